@@ -0,0 +1,152 @@
+"""
+Compare cache codecs: bytes per entry and hit latency (database lookups, the
+in-memory cache is disabled)
+
+    python benchmarks/bench_codecs.py
+    python benchmarks/bench_codecs.py --path ~/.aiutils/cache.db --n 5000
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import argparse
+import random
+import sqlite3
+import statistics
+import time
+
+from aiutils.backends import SQLiteBackend
+from aiutils.cache import APICache
+from aiutils.codecs import Codec, train_dictionary
+
+WORDS = (
+    "the model returned a table with revenue growth for each quarter and the "
+    "assistant summarized the key findings from the annual report including "
+    "risks liabilities and outlook for the next fiscal year"
+).split()
+
+
+def dummy_api_function():
+    pass
+
+
+def synthetic_response(i, rng):
+    content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 400)))
+    completion_tokens = len(content.split())
+
+    return {
+        "id": f"chatcmpl-{rng.getrandbits(96):x}",
+        "choices": [
+            {
+                "finish_reason": "stop",
+                "index": 0,
+                "logprobs": None,
+                "message": {
+                    "content": content,
+                    "role": "assistant",
+                    "function_call": None,
+                    "tool_calls": None,
+                },
+            }
+        ],
+        "created": 1706991533 + i,
+        "model": "gpt-4-0125-preview",
+        "object": "chat.completion",
+        "system_fingerprint": "fp_f084bcfc79",
+        "usage": {
+            "completion_tokens": completion_tokens,
+            "prompt_tokens": 20,
+            "total_tokens": 20 + completion_tokens,
+        },
+    }
+
+
+def load_payloads(path, n):
+    """Load (kwargs, response) pairs from an existing cache database"""
+    backend = SQLiteBackend(path)
+    rows = backend.connection.execute(
+        "SELECT codec, kwargs, response FROM api_calls ORDER BY random() LIMIT ?",
+        (n,),
+    )
+    codecs = {}
+    payloads = []
+
+    for name, kwargs, response in rows:
+        if name not in codecs:
+            codecs[name] = Codec.from_name(name, backend.get_dictionary)
+
+        payloads.append((codecs[name].decode(kwargs), codecs[name].decode(response)))
+
+    return payloads
+
+
+def bench(codec, payloads, tmp, n_lookups):
+    path = Path(tmp, f"{codec.name.replace(':', '-')}.db")
+    my_cache = APICache(
+        api_function=dummy_api_function, path_to_db=path, memory=False, codec=codec
+    )
+
+    for kwargs, response in payloads:
+        my_cache.insert(kwargs=kwargs, response=response)
+
+    (total,) = (
+        sqlite3.connect(path).execute("SELECT SUM(size) FROM api_calls").fetchone()
+    )
+
+    sample = random.Random(0).choices(payloads, k=n_lookups)
+    latencies = []
+
+    for kwargs, _ in sample:
+        start = time.perf_counter()
+        my_cache.lookup(kwargs=kwargs)
+        latencies.append(time.perf_counter() - start)
+
+    return total / len(payloads), statistics.median(latencies) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", help="Sample entries from this database")
+    parser.add_argument("--n", type=int, default=2_000)
+    parser.add_argument("--n-lookups", type=int, default=2_000)
+    args = parser.parse_args()
+
+    if args.path:
+        payloads = load_payloads(args.path, args.n)
+    else:
+        rng = random.Random(0)
+        payloads = [
+            (
+                {"messages": [{"role": "user", "content": f"Question {i}"}]},
+                synthetic_response(i, rng),
+            )
+            for i in range(args.n)
+        ]
+
+    # train on half the entries so the dictionary isn't evaluated on its
+    # training data only
+    dictionary = train_dictionary(
+        [Codec().serialize(r).encode() for _, r in payloads[: len(payloads) // 2]]
+    )
+
+    codecs = [
+        Codec(),
+        Codec(compressor="zlib"),
+        Codec(compressor="zstd"),
+        Codec(compressor="zstd", dictionary=dictionary),
+        Codec(serializer="msgpack"),
+        Codec(serializer="msgpack", compressor="zstd"),
+        Codec(serializer="msgpack", compressor="zstd", dictionary=dictionary),
+    ]
+
+    print(f"{len(payloads):,} entries\n")
+    print(f"{'codec':<32} {'bytes/entry':>12} {'hit latency (us)':>18}")
+
+    with TemporaryDirectory() as tmp:
+        for codec in codecs:
+            size, latency = bench(codec, payloads, tmp, args.n_lookups)
+            name = codec.name.split(":")[0] + (" (dict)" if codec.dictionary else "")
+            print(f"{name:<32} {size:>12,.0f} {latency:>18,.1f}")
+
+
+if __name__ == "__main__":
+    main()
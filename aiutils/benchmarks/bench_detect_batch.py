@@ -0,0 +1,94 @@
+"""
+Compare per-image and batched table detection throughput (CPU by default)
+
+    python benchmarks/bench_detect_batch.py path/to/file.pdf
+    python benchmarks/bench_detect_batch.py path/to/file.pdf --pages 16 \
+        --batch-sizes 1 4 8 --threads 4
+"""
+
+from functools import partial
+import argparse
+import time
+
+import torch
+
+from aiutils.document import Document
+from aiutils.tables import TableDetector, TableStructureDetector, crop_tables
+
+
+def throughput(function, items, repeat):
+    # warm up, the first forward pass allocates buffers
+    function(items[:1])
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        function(items)
+
+    return len(items) * repeat / (time.perf_counter() - start)
+
+
+def report(name, items, detect, detect_batch, batch_sizes, repeat):
+    if not items:
+        print(f"{name}: nothing to detect")
+        return
+
+    baseline = throughput(lambda xs: [detect(x) for x in xs], items, repeat)
+    print(f"{name} ({len(items)} images)")
+    print(f"  per image:      {baseline:6.2f} images/s")
+
+    for batch_size in batch_sizes:
+        batched = throughput(
+            lambda xs: detect_batch(xs, batch_size=batch_size), items, repeat
+        )
+        print(
+            f"  batch_size={batch_size:<3} {batched:6.2f} images/s "
+            f"({batched / baseline:.2f}x)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="PDF to render pages from")
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    print(f"torch {torch.__version__}, {torch.get_num_threads()} threads")
+
+    with Document(args.path) as doc:
+        n_pages = min(args.pages, doc._n_pages)
+        pages = list(doc.iter_page_images(range(n_pages)))
+
+    detector = TableDetector()
+    report(
+        "TableDetector",
+        pages,
+        detector.detect,
+        detector.detect_batch,
+        args.batch_sizes,
+        args.repeat,
+    )
+
+    crops = [
+        crop
+        for page, tables in zip(pages, detector.detect_batch(pages))
+        for crop in crop_tables(page, tables)
+    ]
+    structure = TableStructureDetector()
+    report(
+        "TableStructureDetector",
+        crops,
+        partial(structure.detect, visualize=False),
+        structure.detect_batch,
+        args.batch_sizes,
+        args.repeat,
+    )
+
+
+if __name__ == "__main__":
+    main()
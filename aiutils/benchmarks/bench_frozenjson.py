@@ -0,0 +1,233 @@
+"""
+Compare FrozenJSON with the previous implementation (which copied mappings and
+built new wrappers on every access) and the typed alternatives in aiutils.schema
+on chat completion payloads
+
+    python benchmarks/bench_frozenjson.py
+    python benchmarks/bench_frozenjson.py --path ~/.aiutils/cache.db --n 5000
+"""
+
+from collections.abc import Mapping, MutableSequence
+from typing import Optional
+import argparse
+import keyword
+import time
+import tracemalloc
+
+from pydantic import BaseModel, ConfigDict
+
+from aiutils.backends import SQLiteBackend
+from aiutils.codecs import Codec
+from aiutils.frozenjson import FrozenJSON
+from aiutils.schema import compile_schema, constructor
+
+
+class LegacyFrozenJSON(object):
+    """FrozenJSON before it wrapped objects lazily"""
+
+    def __new__(cls, arg):
+        if isinstance(arg, Mapping):
+            return super(LegacyFrozenJSON, cls).__new__(cls)
+
+        elif isinstance(arg, MutableSequence):
+            return [cls(item) for item in arg]
+        else:
+            return arg
+
+    def __init__(self, mapping):
+        self._path_to_file = None
+
+        self._data = {}
+
+        for key, value in mapping.items():
+            if keyword.iskeyword(key):
+                key += "_"
+
+            self._data[key] = value
+
+    def __getattr__(self, name):
+        if hasattr(self._data, name):
+            return getattr(self._data, name)
+        else:
+            return LegacyFrozenJSON(self._data[name])
+
+
+# the fields of openai's ChatCompletion and ChatCompletionChunk we read
+class Model(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+
+class Message(Model):
+    content: Optional[str] = None
+    role: Optional[str] = None
+
+
+class Choice(Model):
+    index: int
+    message: Message
+
+
+class Usage(Model):
+    completion_tokens: int
+    prompt_tokens: int
+    total_tokens: int
+
+
+class ChatCompletion(Model):
+    id: str
+    choices: list[Choice]
+    usage: Optional[Usage] = None
+
+
+class ChunkChoice(Model):
+    index: int
+    delta: Message
+
+
+class ChatCompletionChunk(Model):
+    id: str
+    choices: list[ChunkChoice]
+
+
+def completion(i):
+    return {
+        "id": f"chatcmpl-{i:024x}",
+        "choices": [
+            {
+                "finish_reason": "stop",
+                "index": 0,
+                "logprobs": None,
+                "message": {
+                    "content": "The table shows revenue by quarter. " * 20,
+                    "role": "assistant",
+                    "function_call": None,
+                    "tool_calls": None,
+                },
+            }
+        ],
+        "created": 1706991533 + i,
+        "model": "gpt-4-0125-preview",
+        "object": "chat.completion",
+        "system_fingerprint": "fp_f084bcfc79",
+        "usage": {"completion_tokens": 140, "prompt_tokens": 20, "total_tokens": 160},
+    }
+
+
+def chunk(i):
+    return {
+        "id": "chatcmpl-8oZ6mQ1MOOQd5kVh3KXYN1bnGZcxt",
+        "choices": [
+            {
+                "delta": {
+                    "content": f" token{i}",
+                    "function_call": None,
+                    "role": None,
+                    "tool_calls": None,
+                },
+                "finish_reason": None,
+                "index": 0,
+                "logprobs": None,
+            }
+        ],
+        "created": 1706991533,
+        "model": "gpt-4-0125-preview",
+        "object": "chat.completion.chunk",
+        "system_fingerprint": "fp_f084bcfc79",
+        "usage": None,
+    }
+
+
+def load_payloads(path, n):
+    """Load non-streamed responses from an existing cache database"""
+    backend = SQLiteBackend(path)
+    rows = backend.connection.execute(
+        "SELECT codec, response FROM api_calls ORDER BY random() LIMIT ?", (n,)
+    )
+    codecs = {}
+    payloads = []
+
+    for name, response in rows:
+        if name not in codecs:
+            codecs[name] = Codec.from_name(name, backend.get_dictionary)
+
+        response = codecs[name].decode(response)
+
+        if isinstance(response, dict) and response.get("choices"):
+            payloads.append(response)
+
+    return payloads
+
+
+def read_completion(types, payload):
+    response = types[0](payload)
+
+    # what code using a response usually does
+    for _ in range(5):
+        response.choices[0].message.content
+        response.usage.total_tokens
+
+
+def read_stream(types, chunks):
+    # reading the content of every chunk of a streamed response
+    return "".join(types[1](c).choices[0].delta.content or "" for c in chunks)
+
+
+def bench(function, types, payloads, repeat):
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        for payload in payloads:
+            function(types, payload)
+
+    elapsed = (time.perf_counter() - start) / (repeat * len(payloads))
+
+    tracemalloc.start()
+
+    for payload in payloads:
+        function(types, payload)
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed * 1e6, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", help="Sample responses from this database")
+    parser.add_argument("--n", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.path:
+        completions = load_payloads(args.path, args.n)
+    else:
+        completions = [completion(i) for i in range(args.n)]
+
+    streams = [[chunk(i) for i in range(200)] for _ in range(10)]
+    implementations = {
+        "LegacyFrozenJSON": (LegacyFrozenJSON, LegacyFrozenJSON),
+        "FrozenJSON": (FrozenJSON, FrozenJSON),
+        "compile_schema": (
+            compile_schema(ChatCompletion),
+            compile_schema(ChatCompletionChunk),
+        ),
+        "constructor": (constructor(ChatCompletion), constructor(ChatCompletionChunk)),
+    }
+
+    for name, function, payloads in (
+        ("completion", read_completion, completions),
+        ("stream (200 chunks)", read_stream, streams),
+    ):
+        print(f"{name}, {len(payloads)} payloads")
+
+        for implementation, types in implementations.items():
+            micros, peak = bench(function, types, payloads, args.repeat)
+            print(
+                f"  {implementation:<17} {micros:9.2f} us/payload, "
+                f"peak {peak:8.1f} KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
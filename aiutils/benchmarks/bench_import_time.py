@@ -0,0 +1,41 @@
+"""
+Show the slowest imports when importing an aiutils module (python -X importtime)
+
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py aiutils.tables --top 30
+"""
+
+import argparse
+import subprocess
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("module", nargs="?", default="aiutils.document")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {args.module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            self_us, cumulative_us, name = line.split("|")
+            self_us = self_us.removeprefix("import time:")
+            rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    rows.sort(reverse=True)
+    print(f"{'cumulative':>12} {'self':>10}  module")
+
+    for cumulative_us, self_us, name in rows[: args.top]:
+        print(f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,7 @@ DEV = [
     "flake8",
     "invoke",
     "twine",
+    "fakeredis",
 ]
 
 setup(
@@ -41,6 +42,6 @@ setup(
         "dev": DEV,
     },
     entry_points={
-        # 'console_scripts': ['aiutils=aiutils.cli:cli'],
+        "console_scripts": ["aiutils=aiutils.cli:cli"],
     },
 )
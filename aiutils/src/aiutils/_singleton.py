@@ -1,14 +0,0 @@
-from threading import Lock
-
-
-# https://refactoring.guru/design-patterns/singleton/python/example
-class SingletonMeta(type):
-    _instances = {}
-    _lock: Lock = Lock()
-
-    def __call__(cls, *args, **kwargs):
-        with cls._lock:
-            if cls not in cls._instances:
-                instance = super().__call__(*args, **kwargs)
-                cls._instances[cls] = instance
-        return cls._instances[cls]
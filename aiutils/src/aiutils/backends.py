@@ -0,0 +1,1042 @@
+"""
+Storage backends for APICache: SQLiteBackend (a local file, the default) and
+RedisBackend (shared by every replica of an application)
+"""
+
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from functools import partial
+from pathlib import Path
+import atexit
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+
+from aiutils.keys import make_key
+
+try:
+    import redis
+except ModuleNotFoundError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+# bump this and append to _MIGRATIONS when changing the schema
+SCHEMA_VERSION = 3
+
+# applied to every connection. WAL lets readers proceed while another
+# connection writes and synchronous=NORMAL is safe in WAL mode (a power loss
+# may roll back the last commits but won't corrupt the database)
+PRAGMAS = {
+    "synchronous": "NORMAL",
+    "busy_timeout": 10_000,
+    "temp_store": "MEMORY",
+    "cache_size": -16_000,
+}
+
+
+Entry = namedtuple(
+    "Entry",
+    [
+        "key",
+        "qualified_name",
+        "kwargs",
+        "response",
+        "created_at",
+        "accessed_at",
+        "expires_at",
+        "size",
+        "codec",
+    ],
+    defaults=("json",),
+)
+
+
+def _table_columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _migrate_to_v1(cursor):
+    """Add a hashed primary key. Databases created before the schema was
+    versioned have an unindexed (qualified_name, kwargs, response) table, we
+    copy those rows over computing their keys
+    """
+    legacy = _table_columns(cursor, "api_calls") == [
+        "qualified_name",
+        "kwargs",
+        "response",
+    ]
+
+    if legacy:
+        cursor.execute("ALTER TABLE api_calls RENAME TO api_calls_v0")
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS api_calls (
+            key TEXT PRIMARY KEY,
+            qualified_name TEXT NOT NULL,
+            kwargs TEXT,
+            response TEXT
+        ) WITHOUT ROWID
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS api_calls_qualified_name
+        ON api_calls (qualified_name)
+    """
+    )
+
+    if legacy:
+        rows = cursor.connection.execute(
+            "SELECT qualified_name, kwargs, response FROM api_calls_v0 ORDER BY rowid"
+        )
+
+        # legacy tables may contain duplicates, keep the first one since that's
+        # the one the old lookup returned
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO api_calls (key, qualified_name, kwargs, response)
+            VALUES (?, ?, ?, ?)
+        """,
+            (
+                (make_key(name, json.loads(kwargs)), name, kwargs, response)
+                for name, kwargs, response in rows
+            ),
+        )
+
+        cursor.execute("DROP TABLE api_calls_v0")
+        logger.info("Migrated legacy cache database to schema version 1.")
+
+
+def _migrate_to_v2(cursor):
+    """Add the columns needed for TTL and LRU eviction"""
+    for column in (
+        "created_at REAL",
+        "accessed_at REAL",
+        "expires_at REAL",
+        "size INTEGER",
+    ):
+        cursor.execute(f"ALTER TABLE api_calls ADD COLUMN {column}")
+
+    now = time.time()
+    cursor.execute(
+        """
+        UPDATE api_calls
+        SET created_at = ?, accessed_at = ?,
+        size = length(CAST(kwargs AS BLOB)) + length(CAST(response AS BLOB))
+    """,
+        (now, now),
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS api_calls_accessed_at
+        ON api_calls (accessed_at)
+    """
+    )
+
+
+def _migrate_to_v3(cursor):
+    """Store the codec used to encode each entry (see aiutils.codecs)"""
+    cursor.execute(
+        "ALTER TABLE api_calls ADD COLUMN codec TEXT NOT NULL DEFAULT 'json'"
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS codec_dictionaries (
+            id TEXT PRIMARY KEY,
+            data BLOB NOT NULL
+        )
+    """
+    )
+
+
+_MIGRATIONS = [_migrate_to_v1, _migrate_to_v2, _migrate_to_v3]
+
+
+def _user_version(cursor):
+    cursor.execute("PRAGMA user_version")
+    return cursor.fetchone()[0]
+
+
+def migrate(connection):
+    """Bring the database schema up to SCHEMA_VERSION"""
+    cursor = connection.cursor()
+
+    if _user_version(cursor) == SCHEMA_VERSION:
+        return
+
+    # take the write lock before reading the version again so two processes
+    # opening the same database don't both run the migrations
+    cursor.execute("BEGIN IMMEDIATE")
+    version = _user_version(cursor)
+
+    if version > SCHEMA_VERSION:
+        connection.rollback()
+        raise RuntimeError(
+            f"Cache database has schema version {version} but this version "
+            f"of aiutils only supports up to {SCHEMA_VERSION}, upgrade aiutils."
+        )
+
+    for migration in _MIGRATIONS[version:]:
+        migration(cursor)
+
+    # PRAGMA does not support parameters but SCHEMA_VERSION is an int
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    connection.commit()
+
+
+def connect(path_to_db, read_only=False):
+    # check_same_thread=False so connections can be closed from any thread,
+    # each one is still only used by the thread that opened it
+    connection = sqlite3.connect(
+        f"{Path(path_to_db).resolve().as_uri()}?mode=ro" if read_only else path_to_db,
+        timeout=PRAGMAS["busy_timeout"] / 1000,
+        check_same_thread=False,
+        uri=read_only,
+    )
+
+    for name, value in PRAGMAS.items():
+        connection.execute(f"PRAGMA {name} = {value}")
+
+    return connection
+
+
+class _ThreadConnection:
+    """Holds a thread's connection in its thread-local data"""
+
+    __slots__ = ("connection", "__weakref__")
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+
+
+class ThreadConnections:
+    """
+    A connection per thread to a database. A thread's connection is closed
+    when the thread exits (its thread-local data is released), so servers that
+    start a thread per request don't accumulate connections. close() closes
+    the remaining ones
+    """
+
+    def __init__(self, path_to_db, read_only=False) -> None:
+        self._path_to_db = path_to_db
+        self._read_only = read_only
+        self._local = threading.local()
+        # close the connection of each thread, they don't reference self
+        self._finalizers = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The connection for the current thread"""
+        holder = getattr(self._local, "holder", None)
+
+        if holder is None:
+            connection = connect(self._path_to_db, read_only=self._read_only)
+            holder = self._local.holder = _ThreadConnection(connection)
+            finalizer = weakref.finalize(holder, holder.connection.close)
+
+            with self._lock:
+                self._finalizers = [f for f in self._finalizers if f.alive]
+                self._finalizers.append(finalizer)
+
+        return holder.connection
+
+    def __len__(self):
+        """Number of open connections"""
+        with self._lock:
+            return sum(finalizer.alive for finalizer in self._finalizers)
+
+    def close(self):
+        with self._lock:
+            for finalizer in self._finalizers:
+                finalizer()
+
+            self._finalizers.clear()
+
+        self._local = threading.local()
+
+
+class _Writer:
+    """
+    Applies writes in a background thread, grouping every write received
+    within flush_interval seconds (or up to max_batch_size writes) of the
+    first one into a single transaction
+    """
+
+    # markers that close the current batch
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, connect, flush_interval, max_batch_size) -> None:
+        self._connect = connect
+        self._flush_interval = flush_interval
+        self._max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        # entries not written yet, so readers can see their own writes
+        self.pending = {}
+        self._pending_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="aiutils-cache-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def set(self, entry):
+        with self._pending_lock:
+            self.pending[entry.key] = entry
+
+        self._queue.put(("set", entry))
+
+    def touch(self, key, accessed_at):
+        self._queue.put(("touch", key, accessed_at))
+
+    def flush(self):
+        """Block until every queued write is committed"""
+        if self._thread.is_alive():
+            self._queue.put(self._FLUSH)
+            self._queue.join()
+
+    def stop(self):
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+        atexit.unregister(self.stop)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._flush_interval
+
+        while (
+            batch[-1] is not self._STOP
+            and batch[-1] is not self._FLUSH
+            and len(batch) < self._max_batch_size
+        ):
+            timeout = deadline - time.monotonic()
+
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        connection = self._connect()
+        stop = False
+
+        while not stop:
+            batch = self._next_batch()
+            stop = batch[-1] is self._STOP
+            writes = [op for op in batch if op not in (self._STOP, self._FLUSH)]
+
+            try:
+                with connection:
+                    for op in writes:
+                        if op[0] == "set":
+                            _insert(connection, op[1])
+                        else:
+                            _touch(connection, *op[1:])
+            except sqlite3.Error:
+                logger.exception("Failed to write %d cache entries.", len(writes))
+
+            with self._pending_lock:
+                for op in writes:
+                    if op[0] == "set" and self.pending.get(op[1].key) is op[1]:
+                        del self.pending[op[1].key]
+
+            for _ in batch:
+                self._queue.task_done()
+
+        connection.close()
+
+
+def _expired(entry, now):
+    return entry.expires_at is not None and entry.expires_at <= now
+
+
+def _insert(connection, entry):
+    connection.execute(
+        """
+        INSERT OR REPLACE INTO api_calls (key, qualified_name, kwargs,
+        response, created_at, accessed_at, expires_at, size, codec)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+        entry,
+    )
+
+
+def _upsert_many(connection, entries):
+    # on conflict, keep the most recently created entry
+    connection.executemany(
+        """
+        INSERT INTO api_calls (key, qualified_name, kwargs, response,
+        created_at, accessed_at, expires_at, size, codec)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET
+            qualified_name = excluded.qualified_name,
+            kwargs = excluded.kwargs,
+            response = excluded.response,
+            created_at = excluded.created_at,
+            accessed_at = excluded.accessed_at,
+            expires_at = excluded.expires_at,
+            size = excluded.size,
+            codec = excluded.codec
+        WHERE excluded.created_at > api_calls.created_at
+    """,
+        entries,
+    )
+
+
+def _touch(connection, key, accessed_at):
+    connection.execute(
+        "UPDATE api_calls SET accessed_at = ? WHERE key = ?", (accessed_at, key)
+    )
+
+
+class Backend(ABC):
+    """
+    Storage for APICache entries. Entries are stored as they are received
+    (kwargs and response are already encoded, see aiutils.codecs) and
+    backends must be safe to share across threads
+    """
+
+    def create_db(self):
+        """Create (or upgrade) the storage, if needed"""
+
+    @abstractmethod
+    def get(self, key, now):
+        """Return the entry for key unless it's missing or expired"""
+
+    def get_many(self, keys, now):
+        """Return the entries for keys, None for missing or expired ones"""
+        return [self.get(key, now) for key in keys]
+
+    @abstractmethod
+    def set(self, entry):
+        """Store entry, replacing any existing one"""
+
+    @abstractmethod
+    def set_many(self, entries):
+        """
+        Store entries. Unlike set, an existing entry is only replaced if the
+        new one was created later
+        """
+
+    @abstractmethod
+    def iter_entries(self, *, qualified_name=None, created_after=None, now=None):
+        """
+        Iterate over the entries that haven't expired, optionally only the ones
+        for a qualified_name or created after a timestamp
+        """
+
+    @abstractmethod
+    def touch(self, key, accessed_at):
+        """Record that key was accessed, used to evict least recently used"""
+
+    def touch_many(self, accesses):
+        """Record many accesses, accesses is an iterable of (key, accessed_at)"""
+        for key, accessed_at in accesses:
+            self.touch(key, accessed_at)
+
+    @abstractmethod
+    def compact(self, now, max_entries=None, max_bytes=None):
+        """
+        Delete expired entries and the least recently used ones over the
+        max_entries or max_bytes budget, returns the deleted keys
+        """
+
+    @abstractmethod
+    def get_dictionary(self, id_):
+        """Return a compression dictionary (see aiutils.codecs) or None"""
+
+    @abstractmethod
+    def set_dictionary(self, id_, data):
+        """Store a compression dictionary, ids are content hashes"""
+
+    def flush(self):
+        """Block until every pending write is stored"""
+
+    def close(self):
+        """Release the backend's resources"""
+
+
+class SQLiteBackend(Backend):
+    """
+    Store cache entries in a SQLite database. The database runs in WAL mode
+    and each thread gets its own connection, so a backend can be shared by
+    threads and many processes can share the same file.
+
+    Parameters
+    ----------
+    path_to_db : str
+        Path to the database, created if it doesn't exist (unless read_only)
+
+    read_only : bool, default=False
+        Open an existing database without writing to it (it isn't created or
+        migrated), e.g., to copy entries from it
+
+    batch_writes : bool, default=False
+        Write in a background thread, committing all writes received within
+        flush_interval seconds in a single transaction. Entries are visible to
+        this backend right away and to other connections after the commit
+
+    flush_interval : float, default=0.05
+        Maximum seconds a write waits before being committed
+
+    max_batch_size : int, default=512
+        Maximum number of writes per transaction
+    """
+
+    def __init__(
+        self,
+        path_to_db,
+        *,
+        read_only=False,
+        batch_writes=False,
+        flush_interval=0.05,
+        max_batch_size=512,
+    ) -> None:
+        self._path_to_db = path_to_db
+        self._read_only = read_only
+        self._writer = None
+        self._connections = ThreadConnections(path_to_db, read_only=read_only)
+
+        if read_only:
+            self._check_schema()
+        else:
+            self.create_db()
+
+        # the writer must not reference self, otherwise its thread would keep
+        # the backend alive
+        self._writer = (
+            _Writer(partial(connect, path_to_db), flush_interval, max_batch_size)
+            if batch_writes
+            else None
+        )
+
+    @property
+    def connection(self):
+        """The connection for the current thread"""
+        return self._connections.get()
+
+    def create_db(self):
+        """Create the database (or upgrade an existing one)"""
+        Path(self._path_to_db).parent.mkdir(parents=True, exist_ok=True)
+        connection = self.connection
+        # the journal mode is stored in the database file
+        connection.execute("PRAGMA journal_mode = WAL")
+        migrate(connection)
+
+    def _check_schema(self):
+        if not Path(self._path_to_db).is_file():
+            raise FileNotFoundError(f"Cache database not found: {self._path_to_db}")
+
+        version = _user_version(self.connection.cursor())
+
+        if version != SCHEMA_VERSION:
+            raise RuntimeError(
+                f"Cache database {self._path_to_db} has schema version "
+                f"{version} but this version of aiutils reads {SCHEMA_VERSION}, "
+                "open it with SQLiteBackend (not read-only) to migrate it."
+            )
+
+    def get(self, key, now):
+        """Return the entry for key unless it's missing or expired"""
+        if self._writer is not None:
+            entry = self._writer.pending.get(key)
+
+            if entry is not None:
+                return None if _expired(entry, now) else entry
+
+        cursor = self.connection.execute(
+            """
+            SELECT key, qualified_name, kwargs, response, created_at,
+            accessed_at, expires_at, size, codec FROM api_calls
+            WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)
+        """,
+            (key, now),
+        )
+        row = cursor.fetchone()
+
+        return None if row is None else Entry(*row)
+
+    def get_many(self, keys, now):
+        entries = {}
+
+        if self._writer is not None:
+            entries.update(
+                (key, self._writer.pending[key])
+                for key in keys
+                if key in self._writer.pending
+            )
+
+        missing = [key for key in keys if key not in entries]
+
+        # stay below SQLite's limit on the number of parameters
+        for i in range(0, len(missing), 500):
+            batch = missing[i : i + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            cursor = self.connection.execute(
+                "SELECT key, qualified_name, kwargs, response, created_at, "
+                "accessed_at, expires_at, size, codec FROM api_calls "
+                f"WHERE key IN ({placeholders})",
+                batch,
+            )
+            entries.update((row[0], Entry(*row)) for row in cursor)
+
+        return [
+            None if entry is None or _expired(entry, now) else entry
+            for entry in map(entries.get, keys)
+        ]
+
+    def set(self, entry):
+        """Store entry, replacing any existing one"""
+        if self._writer is not None:
+            self._writer.set(entry)
+        else:
+            with self.connection as connection:
+                _insert(connection, entry)
+
+    def set_many(self, entries):
+        """
+        Store entries in a single transaction. Unlike set, an existing entry
+        is only replaced if the new one was created later
+        """
+        self.flush()
+
+        with self.connection as connection:
+            _upsert_many(connection, entries)
+
+    def iter_entries(self, *, qualified_name=None, created_after=None, now=None):
+        """
+        Iterate over the entries that haven't expired, optionally only the ones
+        for a qualified_name or created after a timestamp. Rows are fetched in
+        batches so the whole table is never loaded into memory
+        """
+        self.flush()
+        query = (
+            "SELECT key, qualified_name, kwargs, response, created_at, "
+            "accessed_at, expires_at, size, codec FROM api_calls "
+            "WHERE (expires_at IS NULL OR expires_at > ?)"
+        )
+        params = [time.time() if now is None else now]
+
+        if qualified_name is not None:
+            query += " AND qualified_name = ?"
+            params.append(qualified_name)
+
+        if created_after is not None:
+            query += " AND created_at > ?"
+            params.append(created_after)
+
+        # use a dedicated connection so the caller can write while iterating
+        connection = connect(self._path_to_db, read_only=self._read_only)
+
+        try:
+            cursor = connection.execute(query, params)
+
+            while rows := cursor.fetchmany(1_000):
+                for row in rows:
+                    yield Entry(*row)
+        finally:
+            connection.close()
+
+    def touch(self, key, accessed_at):
+        """Record that key was accessed, used to evict least recently used"""
+        if self._writer is not None:
+            self._writer.touch(key, accessed_at)
+        else:
+            with self.connection as connection:
+                _touch(connection, key, accessed_at)
+
+    def touch_many(self, accesses):
+        """Record many accesses in a single transaction"""
+        if self._writer is not None:
+            for key, accessed_at in accesses:
+                self._writer.touch(key, accessed_at)
+        else:
+            with self.connection as connection:
+                connection.executemany(
+                    "UPDATE api_calls SET accessed_at = ? WHERE key = ?",
+                    [(accessed_at, key) for key, accessed_at in accesses],
+                )
+
+    def compact(self, now, max_entries=None, max_bytes=None):
+        """
+        Delete expired entries and the least recently used ones over the
+        max_entries or max_bytes budget, returns the deleted keys
+        """
+        self.flush()
+        deleted = []
+
+        with self.connection as connection:
+            deleted += connection.execute(
+                "DELETE FROM api_calls "
+                "WHERE expires_at IS NOT NULL AND expires_at <= ? RETURNING key",
+                (now,),
+            ).fetchall()
+
+            if max_entries is not None:
+                deleted += connection.execute(
+                    """
+                    DELETE FROM api_calls WHERE key IN (
+                        SELECT key FROM api_calls
+                        ORDER BY accessed_at DESC, key
+                        LIMIT -1 OFFSET ?
+                    ) RETURNING key
+                """,
+                    (max_entries,),
+                ).fetchall()
+
+            if max_bytes is not None:
+                deleted += connection.execute(
+                    """
+                    DELETE FROM api_calls WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size) OVER (
+                                ORDER BY accessed_at DESC, key
+                            ) AS total
+                            FROM api_calls
+                        )
+                        WHERE total > ?
+                    ) RETURNING key
+                """,
+                    (max_bytes,),
+                ).fetchall()
+
+        return [key for (key,) in deleted]
+
+    def get_dictionary(self, id_):
+        """Return a compression dictionary (see aiutils.codecs) or None"""
+        cursor = self.connection.execute(
+            "SELECT data FROM codec_dictionaries WHERE id = ?", (id_,)
+        )
+        row = cursor.fetchone()
+        return None if row is None else row[0]
+
+    def set_dictionary(self, id_, data):
+        with self.connection as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO codec_dictionaries (id, data) VALUES (?, ?)",
+                (id_, data),
+            )
+
+    def flush(self):
+        """Block until every pending write is committed"""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.stop()
+
+        self._connections.close()
+
+    def __del__(self):
+        self.close()
+
+
+def _to_bytes(data):
+    """Return (data as bytes, whether it was a str)"""
+    if isinstance(data, str):
+        return data.encode("utf-8"), True
+
+    return bytes(data), False
+
+
+def _pack(entry):
+    """Serialize an entry (except key and accessed_at) to a single value"""
+    kwargs, kwargs_is_str = _to_bytes(entry.kwargs)
+    response, response_is_str = _to_bytes(entry.response)
+    header = json.dumps(
+        [
+            entry.qualified_name,
+            entry.created_at,
+            entry.expires_at,
+            entry.size,
+            entry.codec,
+            len(kwargs),
+            kwargs_is_str,
+            response_is_str,
+        ]
+    )
+    # JSON escapes newlines, so the first one ends the header
+    return header.encode("utf-8") + b"\n" + kwargs + response
+
+
+def _unpack_header(data):
+    header, _, payload = data.partition(b"\n")
+    return json.loads(header), payload
+
+
+def _unpack(key, data, accessed_at):
+    header, payload = _unpack_header(data)
+    (
+        qualified_name,
+        created_at,
+        expires_at,
+        size,
+        codec,
+        n_kwargs,
+        kwargs_is_str,
+        response_is_str,
+    ) = header
+    kwargs, response = payload[:n_kwargs], payload[n_kwargs:]
+
+    return Entry(
+        key=key,
+        qualified_name=qualified_name,
+        kwargs=kwargs.decode("utf-8") if kwargs_is_str else kwargs,
+        response=response.decode("utf-8") if response_is_str else response,
+        created_at=created_at,
+        accessed_at=created_at if accessed_at is None else accessed_at,
+        expires_at=expires_at,
+        size=size,
+        codec=codec,
+    )
+
+
+class RedisBackend(Backend):
+    """
+    Store cache entries in Redis (or a server speaking its protocol, e.g.,
+    Valkey) so every replica of an application shares the same cache.
+
+    Each entry is a single Redis string, so lookups are a GET (or an MGET in
+    get_many) and writes are pipelined. Entries with an expiration get a
+    Redis TTL, access times and sizes are kept in a sorted set and a hash so
+    compact can evict the least recently used entries
+
+    Parameters
+    ----------
+    client : str or redis.Redis
+        A Redis URL (e.g., "redis://localhost:6379/0") or a client. Clients
+        must be created with decode_responses=False
+
+    prefix : str, default="aiutils:"
+        Prepended to every Redis key, to share a server with other
+        applications (or keep several caches in one)
+
+    batch_size : int, default=500
+        Maximum number of entries per pipeline when writing or scanning many
+        entries
+    """
+
+    def __init__(self, client, *, prefix="aiutils:", batch_size=500) -> None:
+        self._owns_client = isinstance(client, str)
+
+        if self._owns_client:
+            if redis is None:
+                raise ModuleNotFoundError(
+                    "redis is required to use RedisBackend, install it with: "
+                    "pip install redis"
+                )
+
+            client = redis.Redis.from_url(client)
+
+        self._client = client
+        self._prefix = prefix
+        self._batch_size = batch_size
+        # key -> accessed_at, key -> size and key -> expires_at
+        self._accessed = f"{prefix}accessed"
+        self._sizes = f"{prefix}sizes"
+        self._expires = f"{prefix}expires"
+
+    def _name(self, key):
+        return f"{self._prefix}entry:{key}"
+
+    def get(self, key, now):
+        return self.get_many([key], now)[0]
+
+    def get_many(self, keys, now):
+        if not keys:
+            return []
+
+        pipeline = self._client.pipeline(transaction=False)
+        pipeline.mget([self._name(key) for key in keys])
+        pipeline.zmscore(self._accessed, keys)
+        values, accessed = pipeline.execute()
+        entries = []
+
+        for key, data, accessed_at in zip(keys, values, accessed):
+            entry = None if data is None else _unpack(key, data, accessed_at)
+            # Redis TTLs have a resolution of a millisecond, check again
+            expired = entry is not None and _expired(entry, now)
+            entries.append(None if expired else entry)
+
+        return entries
+
+    def _set(self, pipeline, entry):
+        kwargs = {}
+
+        if entry.expires_at is not None:
+            # the TTL counts from the write, entries are written right after
+            # being created
+            ttl = entry.expires_at - entry.created_at
+            kwargs["px"] = max(int(ttl * 1000), 1)
+            pipeline.zadd(self._expires, {entry.key: entry.expires_at})
+        else:
+            pipeline.zrem(self._expires, entry.key)
+
+        pipeline.set(self._name(entry.key), _pack(entry), **kwargs)
+        pipeline.zadd(self._accessed, {entry.key: entry.accessed_at})
+        pipeline.hset(self._sizes, entry.key, entry.size)
+
+    def set(self, entry):
+        pipeline = self._client.pipeline(transaction=False)
+        self._set(pipeline, entry)
+        pipeline.execute()
+
+    def set_many(self, entries):
+        batch = []
+
+        for entry in entries:
+            batch.append(entry)
+
+            if len(batch) == self._batch_size:
+                self._set_newer(batch)
+                batch = []
+
+        if batch:
+            self._set_newer(batch)
+
+    def _set_newer(self, entries):
+        # last one wins within the batch, like an upsert
+        newest = {}
+
+        for entry in entries:
+            current = newest.get(entry.key)
+
+            if current is None or entry.created_at > current.created_at:
+                newest[entry.key] = entry
+
+        existing = self._client.mget([self._name(key) for key in newest])
+        pipeline = self._client.pipeline(transaction=False)
+
+        for entry, data in zip(newest.values(), existing):
+            if data is None or entry.created_at > _unpack_header(data)[0][1]:
+                self._set(pipeline, entry)
+
+        pipeline.execute()
+
+    def iter_entries(self, *, qualified_name=None, created_after=None, now=None):
+        now = time.time() if now is None else now
+        offset = len(self._name(""))
+        # SCAN may return a key more than once
+        seen = set()
+        batch = []
+
+        def entries(batch):
+            for entry in self.get_many(batch, now):
+                if (
+                    entry is not None
+                    and (
+                        qualified_name is None or entry.qualified_name == qualified_name
+                    )
+                    and (created_after is None or entry.created_at > created_after)
+                ):
+                    yield entry
+
+        for name in self._client.scan_iter(
+            match=self._name("*"), count=self._batch_size
+        ):
+            key = name[offset:].decode("utf-8")
+
+            if key in seen:
+                continue
+
+            seen.add(key)
+            batch.append(key)
+
+            if len(batch) == self._batch_size:
+                yield from entries(batch)
+                batch = []
+
+        yield from entries(batch)
+
+    def touch(self, key, accessed_at):
+        # xx=True so we don't resurrect the metadata of a deleted entry
+        self._client.zadd(self._accessed, {key: accessed_at}, xx=True)
+
+    def touch_many(self, accesses):
+        accesses = dict(accesses)
+
+        if accesses:
+            self._client.zadd(self._accessed, accesses, xx=True)
+
+    def _delete(self, keys):
+        for i in range(0, len(keys), self._batch_size):
+            batch = keys[i : i + self._batch_size]
+            pipeline = self._client.pipeline(transaction=False)
+            pipeline.delete(*(self._name(key) for key in batch))
+            pipeline.zrem(self._accessed, *batch)
+            pipeline.zrem(self._expires, *batch)
+            pipeline.hdel(self._sizes, *batch)
+            pipeline.execute()
+
+    def compact(self, now, max_entries=None, max_bytes=None):
+        # Redis deletes expired entries, but not their metadata
+        expired = [
+            key.decode("utf-8")
+            for key in self._client.zrangebyscore(self._expires, "-inf", now)
+        ]
+        self._delete(expired)
+
+        if max_entries is None and max_bytes is None:
+            return expired
+
+        n_entries, n_bytes, evict, start = 0, 0, [], 0
+
+        # walk from the most recently used, in batches
+        while keys := self._client.zrange(
+            self._accessed, start, start + self._batch_size - 1, desc=True
+        ):
+            start += len(keys)
+            keys = [key.decode("utf-8") for key in keys]
+            pipeline = self._client.pipeline(transaction=False)
+            pipeline.hmget(self._sizes, keys)
+
+            for key in keys:
+                pipeline.exists(self._name(key))
+
+            sizes, *exists = pipeline.execute()
+
+            for key, size, exists_ in zip(keys, sizes, exists):
+                # the server may have evicted it (e.g., maxmemory-policy),
+                # clean up its metadata
+                if not exists_:
+                    evict.append(key)
+                    continue
+
+                n_entries += 1
+                n_bytes += int(size)
+
+                if (max_entries is not None and n_entries > max_entries) or (
+                    max_bytes is not None and n_bytes > max_bytes
+                ):
+                    evict.append(key)
+
+        self._delete(evict)
+        return expired + evict
+
+    def get_dictionary(self, id_):
+        return self._client.get(f"{self._prefix}dictionary:{id_}")
+
+    def set_dictionary(self, id_, data):
+        self._client.set(f"{self._prefix}dictionary:{id_}", data, nx=True)
+
+    def close(self):
+        if self._owns_client:
+            self._client.close()
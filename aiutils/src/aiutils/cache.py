@@ -1,99 +1,578 @@
-from pathlib import Path
-import sqlite3
-import json
+from collections import Counter
+from concurrent.futures import Future
+import asyncio
 import logging
+import threading
+import time
 
 from aiutils import CACHE_PATH
+from aiutils.backends import SQLiteBackend, Entry, SCHEMA_VERSION  # noqa: F401
+from aiutils.codecs import Codec, DEFAULT_CODEC, dictionary_id, encoded_size
 from aiutils.frozenjson import FrozenJSON
+from aiutils.keys import canonical_kwargs, make_key  # noqa: F401
+from aiutils.lru import LRUCache
+from aiutils.metrics import METRICS
 
 logger = logging.getLogger(__name__)
 
 
+# only record a new access time if the stored one is older than this (seconds),
+# otherwise every hit would be a write
+ACCESS_RESOLUTION = 60
+
+# when a size budget is set or entries expire, compact after this many inserts
+COMPACT_EVERY = 100
+
+
+# metrics outcome -> stats key
+_STATS = dict(hit="hits", near_hit="near_hits", miss="misses")
+
+
 def qualified_name(obj):
     return obj.__module__ + "." + obj.__qualname__
 
 
 class APICache:
-    def __init__(self, api_function, path_to_db=None) -> None:
+    """
+    Cache API responses in a SQLite database.
+
+    Calls with stream=True are recorded chunk by chunk as they arrive and
+    replayed as a generator of chunks on a hit. A stream is only stored once
+    it has been fully consumed.
+
+    Parameters
+    ----------
+    api_function : callable
+        The function to cache, must return a pydantic model (or an iterable of
+        them when called with stream=True)
+
+    path_to_db : str, optional
+        Path to the database, defaults to ~/.aiutils/cache.db. Ignored if a
+        backend is passed (except by the semantic index)
+
+    ttl : float, optional
+        Seconds before an entry expires, entries never expire by default.
+        Expired entries are deleted from the database every COMPACT_EVERY
+        inserts
+
+    memory : bool or LRUCache, default=True
+        Keep recently used responses in memory, in front of the database.
+        Pass an LRUCache to configure its size, or False to disable it
+
+    max_entries : int, optional
+        Maximum number of entries in the database, least recently used
+        entries are evicted first
+
+    max_bytes : int, optional
+        Maximum size of the stored kwargs and responses in the database
+
+    stream_pace : float, optional
+        Seconds to wait between chunks when replaying a cached stream. By
+        default, all chunks are replayed immediately
+
+    semantic : aiutils.semantic.SemanticIndex, optional
+        If passed, an exact miss falls back to the response of the most
+        similar cached call (a near hit), if it's similar enough
+
+    batch_writes : bool, default=False
+        Write to the database from a background thread, grouping writes into
+        fewer transactions. See aiutils.backends.SQLiteBackend
+
+    backend : aiutils.backends.Backend, optional
+        Where to store entries, defaults to a SQLiteBackend at path_to_db. Use
+        a RedisBackend to share the cache across replicas
+
+    codec : aiutils.codecs.Codec, optional
+        Codec to encode new entries, defaults to uncompressed JSON. Existing
+        entries are decoded with the codec they were written with
+
+    metrics : aiutils.metrics.CacheMetrics, optional
+        Where to record hits, misses, latencies, stored bytes and savings,
+        defaults to aiutils.metrics.METRICS (shared by every cache)
+
+    response_type : callable, optional
+        Builds the object returned from a response (a dictionary), defaults to
+        FrozenJSON. Use aiutils.schema.compile_schema(Model) for typed
+        attribute access or aiutils.schema.constructor(Model) to get the
+        pydantic model back without validating it
+
+    chunk_type : callable, optional
+        Like response_type, for the chunks of streams
+
+    Attributes
+    ----------
+    stats : collections.Counter
+        Number of hits, near_hits and misses
+    """
+
+    def __init__(
+        self,
+        api_function,
+        path_to_db=None,
+        *,
+        ttl=None,
+        memory=True,
+        max_entries=None,
+        max_bytes=None,
+        stream_pace=None,
+        semantic=None,
+        batch_writes=False,
+        codec=None,
+        metrics=None,
+        backend=None,
+        response_type=None,
+        chunk_type=None,
+    ) -> None:
         self._path_to_db = path_to_db or CACHE_PATH
-        self._connection = None
         self._api_function = api_function
         self._qualified_name = qualified_name(api_function)
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._stream_pace = stream_pace
+        self._semantic = semantic
+        self._codec = codec or DEFAULT_CODEC
+        self._codecs = {self._codec.name: self._codec}
+        self._inserts_since_compact = 0
+        # memory hits since the last flush, key -> access time
+        self._accesses = {}
+        self._accesses_flushed_at = time.time()
+        self._accesses_lock = threading.Lock()
+        self.stats = Counter()
+        self.metrics = METRICS if metrics is None else metrics
+        self._response_type = response_type or FrozenJSON
+        self._chunk_type = chunk_type or FrozenJSON
 
-        if not Path(self._path_to_db).exists():
-            self.create_db()
+        if memory is True:
+            self._memory = LRUCache(max_entries=1024, max_bytes=64 * 1024**2)
+        else:
+            self._memory = memory or None
+
+        if backend is None:
+            backend = SQLiteBackend(self._path_to_db, batch_writes=batch_writes)
+        elif batch_writes:
+            raise ValueError(
+                "batch_writes only applies to the default backend, "
+                "configure the backend you're passing instead"
+            )
+
+        self._backend = backend
+
+        # store the dictionary so other processes can decode our entries
+        if self._codec.dictionary is not None:
+            self._backend.set_dictionary(
+                dictionary_id(self._codec.dictionary), self._codec.dictionary
+            )
+
+        if self._semantic is not None:
+            self._semantic.connect(self._path_to_db)
 
     @property
     def connection(self):
-        if self._connection is None:
-            self._connection = sqlite3.connect(self._path_to_db)
+        """The database connection for the current thread (SQLite only)"""
+        return self._backend.connection
 
-        return self._connection
+    def create_db(self):
+        """Create the database (or upgrade an existing one)"""
+        self._backend.create_db()
 
-    def __del__(self):
-        if self._connection is not None:
-            self._connection.close()
+    def flush(self):
+        """Block until every pending write is committed"""
+        self._backend.flush()
 
-    def create_db(self):
-        Path(self._path_to_db).parent.mkdir(parents=True, exist_ok=True)
-        cursor = self.connection.cursor()
-
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS api_calls (
-                qualified_name TEXT,
-                kwargs TEXT,
-                response TEXT
+    def key(self, kwargs: dict) -> str:
+        return make_key(self._qualified_name, kwargs)
+
+    def _get_codec(self, name):
+        codec = self._codecs.get(name)
+
+        if codec is None:
+            codec = Codec.from_name(name, get_dictionary=self._backend.get_dictionary)
+            self._codecs[name] = codec
+
+        return codec
+
+    @property
+    def _evicts(self):
+        return self._max_entries is not None or self._max_bytes is not None
+
+    def insert(self, *, kwargs: dict, response: dict, ttl=None):
+        """Store a response, ttl overrides the cache's default for this entry"""
+        self._insert(self.key(kwargs), kwargs, response, ttl=ttl)
+
+    def _insert(self, key, kwargs, response, ttl=None):
+        ttl = ttl if ttl is not None else self._ttl
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        kwargs_encoded = self._codec.encode(kwargs)
+        response_encoded = self._codec.encode(response)
+        size = encoded_size(kwargs_encoded) + encoded_size(response_encoded)
+
+        # kwargs are only stored for auditing, lookups use the key
+        self._backend.set(
+            Entry(
+                key=key,
+                qualified_name=self._qualified_name,
+                kwargs=kwargs_encoded,
+                response=response_encoded,
+                created_at=now,
+                accessed_at=now,
+                expires_at=expires_at,
+                size=size,
+                codec=self._codec.name,
             )
-        """
         )
+        self.metrics.record_store(self._qualified_name, size)
 
-        self.connection.commit()
-
-    def insert(self, *, kwargs: dict, response: dict):
-        cursor = self.connection.cursor()
-
-        cursor.execute(
-            """
-            INSERT INTO api_calls (qualified_name, kwargs, response)
-            VALUES (?, ?, ?)
-        """,
-            (
-                self._qualified_name,
-                json.dumps(kwargs),
-                json.dumps(response),
-            ),
-        )
+        if self._memory is not None:
+            self._memory.set(key, response, size=size, expires_at=expires_at)
+
+        if self._semantic is not None:
+            query = self._semantic.encode(self._qualified_name, kwargs)
+
+            if query is not None:
+                self._semantic.add(query, key)
+
+        # expired entries are only deleted when compacting
+        if self._evicts or expires_at is not None:
+            self._inserts_since_compact += 1
 
-        self.connection.commit()
+            if self._inserts_since_compact >= COMPACT_EVERY:
+                self.compact()
 
     def lookup(self, *, kwargs: dict):
-        cursor = self.connection.cursor()
-
-        cursor.execute(
-            """
-            SELECT response FROM api_calls
-            WHERE qualified_name = ? AND kwargs = ?
-        """,
-            (self._qualified_name, json.dumps(kwargs)),
+        """
+        Return the cached response or None. Responses may be shared with the
+        in-memory cache, so they must not be modified
+        """
+        return self._lookup(self.key(kwargs))
+
+    def lookup_many(self, *, kwargs_list):
+        """
+        Like lookup, for many calls at once. Calls not in memory are fetched
+        from the backend together (e.g., a single MGET with RedisBackend)
+        """
+        keys = [self.key(kwargs) for kwargs in kwargs_list]
+        responses = [
+            None if self._memory is None else self._memory.get(key) for key in keys
+        ]
+        missing = [i for i, response in enumerate(responses) if response is None]
+        now = time.time()
+
+        if self._evicts:
+            self._record_accesses(
+                [key for key, response in zip(keys, responses) if response is not None],
+                now,
+            )
+
+        entries = self._backend.get_many([keys[i] for i in missing], now)
+
+        for i, entry in zip(missing, entries):
+            if entry is not None:
+                responses[i] = self._load(entry, now)
+
+        return responses
+
+    def _lookup(self, key):
+        if self._memory is not None:
+            response = self._memory.get(key)
+
+            if response is not None:
+                if self._evicts:
+                    self._record_accesses([key], time.time())
+
+                return response
+
+        now = time.time()
+        entry = self._backend.get(key, now)
+
+        return None if entry is None else self._load(entry, now)
+
+    def _load(self, entry, now):
+        """Decode an entry from the backend, and keep it in memory"""
+        key = entry.key
+        response = self._get_codec(entry.codec).decode(entry.response)
+
+        if self._evicts and now - entry.accessed_at > ACCESS_RESOLUTION:
+            self._backend.touch(key, now)
+
+        if self._memory is not None:
+            self._memory.set(
+                key, response, size=entry.size, expires_at=entry.expires_at
+            )
+
+        return response
+
+    def _record_accesses(self, keys, now):
+        """
+        Record hits served from memory, they're written to the backend at most
+        once every ACCESS_RESOLUTION seconds so compact() doesn't evict them
+        """
+        with self._accesses_lock:
+            for key in keys:
+                self._accesses[key] = now
+
+            if now - self._accesses_flushed_at <= ACCESS_RESOLUTION:
+                return
+
+        self._flush_accesses(now)
+
+    def _flush_accesses(self, now):
+        with self._accesses_lock:
+            accesses, self._accesses = self._accesses, {}
+            self._accesses_flushed_at = now
+
+        if accesses:
+            self._backend.touch_many(accesses.items())
+
+    def compact(self):
+        """
+        Delete expired entries and, if the cache is over its max_entries or
+        max_bytes budget, the least recently used ones
+        """
+        now = time.time()
+        self._inserts_since_compact = 0
+        self._flush_accesses(now)
+        deleted = self._backend.compact(
+            now, max_entries=self._max_entries, max_bytes=self._max_bytes
+        )
+
+        if self._memory is not None:
+            for key in deleted:
+                self._memory.delete(key)
+
+        if self._semantic is not None:
+            self._semantic.remove(deleted)
+
+    def _record_lookup(self, outcome, start, response=None):
+        self.stats[_STATS[outcome]] += 1
+        self.metrics.record_lookup(
+            self._qualified_name, outcome, time.perf_counter() - start, response
         )
 
-        response = cursor.fetchone()
+    def _record_upstream(self, start):
+        self.metrics.record_upstream(self._qualified_name, time.perf_counter() - start)
+
+    def _cached_response(self, key, kwargs):
+        """Look up a response by key, falling back to the semantic index"""
+        start = time.perf_counter()
+        response = self._lookup(key)
+
+        if response is not None:
+            self._record_lookup("hit", start, response)
+            logger.info("Cache hit, using cached response.")
+            return response
+
+        if self._semantic is not None:
+            query = self._semantic.encode(self._qualified_name, kwargs)
+
+            if query is not None:
+                # the most similar calls might have been evicted, try the next
+                evicted = []
+
+                for near_key, similarity in self._semantic.search_many(query):
+                    response = self._lookup(near_key)
+
+                    if response is None:
+                        evicted.append(near_key)
+                        continue
+
+                    self._semantic.remove(evicted)
+                    self._record_lookup("near_hit", start, response)
+                    logger.info(
+                        "Cache near hit (similarity: %.3f), using cached response.",
+                        similarity,
+                    )
+                    return response
 
-        return None if response is None else json.loads(response[0])
+                self._semantic.remove(evicted)
+
+        self._record_lookup("miss", start)
+        return None
+
+    def _call_api(self, key, kwargs):
+        logger.info("Cache miss, calling API.")
+        start = time.perf_counter()
+        response = self._api_function(**kwargs).model_dump()
+        self._record_upstream(start)
+        self._insert(key, kwargs, response)
+        return response
+
+    def _call_api_stream(self, key, kwargs):
+        logger.info("Cache miss, calling API.")
+        start = time.perf_counter()
+        return self._record(key, kwargs, self._api_function(**kwargs), start)
+
+    def _record(self, key, kwargs, stream, start):
+        chunks = []
+
+        for chunk in stream:
+            chunk = chunk.model_dump()
+            chunks.append(chunk)
+            yield self._chunk_type(chunk)
+
+        # only reached if the caller consumed the whole stream
+        self._record_upstream(start)
+        self._insert(key, kwargs, chunks)
+
+    def _replay(self, chunks):
+        for i, chunk in enumerate(chunks):
+            if self._stream_pace and i:
+                time.sleep(self._stream_pace)
+
+            yield self._chunk_type(chunk)
+
+    def _stream(self, key, kwargs):
+        chunks = self._cached_response(key, kwargs)
+
+        if chunks is None:
+            return self._call_api_stream(key, kwargs)
+
+        return self._replay(chunks)
 
     def __call__(self, **kwargs):
-        response = self.lookup(kwargs=kwargs)
+        key = self.key(kwargs)
+
+        if kwargs.get("stream"):
+            return self._stream(key, kwargs)
+
+        response = self._cached_response(key, kwargs)
 
         if response is None:
-            logger.info("Cache miss, calling API.")
-            response = self._api_function(**kwargs).model_dump()
-            self.insert(
-                kwargs=kwargs,
-                response=response,
-            )
+            response = self._call_api(key, kwargs)
+
+        return self._response_type(response)
+
+
+class ThreadSafeAPICache(APICache):
+    """
+    An APICache where concurrent misses on the same kwargs are coalesced: the
+    first caller hits the API and the rest wait for its response. Streams
+    (stream=True) are not coalesced
+    """
+
+    def __init__(self, api_function, path_to_db=None, **kwargs) -> None:
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        super().__init__(api_function, path_to_db=path_to_db, **kwargs)
+
+    def __call__(self, **kwargs):
+        key = self.key(kwargs)
+
+        if kwargs.get("stream"):
+            return self._stream(key, kwargs)
+
+        response = self._cached_response(key, kwargs)
+
+        if response is not None:
+            return self._response_type(response)
+
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not leader:
+            logger.info("Cache miss, waiting for in-flight API call.")
+            return self._response_type(future.result())
+
+        try:
+            # the previous leader might have finished after our lookup
+            response = self._lookup(key)
+
+            if response is None:
+                response = self._call_api(key, kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
         else:
-            logger.info("Cache hit, using cached response.")
+            future.set_result(response)
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+
+        return self._response_type(response)
+
+
+class AsyncAPICache(APICache):
+    """
+    An APICache for async API functions (e.g., AsyncOpenAI). Concurrent misses
+    on the same kwargs await a single API call. Database access is synchronous,
+    each lookup is a single primary key read so it doesn't block the event loop
+    for long.
+
+    Like AsyncOpenAI, awaiting a call with stream=True returns an async
+    generator of chunks. Streams are not coalesced
+    """
+
+    def __init__(self, api_function, path_to_db=None, **kwargs) -> None:
+        self._in_flight = {}
+        super().__init__(api_function, path_to_db=path_to_db, **kwargs)
+
+    async def _call_api(self, key, kwargs):
+        logger.info("Cache miss, calling API.")
+        start = time.perf_counter()
+        response = (await self._api_function(**kwargs)).model_dump()
+        self._record_upstream(start)
+        self._insert(key, kwargs, response)
+        return response
+
+    async def _call_api_stream(self, key, kwargs):
+        logger.info("Cache miss, calling API.")
+        start = time.perf_counter()
+        stream = await self._api_function(**kwargs)
+        return self._record(key, kwargs, stream, start)
+
+    async def _record(self, key, kwargs, stream, start):
+        chunks = []
+
+        async for chunk in stream:
+            chunk = chunk.model_dump()
+            chunks.append(chunk)
+            yield self._chunk_type(chunk)
+
+        self._record_upstream(start)
+        self._insert(key, kwargs, chunks)
+
+    async def _replay(self, chunks):
+        for i, chunk in enumerate(chunks):
+            if self._stream_pace and i:
+                await asyncio.sleep(self._stream_pace)
+
+            yield self._chunk_type(chunk)
+
+    async def _stream(self, key, kwargs):
+        chunks = self._cached_response(key, kwargs)
+
+        if chunks is None:
+            return await self._call_api_stream(key, kwargs)
+
+        return self._replay(chunks)
+
+    async def __call__(self, **kwargs):
+        key = self.key(kwargs)
+
+        if kwargs.get("stream"):
+            return await self._stream(key, kwargs)
+
+        response = self._cached_response(key, kwargs)
+
+        if response is not None:
+            return self._response_type(response)
+
+        # tasks belong to a loop, so we can only share them within the same one
+        in_flight_key = (asyncio.get_running_loop(), key)
+        task = self._in_flight.get(in_flight_key)
+
+        if task is None:
+            task = asyncio.ensure_future(self._call_api(key, kwargs))
+            self._in_flight[in_flight_key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(in_flight_key, None))
+        else:
+            logger.info("Cache miss, waiting for in-flight API call.")
 
-        # return FrozenJSON(response) to enable attribute access
-        return FrozenJSON(response)
+        # shield the shared call so cancelling one caller doesn't cancel the rest
+        return self._response_type(await asyncio.shield(task))
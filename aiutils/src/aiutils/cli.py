@@ -0,0 +1,122 @@
+"""
+Command line interface, run aiutils --help for details
+"""
+
+import argparse
+
+from aiutils import CACHE_PATH
+from aiutils import codecs, snapshot
+
+
+def _recompress(args):
+    codec = codecs.Codec.from_name(args.codec, level=args.level)
+    summary = codecs.recompress(
+        args.path,
+        codec,
+        train=args.train_dictionary,
+        dictionary_size=args.dictionary_size,
+        vacuum=not args.no_vacuum,
+    )
+
+    print(
+        f"Re-encoded {summary['entries']:,} entries with {summary['codec']}. "
+        f"Entries: {summary['entries_bytes_before']:,} -> "
+        f"{summary['entries_bytes_after']:,} bytes. "
+        f"File: {summary['file_bytes_before']:,} -> "
+        f"{summary['file_bytes_after']:,} bytes."
+    )
+
+
+def _export(args):
+    count = snapshot.export_entries(
+        args.path_to_db,
+        args.path,
+        qualified_name=args.qualified_name,
+        max_age=args.max_age,
+    )
+    print(f"Exported {count:,} entries to {args.path}.")
+
+
+def _import(args):
+    count = snapshot.import_entries(
+        args.path,
+        args.path_to_db,
+        codec=codecs.Codec.from_name(args.codec),
+        qualified_name=args.qualified_name,
+        max_age=args.max_age,
+    )
+    print(f"Imported {count:,} entries into {args.path_to_db}.")
+
+
+def _merge(args):
+    count = snapshot.merge(
+        args.source,
+        args.path_to_db,
+        qualified_name=args.qualified_name,
+        max_age=args.max_age,
+    )
+    print(f"Merged {count:,} entries into {args.path_to_db}.")
+
+
+def _add_filters(parser):
+    parser.add_argument(
+        "--qualified-name", help="Only entries for this function, e.g., module.func"
+    )
+    parser.add_argument(
+        "--max-age", type=float, help="Only entries created in the last N seconds"
+    )
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog="aiutils")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    recompress = subparsers.add_parser(
+        "recompress",
+        help="Re-encode the entries of a cache database with another codec",
+    )
+    recompress.add_argument("path", nargs="?", default=str(CACHE_PATH))
+    recompress.add_argument(
+        "--codec", default="json+zstd", help="e.g., json, msgpack+zlib, json+zstd"
+    )
+    recompress.add_argument("--level", type=int, default=None)
+    recompress.add_argument(
+        "--train-dictionary",
+        action="store_true",
+        help="Train a zstd dictionary on the existing entries",
+    )
+    recompress.add_argument("--dictionary-size", type=int, default=16 * 1024)
+    recompress.add_argument("--no-vacuum", action="store_true")
+    recompress.set_defaults(func=_recompress)
+
+    export = subparsers.add_parser(
+        "export", help="Export cache entries to a .jsonl or .parquet file"
+    )
+    export.add_argument("path")
+    export.add_argument("--path-to-db", default=str(CACHE_PATH))
+    _add_filters(export)
+    export.set_defaults(func=_export)
+
+    import_ = subparsers.add_parser(
+        "import", help="Import cache entries from a .jsonl or .parquet file"
+    )
+    import_.add_argument("path")
+    import_.add_argument("--path-to-db", default=str(CACHE_PATH))
+    import_.add_argument("--codec", default="json")
+    _add_filters(import_)
+    import_.set_defaults(func=_import)
+
+    merge = subparsers.add_parser(
+        "merge", help="Copy the entries of another cache database into this one"
+    )
+    merge.add_argument("source")
+    merge.add_argument("--path-to-db", default=str(CACHE_PATH))
+    _add_filters(merge)
+    merge.set_defaults(func=_merge)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    cli()
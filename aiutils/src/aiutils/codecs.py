@@ -0,0 +1,301 @@
+"""
+Codecs to serialize and compress cache entries. The codec name is stored with
+every entry so entries written with different codecs can coexist in the same
+database.
+
+Names look like: json, msgpack+zlib, json+zstd, json+zstd:<dictionary id>
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import threading
+import zlib
+
+from aiutils.backends import SQLiteBackend
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+try:
+    import msgpack
+except ModuleNotFoundError:
+    msgpack = None
+
+
+def _requires(module, name):
+    if module is None:
+        raise ModuleNotFoundError(
+            f"{name} is required to use this codec, install it with: "
+            f"pip install {name}"
+        )
+
+
+def dictionary_id(dictionary):
+    return hashlib.blake2b(dictionary, digest_size=8).hexdigest()
+
+
+def train_dictionary(samples, size=16 * 1024):
+    """Train a zstd dictionary from a list of serialized (uncompressed) entries"""
+    _requires(zstandard, "zstandard")
+
+    try:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    except zstandard.ZstdError as e:
+        raise ValueError(
+            f"Could not train a dictionary from {len(samples)} samples, "
+            "try with more samples or a smaller dictionary size"
+        ) from e
+
+
+class Codec:
+    """
+    Serialize entries to JSON or msgpack and optionally compress them
+
+    Parameters
+    ----------
+    serializer : str, default="json"
+        "json" or "msgpack"
+
+    compressor : str, optional
+        "zlib" or "zstd", entries are not compressed by default
+
+    level : int, optional
+        Compression level, uses the compressor's default if None
+
+    dictionary : bytes, optional
+        A zstd dictionary (see train_dictionary), it improves the compression
+        ratio of small entries with similar structure (e.g., API responses)
+    """
+
+    def __init__(
+        self, serializer="json", compressor=None, level=None, dictionary=None
+    ) -> None:
+        if serializer not in {"json", "msgpack"}:
+            raise ValueError(f"Unknown serializer: {serializer!r}")
+
+        if compressor not in {None, "zlib", "zstd"}:
+            raise ValueError(f"Unknown compressor: {compressor!r}")
+
+        if dictionary is not None and compressor != "zstd":
+            raise ValueError("Dictionaries are only supported by zstd")
+
+        if serializer == "msgpack":
+            _requires(msgpack, "msgpack")
+
+        if compressor == "zstd":
+            _requires(zstandard, "zstandard")
+
+        self.serializer = serializer
+        self.compressor = compressor
+        self.level = level
+        self.dictionary = dictionary
+        self._zstd_dictionary = (
+            None if dictionary is None else zstandard.ZstdCompressionDict(dictionary)
+        )
+        # zstd (de)compressors can't be used by two threads at the same time
+        self._local = threading.local()
+
+    @property
+    def name(self):
+        name = self.serializer
+
+        if self.compressor is not None:
+            name += f"+{self.compressor}"
+
+        if self.dictionary is not None:
+            name += f":{dictionary_id(self.dictionary)}"
+
+        return name
+
+    def __repr__(self):
+        return f"Codec({self.name!r})"
+
+    @classmethod
+    def from_name(cls, name, get_dictionary=None, level=None):
+        """
+        Build the codec for name, get_dictionary is called with the dictionary
+        id if the codec uses a dictionary
+        """
+        serializer, _, compressor = name.partition("+")
+        compressor, _, id_ = compressor.partition(":")
+        dictionary = None
+
+        if id_:
+            dictionary = None if get_dictionary is None else get_dictionary(id_)
+
+            if dictionary is None:
+                raise KeyError(f"Missing dictionary {id_!r} for codec {name!r}")
+
+        return cls(
+            serializer=serializer,
+            compressor=compressor or None,
+            level=level,
+            dictionary=dictionary,
+        )
+
+    def with_dictionary(self, dictionary):
+        return type(self)(
+            serializer=self.serializer,
+            compressor=self.compressor,
+            level=self.level,
+            dictionary=dictionary,
+        )
+
+    def serialize(self, obj):
+        if self.serializer == "json":
+            return json.dumps(obj)
+        else:
+            return msgpack.packb(obj)
+
+    def deserialize(self, data):
+        if self.serializer == "json":
+            return json.loads(data)
+        else:
+            return msgpack.unpackb(data)
+
+    def _zstd(self):
+        if not hasattr(self._local, "compressor"):
+            kwargs = {} if self.level is None else {"level": self.level}
+            self._local.compressor = zstandard.ZstdCompressor(
+                dict_data=self._zstd_dictionary, **kwargs
+            )
+            self._local.decompressor = zstandard.ZstdDecompressor(
+                dict_data=self._zstd_dictionary
+            )
+
+        return self._local.compressor, self._local.decompressor
+
+    def encode(self, obj):
+        """
+        Return obj encoded, a str for uncompressed JSON (so existing databases
+        are still readable by older versions) and bytes otherwise
+        """
+        data = self.serialize(obj)
+
+        if self.compressor is None:
+            return data
+
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        if self.compressor == "zlib":
+            return zlib.compress(data, -1 if self.level is None else self.level)
+        else:
+            compressor, _ = self._zstd()
+            return compressor.compress(data)
+
+    def decode(self, data):
+        if self.compressor == "zlib":
+            data = zlib.decompress(data)
+        elif self.compressor == "zstd":
+            _, decompressor = self._zstd()
+            data = decompressor.decompress(data)
+
+        return self.deserialize(data)
+
+
+DEFAULT_CODEC = Codec()
+
+
+def encoded_size(data):
+    return len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+
+
+def recompress(
+    path_to_db,
+    codec,
+    *,
+    train=False,
+    dictionary_size=16 * 1024,
+    n_samples=2_000,
+    batch_size=500,
+    vacuum=True,
+):
+    """
+    Re-encode every entry in a cache database with codec and VACUUM it so the
+    freed space is returned to the OS.
+
+    If train is True, a zstd dictionary is trained on a sample of n_samples
+    responses and added to codec. Returns a dictionary with the number of
+    re-encoded entries and the size of the entries and the file before and
+    after
+    """
+    backend = SQLiteBackend(path_to_db)
+    connection = backend.connection
+    codecs = {}
+
+    def get_codec(name):
+        if name not in codecs:
+            codecs[name] = Codec.from_name(name, get_dictionary=backend.get_dictionary)
+
+        return codecs[name]
+
+    def entries_size():
+        (size,) = connection.execute("SELECT SUM(size) FROM api_calls").fetchone()
+        return size or 0
+
+    summary = dict(
+        entries_bytes_before=entries_size(),
+        file_bytes_before=Path(path_to_db).stat().st_size,
+    )
+
+    if train:
+        rows = connection.execute(
+            "SELECT codec, response FROM api_calls ORDER BY random() LIMIT ?",
+            (n_samples,),
+        ).fetchall()
+        samples = [codec.serialize(get_codec(name).decode(data)) for name, data in rows]
+        samples = [s.encode("utf-8") if isinstance(s, str) else s for s in samples]
+        codec = codec.with_dictionary(train_dictionary(samples, size=dictionary_size))
+
+    if codec.dictionary is not None:
+        backend.set_dictionary(dictionary_id(codec.dictionary), codec.dictionary)
+
+    # collect the keys first, updating a table while iterating over it is
+    # undefined in SQLite
+    keys = [
+        key
+        for (key,) in connection.execute(
+            "SELECT key FROM api_calls WHERE codec != ?", (codec.name,)
+        )
+    ]
+
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i : i + batch_size]
+        placeholders = ", ".join("?" for _ in batch)
+        rows = connection.execute(
+            "SELECT key, codec, kwargs, response FROM api_calls "
+            f"WHERE key IN ({placeholders})",
+            batch,
+        ).fetchall()
+        updates = []
+
+        for key, name, kwargs, response in rows:
+            source = get_codec(name)
+            kwargs = codec.encode(source.decode(kwargs))
+            response = codec.encode(source.decode(response))
+            size = encoded_size(kwargs) + encoded_size(response)
+            updates.append((kwargs, response, size, codec.name, key))
+
+        with connection:
+            connection.executemany(
+                """
+                UPDATE api_calls SET kwargs = ?, response = ?, size = ?, codec = ?
+                WHERE key = ?
+            """,
+                updates,
+            )
+
+    if vacuum:
+        connection.execute("VACUUM")
+
+    summary["entries"] = len(keys)
+    summary["entries_bytes_after"] = entries_size()
+    backend.close()
+    summary["file_bytes_after"] = Path(path_to_db).stat().st_size
+    summary["codec"] = codec.name
+
+    return summary
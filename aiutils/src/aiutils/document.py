@@ -1,13 +1,30 @@
+from collections import namedtuple
+from functools import cache
+
 import tiktoken
 import fitz
+import numpy as np
 from PIL import Image
 from jinja2 import Template
 
-import aiutils.text
 from aiutils import tables
+from aiutils.lru import LRUCache
+from aiutils.pipeline import Pipeline, Stage
+from aiutils.tablecache import PageTables, page_fingerprint
+
+
+@cache
+def get_encoding():
+    """The tokenizer used to count tokens, loaded on first use"""
+    return tiktoken.get_encoding("cl100k_base")
 
 
-encoding = tiktoken.get_encoding("cl100k_base")
+def __getattr__(name):
+    # backwards compatibility, the encoding used to be loaded on import
+    if name == "encoding":
+        return get_encoding()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # gpt-3.5-turbo-0125
@@ -29,58 +46,508 @@ template_page = Template(
 )
 
 
+PromptBatch = namedtuple("PromptBatch", ["prompt", "page_numbers", "n_tokens", "cost"])
+PromptBatch.__doc__ = """
+A prompt with one or more consecutive pages (or a part of a page), its number
+of tokens and its estimated cost in USD
+"""
+
+
+# pages are split on paragraphs first, then on lines
+_SEPARATORS = ("\n\n", "\n")
+
+
+def _pieces(text, max_tokens, encoding, separators=_SEPARATORS):
+    """
+    Split text in (piece, n_tokens) of at most max_tokens each, on the first
+    separator that makes pieces small enough. Pieces keep their separator, so
+    joining them returns the text
+    """
+    tokens = encoding.encode(text)
+
+    if len(tokens) <= max_tokens:
+        return [(text, len(tokens))]
+
+    # a single line over the budget is split on tokens
+    if not separators:
+        slices = [tokens[i : i + max_tokens] for i in range(0, len(tokens), max_tokens)]
+        return [(encoding.decode(slice_), len(slice_)) for slice_ in slices]
+
+    separator, *rest = separators
+    parts = text.split(separator)
+    pieces = []
+
+    for i, part in enumerate(parts):
+        if i < len(parts) - 1:
+            part += separator
+
+        pieces.extend(_pieces(part, max_tokens, encoding, rest))
+
+    return pieces
+
+
+def _page_prompts(page_number, text, tables_, max_tokens, encoding):
+    """
+    Render a page with template_page, return a list of (prompt, n_tokens). Pages
+    over max_tokens are split, the tables go in the last part
+    """
+    prompt = template_page.render(text=text, tables=tables_, page_number=page_number)
+    n_tokens = len(encoding.encode(prompt))
+
+    if n_tokens <= max_tokens:
+        return [(prompt, n_tokens)]
+
+    overhead = len(
+        encoding.encode(
+            template_page.render(text="", tables=tables_, page_number=page_number)
+        )
+    )
+    # if the tables alone are over the budget, the last part will be too
+    budget = max(max_tokens - overhead, 1)
+    parts, current, size = [], [], 0
+
+    for piece, n in _pieces(text, budget, encoding):
+        if current and size + n > budget:
+            parts.append("".join(current))
+            current, size = [], 0
+
+        current.append(piece)
+        size += n
+
+    parts.append("".join(current))
+    prompts = [
+        template_page.render(
+            text=part,
+            tables=tables_ if i == len(parts) - 1 else "",
+            page_number=page_number,
+        )
+        for i, part in enumerate(parts)
+    ]
+    return [(prompt, len(encoding.encode(prompt))) for prompt in prompts]
+
+
+def pack_prompts(pages, max_tokens, *, encoding=None, price_per_token=PRICE_PER_TOKEN):
+    """
+    Render pages with template_page and pack consecutive ones into prompts of
+    up to max_tokens, pages over the budget are split on paragraphs (or lines).
+    Yields a PromptBatch per prompt
+
+    Parameters
+    ----------
+    pages : iterable
+        (page_number, text, tables) for each page
+
+    max_tokens : int
+        Token budget per prompt. Parts of a page are counted separately and
+        tokens may merge when joining them, so prompts can come out shorter
+
+    encoding : tiktoken.Encoding, optional
+        Defaults to get_encoding()
+
+    price_per_token : float, default=PRICE_PER_TOKEN
+        Used to estimate the cost of each prompt
+    """
+    encoding = encoding or get_encoding()
+    prompts, page_numbers, n_tokens = [], [], 0
+
+    def batch():
+        prompt = "".join(prompts)
+        n_tokens = len(encoding.encode(prompt))
+        return PromptBatch(prompt, page_numbers, n_tokens, n_tokens * price_per_token)
+
+    for page_number, text, tables_ in pages:
+        for prompt, n in _page_prompts(
+            page_number, text, tables_, max_tokens, encoding
+        ):
+            if prompts and n_tokens + n > max_tokens:
+                yield batch()
+                prompts, page_numbers, n_tokens = [], [], 0
+
+            prompts.append(prompt)
+            n_tokens += n
+
+            if page_number not in page_numbers:
+                page_numbers.append(page_number)
+
+    if prompts:
+        yield batch()
+
+
+# pages are rendered at this zoom to find tables, higher resolutions improve OCR
+ZOOM = 2
+
+
+# PIL modes by number of channels
+_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+
+def pixmap_to_array(pix):
+    """
+    Return a (height, width, channels) uint8 array that shares memory with
+    the pixmap (no copy). The array must be dropped before pix, copy it to
+    keep it around
+    """
+    return np.ndarray(
+        shape=(pix.height, pix.width, pix.n),
+        dtype=np.uint8,
+        buffer=pix.samples_mv,
+        strides=(pix.stride, pix.n, 1),
+    )
+
+
+def pixmap_to_image(pix):
+    """
+    Return the pixmap as a PIL image. Grayscale and RGBA (alpha=True) pixmaps
+    share memory with the image, so it must be dropped before pix. PIL stores
+    RGB images with 4 bytes per pixel, so RGB pixmaps are copied
+    """
+    mode = _MODES[pix.n]
+    return Image.frombuffer(
+        mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1
+    )
+
+
+# documents opened by each worker process, see Document.iter_tables
+_worker_documents = {}
+
+
+def _render_page(item):
+    path, page_number = item
+
+    if path not in _worker_documents:
+        _worker_documents[path] = Document(path)
+
+    return _worker_documents[path].get_page_as_image(page_number)
+
+
+def _load_table_detector():
+    tables.TableDetector()
+
+
+def _detect_tables(page):
+    """Return the tables detected in a page image and the tables cropped"""
+    objects = tables.TableDetector().detect(page)
+    return objects, tables.crop_tables(page, objects)
+
+
+def _load_structure_detector():
+    tables.TableStructureDetector()
+
+
+def _detect_structure(detected):
+    """Return the detected tables and (cropped table, CellGrid) for each one"""
+    objects, cropped = detected
+    structures = tables.TableStructureDetector().detect_batch(cropped)
+    return objects, [
+        (img, tables.get_cell_grid(cells))
+        for img, (_, cells) in zip(cropped, structures)
+    ]
+
+
+def _load_ocr_reader():
+    tables.OCRReader()
+
+
+def _ocr_tables(detected):
+    """Return the PageTables of a page"""
+    objects, structures = detected
+    return PageTables(
+        objects=objects,
+        grids=[grid for _, grid in structures],
+        # TODO: we need to export the tables to a format that can be used in the
+        # prompt
+        tables=[tables.apply_ocr(grid, img)[1] for img, grid in structures],
+    )
+
+
+def _extract_tables(page):
+    """Return the PageTables of a page image"""
+    return _ocr_tables(_detect_structure(_detect_tables(page)))
+
+
 class Document:
-    def __init__(self, path) -> None:
+    """
+    A PDF document. Pages are extracted and tokenized on demand, so opening a
+    document is cheap regardless of its size.
+
+    The PDF is opened once, on first use, and stays open until close() is
+    called (or the with block ends). Documents are not thread-safe
+
+    Parameters
+    ----------
+    path : str
+        Path to the PDF
+
+    max_cache_bytes : int, default=32MB
+        Memory budget for the text of recently used pages
+
+    n_sample_pages : int, default=10
+        Number of pages to tokenize when estimating the number of tokens
+
+    table_cache : aiutils.tablecache.TableCache, optional
+        Where to store the tables extracted from each page. Pages whose
+        content didn't change since they were stored are read from it instead
+        of running the models again
+    """
+
+    def __init__(
+        self,
+        path,
+        *,
+        max_cache_bytes=32 * 1024**2,
+        n_sample_pages=10,
+        table_cache=None,
+    ) -> None:
         self._path = path
-        self._text_pages = aiutils.text.pdf2text(self._path)
-        self._n_tokens = sum([len(encoding.encode(page)) for page in self._text_pages])
-        self._n_pages = len(self._text_pages)
+        self._n_sample_pages = n_sample_pages
+        self._table_cache = table_cache
+        self._doc = None
+        self._text_pages = LRUCache(max_entries=None, max_bytes=max_cache_bytes)
+        # page number -> number of tokens, kept for every page extracted so far
+        self._page_tokens = {}
+
+    @property
+    def _fitz(self):
+        if self._doc is None:
+            self._doc = fitz.open(self._path)
+
+        return self._doc
+
+    def close(self):
+        """Close the PDF, it's opened again if the document is used afterwards"""
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def _n_pages(self):
+        return self._fitz.page_count
+
+    def get_page_text(self, page_number):
+        """Return the text in a page"""
+        text = self._text_pages.get(page_number)
+
+        if text is None:
+            text = self._fitz[page_number].get_text()
+            self._page_tokens[page_number] = len(get_encoding().encode(text))
+            self._text_pages.set(page_number, text, size=len(text.encode("utf-8")))
+
+        return text
 
     def pages(self):
-        for page in self._text_pages:
-            yield page
+        for i in range(self._n_pages):
+            yield self.get_page_text(i)
 
-    def get_page_as_image(self, page_number):
-        """Return a page as an image"""
-        doc = fitz.open(self._path)
+    @property
+    def n_tokens(self):
+        """
+        Number of tokens in the document. Exact once every page has been
+        extracted, otherwise estimated from a sample of evenly spaced pages
+        """
+        n_pages = self._n_pages
+
+        if len(self._page_tokens) == n_pages:
+            return sum(self._page_tokens.values())
+
+        n_sample = min(self._n_sample_pages, n_pages)
+
+        for i in range(n_sample):
+            self.get_page_text(i * n_pages // n_sample)
+
+        mean = sum(self._page_tokens.values()) / len(self._page_tokens)
+        return round(mean * n_pages)
+
+    def count_tokens(self):
+        """Extract every page and return the exact number of tokens"""
+        for i in range(self._n_pages):
+            if i not in self._page_tokens:
+                self.get_page_text(i)
+
+        return self.n_tokens
+
+    def render_pages(self, page_numbers=None, *, zoom=ZOOM, alpha=False):
+        """
+        Render pages (all by default) and yield a pixmap for each, convert them
+        with pixmap_to_array or pixmap_to_image. Only one pixmap is alive at a
+        time, so zero-copy conversions are valid until the next one is yielded
+        """
+        if page_numbers is None:
+            page_numbers = range(self._n_pages)
 
         # render at a higher res using matrix to improve ocr
         # https://github.com/pymupdf/PyMuPDF/issues/322#issuecomment-512561756
-        pix = doc[page_number].get_pixmap(matrix=fitz.Matrix(2, 2))
+        matrix = fitz.Matrix(zoom, zoom)
+        doc = self._fitz
+
+        for page_number in page_numbers:
+            yield doc[page_number].get_pixmap(matrix=matrix, alpha=alpha)
+
+    def iter_page_images(self, page_numbers=None):
+        """Yield pages (all by default) as PIL images"""
+        for pix in self.render_pages(page_numbers):
+            yield pixmap_to_image(pix)
 
-        return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    def get_page_as_image(self, page_number):
+        """Return a page as an image"""
+        return next(self.iter_page_images([page_number]))
 
     def get_tables_in_page(self, page_number):
         """Return a list of tables in the page. Each table is a dictionary"""
-        # TODO: make the detectors a singleton to avoid loading the model every time
-        table_detector = tables.TableDetector()
-        page = self.get_page_as_image(page_number)
-        tables_detected = table_detector.detect(page)
-        cropped = tables.crop_tables(page, tables_detected)
-        detector_structure = tables.TableStructureDetector()
-        tables_detected = [detector_structure.detect(img) for img in cropped]
-        coords = [tables.get_cell_coordinates_by_row(t[1]) for t in tables_detected]
-        out = [tables.apply_ocr(c, img) for c, img in zip(coords, cropped)]
-
-        # TODO: we need to export the tables to a format that can be used in the prompt
-        return [table[1] for table in out]
-
-    def iter_tables(self):
-        for i in range(self._n_pages):
-            tables = self.get_tables_in_page(i)
-            yield tables
+        return self.get_page_tables(page_number).tables
+
+    def get_page_tables(self, page_number):
+        """
+        Return the PageTables of a page: the tables detected, their cell grids
+        and their text
+        """
+        return next(self.iter_page_tables([page_number]))
+
+    def _table_keys(self, page_numbers):
+        matrix = fitz.Matrix(ZOOM, ZOOM)
+        return [
+            self._table_cache.key(page_fingerprint(self._fitz, i), matrix)
+            for i in page_numbers
+        ]
+
+    def iter_page_tables(
+        self, page_numbers=None, *, n_workers=None, progress=None, mp_context=None
+    ):
+        """
+        Yield the PageTables of each page (all by default), in order. Pages
+        stored in the table cache aren't rendered, see iter_tables for the
+        other parameters
+        """
+        if page_numbers is None:
+            page_numbers = range(self._n_pages)
+
+        page_numbers = list(page_numbers)
+
+        if self._table_cache is None:
+            yield from self._compute_page_tables(
+                page_numbers, n_workers, progress, mp_context
+            )
+            return
+
+        keys = self._table_keys(page_numbers)
+        cached = self._table_cache.get_many(keys)
+        results = self._compute_page_tables(
+            [i for i, key in zip(page_numbers, keys) if key not in cached],
+            n_workers,
+            progress,
+            mp_context,
+        )
+
+        try:
+            for key in keys:
+                page_tables = cached.get(key)
+
+                if page_tables is None:
+                    page_tables = next(results)
+                    self._table_cache.set(key, page_tables)
+
+                yield page_tables
+        finally:
+            # stops the pipeline if the caller stops iterating early
+            results.close()
+
+    def _compute_page_tables(self, page_numbers, n_workers, progress, mp_context):
+        if not page_numbers:
+            return
+
+        if n_workers is None:
+            for page in self.iter_page_images(page_numbers):
+                yield _extract_tables(page)
+
+            return
+
+        pipeline = Pipeline(
+            [
+                Stage("render", _render_page),
+                Stage(
+                    "detect",
+                    _detect_tables,
+                    n_workers=n_workers,
+                    initializer=_load_table_detector,
+                ),
+                Stage(
+                    "structure",
+                    _detect_structure,
+                    n_workers=n_workers,
+                    initializer=_load_structure_detector,
+                ),
+                Stage(
+                    "ocr",
+                    _ocr_tables,
+                    n_workers=n_workers,
+                    initializer=_load_ocr_reader,
+                ),
+            ],
+            progress=progress,
+            mp_context=mp_context,
+        )
+        yield from pipeline.map((self._path, i) for i in page_numbers)
+
+    def iter_tables(self, n_workers=None, *, progress=None, mp_context=None):
+        """
+        Yield the tables in each page, in order.
+
+        If n_workers is passed, pages go through a pipeline where rendering,
+        table detection, structure detection and OCR run as separate stages,
+        each one in a pool of n_workers processes (rendering uses one) that
+        load their model once. See aiutils.pipeline.Pipeline for progress and
+        mp_context
+        """
+        for page_tables in self.iter_page_tables(
+            n_workers=n_workers, progress=progress, mp_context=mp_context
+        ):
+            yield page_tables.tables
+
+    def iter_prompts(self, n_workers=None, *, max_tokens=None):
+        """
+        Iterate over the pages and tables and return a prompt for the document,
+        n_workers is passed to iter_tables. By default, there is a prompt per
+        page, pass max_tokens to pack pages into prompts of up to max_tokens
+        (see iter_prompt_batches)
+        """
+        if max_tokens is not None:
+            for batch in self.iter_prompt_batches(max_tokens, n_workers):
+                yield batch.prompt
+
+            return
 
-    def iter_prompts(self):
-        """Iterate over the pages and tables and return a prompt for the document"""
         for i, text, tables in zip(
             range(self._n_pages),
             self.pages(),
-            self.iter_tables(),
+            self.iter_tables(n_workers),
         ):
             yield template_page.render(text=text, tables=tables, page_number=i)
 
+    def iter_prompt_batches(
+        self, max_tokens, n_workers=None, *, price_per_token=PRICE_PER_TOKEN
+    ):
+        """
+        Pack consecutive pages (and their tables) into prompts of up to
+        max_tokens, splitting pages over the budget, and yield a PromptBatch
+        with each prompt, its pages, number of tokens and estimated cost. See
+        pack_prompts
+        """
+        pages = zip(range(self._n_pages), self.pages(), self.iter_tables(n_workers))
+        yield from pack_prompts(pages, max_tokens, price_per_token=price_per_token)
+
     def __repr__(self) -> str:
+        n_tokens = self.n_tokens
+        # "~" marks estimates
+        approx = "" if len(self._page_tokens) == self._n_pages else "~"
         return (
-            f"Document(path={self._path}, n_tokens={self._n_tokens:,}, "
-            f"price={self._n_tokens * PRICE_PER_TOKEN:.2f} USD)"
+            f"Document(path={self._path}, n_tokens={approx}{n_tokens:,}, "
+            f"price={approx}{n_tokens * PRICE_PER_TOKEN:.2f} USD)"
         )
@@ -1,45 +1,102 @@
 from collections.abc import Mapping, MutableSequence
+from types import MappingProxyType
 import keyword
 from copy import deepcopy
 
 
+_SCALARS = frozenset({str, int, float, bool, type(None)})
+
+
+def _escape(key):
+    """Keys that are Python keywords are accessed with a trailing underscore"""
+    return key + "_" if isinstance(key, str) and keyword.iskeyword(key) else key
+
+
+def _copy(value):
+    """
+    Copy containers, so callers can't modify the wrapped object (which may be
+    shared, e.g., by APICache's in-memory cache)
+    """
+    return value if type(value) in _SCALARS else deepcopy(value)
+
+
+def _unescape(data, key):
+    """Return the key in data for an (escaped) attribute name"""
+    if key not in data and isinstance(key, str) and key.endswith("_"):
+        if keyword.iskeyword(key[:-1]):
+            return key[:-1]
+
+    return key
+
+
 class FrozenJSON(object):
     """
     A facade for navigating a JSON-like object using attribute notation.
-    Based on FrozenJSON from 'Fluent Python'
+    Based on FrozenJSON from 'Fluent Python'.
+
+    The object is wrapped, not copied. Nested objects are wrapped on first
+    access and the wrappers are reused afterwards. Lists of scalars (e.g.,
+    embeddings) are returned as lists, other lists as read-only FrozenList
+    objects that wrap their items on access. Values read with [], get(),
+    values() and items() are copies
     """
 
+    __slots__ = ("_data", "_children", "_path_to_file")
+
     def __new__(cls, arg):
-        if isinstance(arg, Mapping):
+        # exact type checks first, isinstance with ABCs is comparatively slow
+        # and this runs for every value accessed
+        type_ = type(arg)
+
+        if type_ in _SCALARS:
+            return arg
+        elif type_ is dict or isinstance(arg, Mapping):
             return super(FrozenJSON, cls).__new__(cls)
+        elif type_ is list or isinstance(arg, MutableSequence):
+            if all(type(item) in _SCALARS for item in arg):
+                return list(arg)
 
-        elif isinstance(arg, MutableSequence):
-            return [cls(item) for item in arg]
+            return FrozenList(arg)
         else:
             return arg
 
     def __init__(self, mapping):
         self._path_to_file = None
-
-        self._data = {}
-
-        for key, value in mapping.items():
-            if keyword.iskeyword(key):
-                key += "_"
-
-            self._data[key] = value
+        self._data = mapping
+        # attribute -> wrapped value
+        self._children = {}
 
     def __getattr__(self, name):
+        # if _children isn't set yet, this raises AttributeError (see below)
+        children = self._children
+
+        try:
+            return children[name]
+        except KeyError:
+            pass
+
+        # unset slots (e.g., while unpickling) and special methods that
+        # libraries look up (e.g., __deepcopy__) aren't keys
+        if name in FrozenJSON.__slots__ or (
+            name.startswith("__") and name.endswith("__")
+        ):
+            raise AttributeError(name)
+
+        # dictionary methods, without the ones that modify it
         if hasattr(self._data, name):
-            return getattr(self._data, name)
-        else:
-            return FrozenJSON(self._data[name])
+            return getattr(MappingProxyType(self._data), name)
+
+        child = children[name] = FrozenJSON(self._data[_unescape(self._data, name)])
+        return child
+
+    def __reduce__(self):
+        return FrozenJSON, (self._data,)
 
     def __dir__(self):
-        return self._data.keys()
+        return [_escape(key) for key in self._data.keys()]
 
     def __getitem__(self, key):
-        value = self._data.get(key)
+        value = self._data.get(_unescape(self._data, key))
 
         if value is None:
             key_ = key if not isinstance(key, str) else "'%s'" % key
@@ -50,7 +107,19 @@ class FrozenJSON(object):
                 msg += ". File loaded from {}".format(self._path_to_file)
             raise KeyError(msg)
 
-        return value
+        return _copy(value)
+
+    def get(self, key, default=None):
+        return _copy(self._data.get(_unescape(self._data, key), default))
+
+    def values(self):
+        return [_copy(value) for value in self._data.values()]
+
+    def items(self):
+        return [(key, _copy(value)) for key, value in self._data.items()]
+
+    def copy(self):
+        return deepcopy(self._data)
 
     def __str__(self):
         if self._path_to_file:
@@ -62,4 +131,61 @@ class FrozenJSON(object):
         return "FrozenJSON({})".format(str(self))
 
     def to_dict(self):
-        return deepcopy(self._data)
+        return {_escape(key): deepcopy(value) for key, value in self._data.items()}
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("FrozenList is read-only")
+
+
+class FrozenList(list):
+    """
+    A read-only list whose items are wrapped with FrozenJSON on first access
+    (the wrappers are reused afterwards). It holds a shallow copy of the
+    list, so it serializes (e.g., with json.dumps) as the original one
+    """
+
+    __slots__ = ("_children",)
+
+    def __init__(self, data):
+        super().__init__(data)
+        # index -> wrapped item
+        self._children = {}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return FrozenList(list.__getitem__(self, index))
+
+        # negative indexes share the wrapper of the same position
+        if index < 0:
+            index += len(self)
+
+            if index < 0:
+                raise IndexError("list index out of range")
+
+        try:
+            return self._children[index]
+        except KeyError:
+            pass
+
+        child = self._children[index] = FrozenJSON(list.__getitem__(self, index))
+        return child
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __reduce__(self):
+        return FrozenList, (list(list.__iter__(self)),)
+
+    def __add__(self, other):
+        return self.to_list() + list(other)
+
+    def __mul__(self, n):
+        return self.to_list() * n
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def to_list(self):
+        return deepcopy(list(list.__iter__(self)))
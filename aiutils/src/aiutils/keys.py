@@ -0,0 +1,16 @@
+import hashlib
+import json
+
+
+def canonical_kwargs(kwargs: dict) -> str:
+    """Serialize kwargs so that equivalent calls produce the same string"""
+    return json.dumps(kwargs, sort_keys=True, separators=(",", ":"))
+
+
+def make_key(qualified_name: str, kwargs: dict) -> str:
+    """Return the digest that identifies an API call in the cache"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(qualified_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(canonical_kwargs(kwargs).encode("utf-8"))
+    return digest.hexdigest()
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """
+    A thread-safe, in-process mapping bounded by number of entries and total
+    size. When full, the least recently used entries are evicted. Entries may
+    have an expiration timestamp (as returned by time.time())
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None) -> None:
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    @property
+    def n_bytes(self):
+        return self._n_bytes
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            value, size, expires_at = entry
+
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, *, size=0, expires_at=None):
+        if self._max_bytes is not None and size > self._max_bytes:
+            # it'd evict everything else and then itself
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, size, expires_at)
+            self._n_bytes += size
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._n_bytes -= size
+
+    def _evict(self):
+        while (
+            self._max_entries is not None and len(self._entries) > self._max_entries
+        ) or (self._max_bytes is not None and self._n_bytes > self._max_bytes):
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._n_bytes -= size
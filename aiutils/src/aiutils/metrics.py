@@ -0,0 +1,296 @@
+"""
+Hit/miss, latency, size and savings metrics for APICache, per qualified name.
+Read them with CacheMetrics.summary() or expose them to Prometheus with
+to_prometheus() or serve_metrics()
+"""
+
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import threading
+
+# seconds, lookups are usually sub-millisecond and API calls take seconds
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+# USD per token (prompt, completion), used to estimate savings. Models are
+# matched by the longest prefix of the model in the response
+PRICES = {
+    "gpt-3.5-turbo": (0.5 / 1_000_000, 1.5 / 1_000_000),
+    "gpt-4": (30 / 1_000_000, 60 / 1_000_000),
+    "gpt-4-turbo": (10 / 1_000_000, 30 / 1_000_000),
+    "gpt-4-0125-preview": (10 / 1_000_000, 30 / 1_000_000),
+    "gpt-4-1106-preview": (10 / 1_000_000, 30 / 1_000_000),
+    "gpt-4o": (2.5 / 1_000_000, 10 / 1_000_000),
+    "gpt-4o-mini": (0.15 / 1_000_000, 0.6 / 1_000_000),
+    "text-embedding-3-small": (0.02 / 1_000_000, 0),
+    "text-embedding-3-large": (0.13 / 1_000_000, 0),
+}
+
+OUTCOMES = ("hit", "near_hit", "miss")
+
+
+class Histogram:
+    """A cumulative histogram with fixed buckets (as Prometheus does)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        # the last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile, interpolating linearly within its bucket"""
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0
+
+                # the +Inf bucket has no upper bound
+                if i == len(self.buckets):
+                    return lower
+
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+
+            seen += count
+
+    def summary(self):
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            mean=self.sum / self.count if self.count else None,
+            p50=self.quantile(0.5),
+            p95=self.quantile(0.95),
+            p99=self.quantile(0.99),
+        )
+
+
+def _usage(response):
+    """Return (model, usage) from a response, or a recorded stream"""
+    if isinstance(response, list):
+        # streams only report usage in the last chunk (if requested)
+        response = next((c for c in reversed(response) if c.get("usage")), {})
+
+    if not isinstance(response, dict):
+        return None, None
+
+    return response.get("model"), response.get("usage")
+
+
+class _Metrics:
+    def __init__(self) -> None:
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.lookup_seconds = Histogram()
+        self.upstream_seconds = Histogram()
+        self.stored_bytes = 0
+        self.saved_tokens = 0
+        self.saved_cost = 0.0
+
+
+class CacheMetrics:
+    """
+    Thread-safe metrics registry. APICache records to aiutils.metrics.METRICS
+    unless another registry is passed
+
+    Parameters
+    ----------
+    prices : dict, optional
+        Maps model prefixes to (prompt, completion) USD per token, used to
+        estimate the cost saved by hits. Defaults to PRICES
+    """
+
+    def __init__(self, prices=None) -> None:
+        self._prices = PRICES if prices is None else prices
+        self._metrics = defaultdict(_Metrics)
+        self._lock = threading.Lock()
+
+    def _price(self, model):
+        matches = [prefix for prefix in self._prices if model.startswith(prefix)]
+        return self._prices[max(matches, key=len)] if matches else None
+
+    def _saved(self, response):
+        model, usage = _usage(response)
+
+        if not usage:
+            return 0, 0.0
+
+        prompt = usage.get("prompt_tokens") or 0
+        completion = usage.get("completion_tokens") or 0
+        price = None if model is None else self._price(model)
+        cost = 0.0 if price is None else prompt * price[0] + completion * price[1]
+
+        return prompt + completion, cost
+
+    def record_lookup(self, qualified_name, outcome, seconds, response=None):
+        """Record a lookup, response is the cached response on (near) hits"""
+        tokens, cost = (0, 0.0) if response is None else self._saved(response)
+
+        with self._lock:
+            metrics = self._metrics[qualified_name]
+            metrics.outcomes[outcome] += 1
+            metrics.lookup_seconds.observe(seconds)
+            metrics.saved_tokens += tokens
+            metrics.saved_cost += cost
+
+    def record_upstream(self, qualified_name, seconds):
+        with self._lock:
+            self._metrics[qualified_name].upstream_seconds.observe(seconds)
+
+    def record_store(self, qualified_name, size):
+        with self._lock:
+            self._metrics[qualified_name].stored_bytes += size
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def summary(self):
+        """Return the metrics per qualified name as a dictionary"""
+        with self._lock:
+            summary = {}
+
+            for name, metrics in self._metrics.items():
+                n_lookups = sum(metrics.outcomes.values())
+                n_served = metrics.outcomes["hit"] + metrics.outcomes["near_hit"]
+                summary[name] = dict(
+                    hits=metrics.outcomes["hit"],
+                    near_hits=metrics.outcomes["near_hit"],
+                    misses=metrics.outcomes["miss"],
+                    hit_ratio=n_served / n_lookups if n_lookups else None,
+                    lookup_seconds=metrics.lookup_seconds.summary(),
+                    upstream_seconds=metrics.upstream_seconds.summary(),
+                    stored_bytes=metrics.stored_bytes,
+                    saved_tokens=metrics.saved_tokens,
+                    saved_cost_usd=metrics.saved_cost,
+                )
+
+            return summary
+
+    def to_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def family(name, type_, help_):
+            lines.append(f"# HELP {name} {help_}")
+            lines.append(f"# TYPE {name} {type_}")
+
+        with self._lock:
+            items = sorted(self._metrics.items())
+
+            family("aiutils_cache_lookups_total", "counter", "Cache lookups by outcome")
+            for name, metrics in items:
+                for outcome, count in metrics.outcomes.items():
+                    labels = _labels(qualified_name=name, outcome=outcome)
+                    lines.append(f"aiutils_cache_lookups_total{labels} {count}")
+
+            for attribute, help_ in (
+                ("lookup_seconds", "Time to look up an entry in the cache"),
+                ("upstream_seconds", "Time spent calling the API on misses"),
+            ):
+                metric = f"aiutils_cache_{attribute}"
+                family(metric, "histogram", help_)
+
+                for name, metrics in items:
+                    _histogram_lines(lines, metric, name, getattr(metrics, attribute))
+
+            for attribute, metric, help_ in (
+                ("stored_bytes", "stored_bytes_total", "Bytes written to the cache"),
+                ("saved_tokens", "saved_tokens_total", "Tokens served from the cache"),
+                (
+                    "saved_cost",
+                    "saved_cost_usd_total",
+                    "Estimated API cost saved by the cache",
+                ),
+            ):
+                family(f"aiutils_cache_{metric}", "counter", help_)
+
+                for name, metrics in items:
+                    labels = _labels(qualified_name=name)
+                    value = getattr(metrics, attribute)
+                    lines.append(f"aiutils_cache_{metric}{labels} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _histogram_lines(lines, metric, name, histogram):
+    cumulative = 0
+
+    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+        cumulative += count
+        labels = _labels(qualified_name=name, le=bound)
+        lines.append(f"{metric}_bucket{labels} {cumulative}")
+
+    labels = _labels(qualified_name=name)
+    lines.append(f"{metric}_sum{labels} {histogram.sum}")
+    lines.append(f"{metric}_count{labels} {histogram.count}")
+
+
+METRICS = CacheMetrics()
+
+
+def serve_metrics(port=9090, host="0.0.0.0", metrics=None):
+    """
+    Serve the metrics at http://host:port/metrics from a background thread,
+    returns the server (call .shutdown() to stop it)
+    """
+    metrics = metrics or METRICS
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = metrics.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="aiutils-metrics", daemon=True
+    )
+    thread.start()
+    return server
@@ -0,0 +1,255 @@
+"""
+A pipelined executor: each stage runs in its own process pool and stages are
+connected by bounded queues, so a slow stage applies backpressure instead of
+accumulating results in memory. Results come out in input order
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# marks the end of a stage's input
+_DONE = object()
+
+
+class _Error:
+    def __init__(self, exception) -> None:
+        self.exception = exception
+
+
+class Stage:
+    """
+    A step in a Pipeline
+
+    Parameters
+    ----------
+    name : str
+        Used when reporting progress
+
+    function : callable
+        Takes an item and returns the input for the next stage, it must be
+        picklable (e.g., defined at the top level of a module)
+
+    n_workers : int, default=1
+        Number of processes running this stage
+
+    initializer : callable, optional
+        Called once when each worker process starts, e.g., to load a model
+    """
+
+    def __init__(self, name, function, n_workers=1, initializer=None) -> None:
+        self.name = name
+        self.function = function
+        self.n_workers = n_workers
+        self.initializer = initializer
+
+
+class StageStats:
+    """Progress of a stage. busy is the time workers spent running it"""
+
+    def __init__(self, name, n_workers) -> None:
+        self.name = name
+        self.n_workers = n_workers
+        self.n_items = 0
+        self.busy = 0.0
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def throughput(self):
+        """Items per second"""
+        elapsed = self.elapsed
+        return self.n_items / elapsed if elapsed else 0.0
+
+    @property
+    def utilization(self):
+        """Fraction of the time the stage's workers were busy"""
+        elapsed = self.elapsed
+        return self.busy / (elapsed * self.n_workers) if elapsed else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"StageStats(name={self.name!r}, n_items={self.n_items}, "
+            f"throughput={self.throughput:.2f}/s, "
+            f"utilization={self.utilization:.0%})"
+        )
+
+
+def _timed(function, item):
+    start = time.perf_counter()
+    result = function(item)
+    return result, time.perf_counter() - start
+
+
+class Pipeline:
+    """
+    Run items through stages, each one in its own process pool
+
+    Parameters
+    ----------
+    stages : list of Stage
+
+    max_in_flight : int, optional
+        Maximum number of items submitted to a stage and not yet passed to the
+        next one, defaults to twice its number of workers. Queues between
+        stages hold at most this many items too
+
+    progress : callable, optional
+        Called with the StageStats of a stage every time it finishes an item
+
+    mp_context : multiprocessing context, optional
+        Passed to ProcessPoolExecutor (e.g., to use "spawn")
+
+    Examples
+    --------
+    >>> pipeline = Pipeline([Stage("square", square, n_workers=4)])
+    >>> list(pipeline.map(range(10)))
+    """
+
+    def __init__(
+        self, stages, *, max_in_flight=None, progress=None, mp_context=None
+    ) -> None:
+        self._stages = stages
+        self._max_in_flight = max_in_flight
+        self._progress = progress
+        self._mp_context = mp_context
+        self.stats = [StageStats(stage.name, stage.n_workers) for stage in stages]
+
+    def _limit(self, stage):
+        return self._max_in_flight or 2 * stage.n_workers
+
+    def map(self, items):
+        """Yield the output of the last stage for each item, in order"""
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self._limit(stage)) for stage in self._stages]
+        queues.append(queue.Queue(maxsize=self._limit(self._stages[-1])))
+        threads = [
+            threading.Thread(
+                target=self._feed, args=(items, queues[0], stop), daemon=True
+            )
+        ]
+
+        for i, stage in enumerate(self._stages):
+            threads.append(
+                threading.Thread(
+                    target=self._run_stage,
+                    args=(stage, self.stats[i], queues[i], queues[i + 1], stop),
+                    name=f"aiutils-pipeline-{stage.name}",
+                    daemon=True,
+                )
+            )
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = queues[-1].get()
+
+                if item is _DONE:
+                    break
+                elif isinstance(item, _Error):
+                    raise item.exception
+
+                yield item
+        finally:
+            # also reached if the caller stops iterating early
+            stop.set()
+
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def _put(q, item, stop):
+        """Put item in q unless the pipeline is stopped, returns False if so"""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _feed(self, items, q, stop):
+        try:
+            for item in items:
+                if not self._put(q, item, stop):
+                    return
+        except BaseException as e:
+            self._put(q, _Error(e), stop)
+            return
+
+        self._put(q, _DONE, stop)
+
+    def _run_stage(self, stage, stats, q_in, q_out, stop):
+        limit = self._limit(stage)
+        pending = deque()
+        done = False
+        # an error from a previous stage, passed on after the pending results
+        error = None
+        executor = ProcessPoolExecutor(
+            max_workers=stage.n_workers,
+            initializer=stage.initializer,
+            mp_context=self._mp_context,
+        )
+
+        def emit(future):
+            try:
+                result, busy = future.result()
+                stats.n_items += 1
+                stats.busy += busy
+
+                if self._progress is not None:
+                    self._progress(stats)
+            except BaseException as e:
+                self._put(q_out, _Error(e), stop)
+                return False
+
+            logger.debug("%r", stats)
+            return self._put(q_out, result, stop)
+
+        try:
+            while not stop.is_set() and (pending or not done):
+                if not done and len(pending) < limit:
+                    try:
+                        # don't block while there are results to pass on
+                        item = q_in.get(timeout=0.01 if pending else 0.1)
+                    except queue.Empty:
+                        pass
+                    else:
+                        if item is _DONE:
+                            done = True
+                        elif isinstance(item, _Error):
+                            done, error = True, item
+                        else:
+                            if stats.started_at is None:
+                                stats.started_at = time.perf_counter()
+
+                            pending.append(
+                                executor.submit(_timed, stage.function, item)
+                            )
+
+                # pass on finished results in order, waiting for the oldest
+                # one if we can't take more input
+                while pending and (pending[0].done() or len(pending) >= limit or done):
+                    if not emit(pending.popleft()):
+                        return
+
+            stats.finished_at = time.perf_counter()
+            self._put(q_out, _DONE if error is None else error, stop)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
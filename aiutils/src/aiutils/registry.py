@@ -0,0 +1,174 @@
+"""
+A registry of models loaded once per process. Classes using the ModelMeta
+metaclass return the same instance every time they're called:
+
+>>> detector = TableDetector()  # loads the model
+>>> TableDetector() is detector
+True
+
+Looking up a loaded model doesn't take a lock. The registry is fork-aware:
+forking waits for models being loaded, so children never inherit half-loaded
+ones, and children drop the models that aren't fork-safe (e.g., those on a
+GPU), they're loaded again on first use. Call preload() before forking (e.g.,
+in gunicorn's or celery's master process) so workers share the weights
+copy-on-write instead of loading them each
+"""
+
+from itertools import chain
+import os
+import threading
+import time
+
+
+def module_bytes(*modules):
+    """Bytes taken by the parameters and buffers of torch modules"""
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for module in modules
+        for tensor in chain(module.parameters(), module.buffers())
+    )
+
+
+class ModelStats:
+    """How long a model took to load and how much memory it takes"""
+
+    def __init__(self, name, load_seconds, n_bytes, preloaded) -> None:
+        self.name = name
+        self.load_seconds = load_seconds
+        self.n_bytes = n_bytes
+        self.preloaded = preloaded
+        self.pid = os.getpid()
+
+    def __repr__(self) -> str:
+        n_bytes = "?" if self.n_bytes is None else f"{self.n_bytes / 1024**2:.1f}MB"
+        return (
+            f"ModelStats(name={self.name!r}, load_seconds={self.load_seconds:.2f}, "
+            f"size={n_bytes}, preloaded={self.preloaded}, pid={self.pid})"
+        )
+
+
+class ModelRegistry:
+    """
+    Holds the models loaded by this process, see the module's docstring.
+    Instances can report their size with a memory_usage() method (bytes) and
+    opt out of being inherited by forked processes with fork_safe = False
+    """
+
+    def __init__(self) -> None:
+        self._instances = {}
+        self._stats = {}
+        # reentrant, so a model can load other models (or fork) while loading
+        self._lock = threading.RLock()
+
+        if hasattr(os, "register_at_fork"):
+            # forking waits for models being loaded by other threads
+            os.register_at_fork(
+                before=self._before_fork,
+                after_in_parent=self._after_fork_in_parent,
+                after_in_child=self._after_fork_in_child,
+            )
+
+    def get(self, cls, *args, **kwargs):
+        """
+        Return the instance of cls, creating it with args and kwargs if it
+        doesn't exist (they're ignored afterwards)
+        """
+        # reading a dict is atomic, no lock needed once the model is loaded
+        instance = self._instances.get(cls)
+
+        if instance is not None:
+            return instance
+
+        return self._load(cls, args, kwargs, preloaded=False)
+
+    def _load(self, cls, args, kwargs, preloaded):
+        with self._lock:
+            # another thread might have loaded it while we waited
+            instance = self._instances.get(cls)
+
+            if instance is not None:
+                return instance
+
+            start = time.perf_counter()
+            instance = type.__call__(cls, *args, **kwargs)
+            load_seconds = time.perf_counter() - start
+            memory_usage = getattr(instance, "memory_usage", None)
+            self._stats[cls] = ModelStats(
+                cls.__qualname__,
+                load_seconds,
+                None if memory_usage is None else memory_usage(),
+                preloaded,
+            )
+            self._instances[cls] = instance
+            return instance
+
+    def preload(self, *classes):
+        """
+        Load models now, e.g., before forking so worker processes share them.
+        Loaded models are kept
+        """
+        for cls in classes:
+            if cls in self._instances:
+                self._stats[cls].preloaded = True
+            else:
+                self._load(cls, (), {}, preloaded=True)
+
+    def is_loaded(self, cls):
+        return cls in self._instances
+
+    def unload(self, cls=None):
+        """
+        Forget the instance of cls (or every instance), it's loaded again on
+        next use
+        """
+        with self._lock:
+            if cls is None:
+                self._instances.clear()
+                self._stats.clear()
+            else:
+                self._instances.pop(cls, None)
+                self._stats.pop(cls, None)
+
+    def stats(self):
+        """Return a list of ModelStats, one per loaded model"""
+        return list(self._stats.values())
+
+    @property
+    def n_bytes(self):
+        """Memory taken by the loaded models that report it"""
+        return sum(stats.n_bytes or 0 for stats in self._stats.values())
+
+    def _before_fork(self):
+        self._lock.acquire()
+
+    def _after_fork_in_parent(self):
+        self._lock.release()
+
+    def _after_fork_in_child(self):
+        # the lock was acquired before forking, start with a new one
+        self._lock = threading.RLock()
+
+        for cls, instance in list(self._instances.items()):
+            if getattr(instance, "fork_safe", True):
+                self._stats[cls].pid = os.getpid()
+            else:
+                del self._instances[cls]
+                del self._stats[cls]
+
+
+REGISTRY = ModelRegistry()
+
+
+class ModelMeta(type):
+    """
+    Metaclass for models managed by REGISTRY, calling the class returns the
+    process' instance
+    """
+
+    def __call__(cls, *args, **kwargs):
+        return REGISTRY.get(cls, *args, **kwargs)
+
+
+def preload(*classes):
+    """Load models in REGISTRY now, see ModelRegistry.preload"""
+    REGISTRY.preload(*classes)
@@ -0,0 +1,220 @@
+"""
+Build typed objects from cached responses (the output of model_dump()), an
+alternative to FrozenJSON for code that reads many fields per response. Pass
+them to APICache(response_type=..., chunk_type=...):
+
+* compile_schema(Model) returns a class with __slots__ for the fields of the
+  pydantic model, built from the dictionary with generated code, attribute
+  access runs at native speed
+
+* constructor(Model) returns a function that builds the pydantic model itself
+  with model_construct, skipping validation
+"""
+
+from copy import deepcopy
+from typing import Annotated, Union, get_args, get_origin
+import types
+
+from pydantic import BaseModel
+
+NoneType = type(None)
+
+# X | Y annotations, Python 3.10+
+UnionType = getattr(types, "UnionType", None)
+
+# values of these types are immutable, the rest are copied so objects don't
+# share them with the dictionary (which may be shared, e.g., by APICache's
+# in-memory cache)
+_SCALARS = (str, int, float, bool, NoneType)
+
+# pydantic model -> compiled class
+_COMPILED = {}
+
+
+def _is_model(annotation):
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def _copy(value):
+    return value if type(value) in _SCALARS else deepcopy(value)
+
+
+def _is_scalar(annotation):
+    """True if values of type annotation are never containers"""
+    if annotation in _SCALARS:
+        return True
+
+    origin = get_origin(annotation)
+
+    if origin is Annotated:
+        return _is_scalar(get_args(annotation)[0])
+
+    if origin is Union or (UnionType is not None and origin is UnionType):
+        return all(_is_scalar(arg) for arg in get_args(annotation))
+
+    return False
+
+
+def _converter(annotation, build):
+    """
+    Return a function that converts a dumped value of type annotation. Values
+    are copied unless they're scalars. build(model) returns the function for a
+    pydantic model
+    """
+    origin = get_origin(annotation)
+    args = get_args(annotation)
+
+    if _is_model(annotation):
+        return build(annotation)
+
+    if _is_scalar(annotation):
+        return None
+
+    if origin is Annotated:
+        return _converter(args[0], build)
+
+    if origin is Union or (UnionType is not None and origin is UnionType):
+        members = [arg for arg in args if arg is not NoneType]
+
+        # unions of several types are copied as they are, we can't tell which
+        # one a value is without validating it
+        if len(members) != 1:
+            return _copy
+
+        convert = _converter(members[0], build)
+
+        if convert is None:
+            return None
+
+        return lambda value: None if value is None else convert(value)
+
+    if origin in (list, tuple) and args:
+        # tuple[X, ...] or list[X]
+        if origin is tuple and (len(args) != 2 or args[1] is not Ellipsis):
+            return _copy
+
+        convert = _converter(args[0], build)
+
+        if convert is None:
+            return lambda values: None if values is None else list(values)
+
+        return lambda values: None if values is None else [convert(v) for v in values]
+
+    if origin is dict and len(args) == 2:
+        convert = _converter(args[1], build)
+
+        if convert is None:
+            return lambda values: None if values is None else dict(values)
+
+        return lambda values: (
+            None if values is None else {k: convert(v) for k, v in values.items()}
+        )
+
+    return _copy
+
+
+class CompiledModel:
+    """
+    Base class of the classes returned by compile_schema. Fields are
+    attributes, keys missing in the dictionary are None and extra keys are
+    available with [] (as FrozenJSON)
+    """
+
+    __slots__ = ("_data",)
+
+    # set by compile_schema
+    _model = None
+
+    def __getitem__(self, key):
+        if key in self.__slots__ and key != "_data":
+            return getattr(self, key)
+
+        return _copy(self._data[key])
+
+    def to_dict(self):
+        return deepcopy(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, CompiledModel):
+            return self._data == other._data
+
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(
+            f"{name}={getattr(self, name)!r}" for name in self.__slots__[1:]
+        )
+        return f"{type(self).__name__}({fields})"
+
+
+def compile_schema(model):
+    """
+    Compile a pydantic model into a CompiledModel subclass whose constructor
+    takes the output of model_dump(). Nested models (also in lists, tuples,
+    dictionaries and optional fields) are compiled as well, and containers are
+    copied. Classes are cached, so compiling a model again is free
+    """
+    compiled = _COMPILED.get(model)
+
+    if compiled is not None:
+        return compiled
+
+    # pydantic fields can't start with an underscore, so they don't clash with
+    # _data
+    names = list(model.model_fields)
+    cls = type(
+        model.__name__,
+        (CompiledModel,),
+        {
+            "__slots__": ("_data", *names),
+            "__module__": __name__,
+            "__qualname__": model.__qualname__,
+            "_model": model,
+        },
+    )
+    # register before compiling the fields, models may reference themselves
+    _COMPILED[model] = cls
+
+    namespace = {}
+    lines = ["def __init__(self, data):", "    self._data = data", "    get = data.get"]
+
+    for i, name in enumerate(names):
+        convert = _converter(model.model_fields[name].annotation, compile_schema)
+
+        if convert is None:
+            lines.append(f"    self.{name} = get({name!r})")
+        else:
+            namespace[f"convert_{i}"] = convert
+            lines.append(f"    self.{name} = convert_{i}(get({name!r}))")
+
+    exec("\n".join(lines), namespace)
+    cls.__init__ = namespace["__init__"]
+    return cls
+
+
+def constructor(model):
+    """
+    Return a function that builds the pydantic model from the output of
+    model_dump() with model_construct (no validation), nested models included.
+    Containers are copied, models don't share them with the dictionary
+    """
+    converters = {}
+
+    def construct(data):
+        # converters are resolved on first use, models may reference themselves
+        if not converters:
+            for name, field in model.model_fields.items():
+                converters[name] = _converter(field.annotation, constructor)
+
+        values = {}
+
+        for key, value in data.items():
+            # extra fields are copied
+            convert = converters.get(key, _copy)
+            values[key] = value if convert is None else convert(value)
+
+        return model.model_construct(**values)
+
+    return construct
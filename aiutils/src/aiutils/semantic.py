@@ -0,0 +1,303 @@
+"""
+Semantic (embedding similarity) index for APICache. Calls whose last user
+message is close enough to a cached one reuse the cached response
+"""
+
+from collections import namedtuple
+import threading
+
+import numpy as np
+
+from aiutils.backends import connect
+from aiutils.keys import make_key
+from aiutils.lru import LRUCache
+
+
+Query = namedtuple("Query", ["context", "vector"])
+
+
+def normalize_text(text):
+    return " ".join(text.split()).lower()
+
+
+def message_text(message):
+    """Return the text in a chat message, content can be a string or a list of
+    parts (e.g., when sending images)
+    """
+    content = message.get("content") or ""
+
+    if isinstance(content, str):
+        return content
+
+    return " ".join(part.get("text", "") for part in content)
+
+
+def split_messages(messages):
+    """
+    Split chat messages into the text of the last user message and the rest,
+    return None if there isn't a user message
+    """
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("role") == "user":
+            return message_text(messages[i]), messages[:i] + messages[i + 1 :]
+
+    return None
+
+
+class _Vectors:
+    """
+    The keys and embeddings of the calls in a context. Embeddings are rows of
+    a buffer with spare capacity, so adding one doesn't copy the rest
+    """
+
+    def __init__(self, keys, vectors) -> None:
+        self.keys = list(keys)
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+        self._buffer = np.vstack(vectors) if vectors else None
+
+    @property
+    def matrix(self):
+        return self._buffer[: len(self.keys)]
+
+    def add(self, key, vector):
+        i = self.positions.get(key)
+
+        if i is None:
+            i = len(self.keys)
+
+            # double the capacity when it's full
+            if self._buffer is None or i == len(self._buffer):
+                buffer = np.empty((max(2 * i, 16), len(vector)), dtype=np.float32)
+
+                if i:
+                    buffer[:i] = self.matrix
+
+                self._buffer = buffer
+
+            self.keys.append(key)
+            self.positions[key] = i
+
+        self._buffer[i] = vector
+
+    def remove(self, keys):
+        keep = [i for i, key in enumerate(self.keys) if key not in keys]
+
+        if len(keep) < len(self.keys):
+            self._buffer[: len(keep)] = self._buffer[keep]
+            self.keys = [self.keys[i] for i in keep]
+            self.positions = {key: i for i, key in enumerate(self.keys)}
+
+
+class SemanticIndex:
+    """
+    Nearest-neighbour index over the embeddings of the last user message of
+    chat calls.
+
+    Only calls that share a context are compared: the qualified name, every
+    kwarg other than messages (e.g., model, temperature), and the rest of the
+    messages, compared ignoring case and whitespace; system messages are
+    compared ignoring their order
+
+    Parameters
+    ----------
+    embed_function : callable
+        Takes a string and returns its embedding (a sequence of floats)
+
+    threshold : float, default=0.95
+        Minimum cosine similarity to reuse a cached response
+
+    path_to_db : str, optional
+        Where to store the embeddings, defaults to the database of the
+        APICache using the index
+    """
+
+    def __init__(self, embed_function, threshold=0.95, path_to_db=None) -> None:
+        self._embed_function = embed_function
+        self._threshold = threshold
+        self._path_to_db = path_to_db
+        self._connection = None
+        self._indexes = {}
+        self._embeddings = LRUCache(max_entries=1024)
+        self._lock = threading.RLock()
+
+    def connect(self, path_to_db):
+        """Use path_to_db to store embeddings unless a path was already given"""
+        with self._lock:
+            if self._connection is not None:
+                return
+
+            self._path_to_db = self._path_to_db or path_to_db
+            # guarded by self._lock, so it's ok to share it across threads
+            self._connection = connect(self._path_to_db)
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS semantic_index (
+                    key TEXT PRIMARY KEY,
+                    context TEXT NOT NULL,
+                    vector BLOB NOT NULL
+                )
+            """
+            )
+            self._connection.execute(
+                """
+                CREATE INDEX IF NOT EXISTS semantic_index_context
+                ON semantic_index (context)
+            """
+            )
+            self._connection.commit()
+
+    def __del__(self):
+        if self._connection is not None:
+            self._connection.close()
+
+    def embed(self, text):
+        """Return the normalized embedding of text"""
+        vector = self._embeddings.get(text)
+
+        if vector is None:
+            vector = np.asarray(self._embed_function(text), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+
+            # a zero vector isn't similar to anything, leave it as it is
+            # instead of dividing by zero
+            if norm > 0:
+                vector = vector / norm
+
+            self._embeddings.set(text, vector, size=vector.nbytes)
+
+        return vector
+
+    def encode(self, qualified_name, kwargs):
+        """Return the Query for a call, or None if it doesn't have a user message"""
+        messages = kwargs.get("messages")
+
+        if not isinstance(messages, list):
+            return None
+
+        split = split_messages(messages)
+
+        if split is None:
+            return None
+
+        text, rest = split
+        system = sorted(
+            normalize_text(message_text(m)) for m in rest if m.get("role") == "system"
+        )
+        history = [
+            (m.get("role"), normalize_text(message_text(m)))
+            for m in rest
+            if m.get("role") != "system"
+        ]
+        other = {k: v for k, v in kwargs.items() if k != "messages"}
+        context = make_key(
+            qualified_name, dict(kwargs=other, system=system, history=history)
+        )
+
+        return Query(context=context, vector=self.embed(normalize_text(text)))
+
+    def _index(self, context):
+        """Return the _Vectors of a context, loading them from disk if needed"""
+        index = self._indexes.get(context)
+
+        if index is None:
+            cursor = self._connection.execute(
+                "SELECT key, vector FROM semantic_index WHERE context = ?",
+                (context,),
+            )
+            rows = cursor.fetchall()
+            index = self._indexes[context] = _Vectors(
+                [key for key, _ in rows],
+                [np.frombuffer(vector, dtype=np.float32) for _, vector in rows],
+            )
+
+        return index
+
+    def search(self, query):
+        """
+        Return (key, similarity) for the most similar cached call, key is None
+        if no call is above the threshold
+        """
+        with self._lock:
+            index = self._index(query.context)
+
+            if not index.keys:
+                return None, None
+
+            similarities = index.matrix @ query.vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            key = index.keys[best]
+
+        if similarity < self._threshold:
+            return None, similarity
+
+        return key, similarity
+
+    def search_many(self, query, k=5):
+        """
+        Return up to k (key, similarity) pairs above the threshold, most
+        similar first. Use it to fall back to the next key when a cached
+        response has been evicted
+        """
+        with self._lock:
+            index = self._index(query.context)
+
+            if not index.keys:
+                return []
+
+            similarities = index.matrix @ query.vector
+            best = np.argsort(-similarities, kind="stable")[:k]
+            return [
+                (index.keys[i], float(similarities[i]))
+                for i in best
+                if similarities[i] >= self._threshold
+            ]
+
+    def keys(self):
+        """Return the keys of every indexed call"""
+        with self._lock:
+            cursor = self._connection.execute("SELECT key FROM semantic_index")
+            return [key for (key,) in cursor.fetchall()]
+
+    def remove(self, keys, batch_size=500):
+        """Remove calls from the index (e.g., once they're evicted from the cache)"""
+        keys = list(set(keys))
+
+        if not keys:
+            return
+
+        with self._lock:
+            removed = {}
+
+            # stay below SQLite's limit on the number of parameters
+            for i in range(0, len(keys), batch_size):
+                batch = keys[i : i + batch_size]
+                cursor = self._connection.execute(
+                    "DELETE FROM semantic_index "
+                    f"WHERE key IN ({', '.join('?' * len(batch))}) "
+                    "RETURNING key, context",
+                    batch,
+                )
+
+                for key, context in cursor.fetchall():
+                    removed.setdefault(context, set()).add(key)
+
+            self._connection.commit()
+
+            for context, removed_keys in removed.items():
+                index = self._indexes.get(context)
+
+                if index is not None:
+                    index.remove(removed_keys)
+
+    def add(self, query, key):
+        with self._lock:
+            self._connection.execute(
+                """
+                INSERT OR REPLACE INTO semantic_index (key, context, vector)
+                VALUES (?, ?, ?)
+            """,
+                (key, query.context, query.vector.tobytes()),
+            )
+            self._connection.commit()
+            self._index(query.context).add(key, query.vector)
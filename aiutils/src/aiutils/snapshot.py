@@ -0,0 +1,238 @@
+"""
+Export, import and merge cache entries, e.g., to pre-warm a new deployment from
+a snapshot of a production cache. Everything is streamed in batches so
+snapshots don't need to fit in memory.
+
+Snapshots are JSONL files (one entry per line) or Parquet files (requires
+pyarrow), the format is inferred from the extension. Entries are stored
+decoded, so snapshots don't depend on the codec used by the database
+"""
+
+from pathlib import Path
+import json
+import time
+
+from aiutils.backends import Entry, SQLiteBackend
+from aiutils.codecs import Codec, DEFAULT_CODEC, dictionary_id, encoded_size
+from aiutils.keys import make_key
+
+
+def _format(path):
+    suffix = Path(path).suffix
+
+    if suffix == ".parquet":
+        return "parquet"
+    elif suffix in {".jsonl", ".ndjson"}:
+        return "jsonl"
+
+    raise ValueError(
+        f"Cannot infer the snapshot format from {str(path)!r}, "
+        "use a .jsonl or .parquet extension"
+    )
+
+
+def _batched(iterable, size):
+    batch = []
+
+    for item in iterable:
+        batch.append(item)
+
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _created_after(max_age):
+    return None if max_age is None else time.time() - max_age
+
+
+def _decoded_records(backend, qualified_name, max_age):
+    codecs = {}
+
+    for entry in backend.iter_entries(
+        qualified_name=qualified_name, created_after=_created_after(max_age)
+    ):
+        if entry.codec not in codecs:
+            codecs[entry.codec] = Codec.from_name(entry.codec, backend.get_dictionary)
+
+        codec = codecs[entry.codec]
+
+        yield dict(
+            key=entry.key,
+            qualified_name=entry.qualified_name,
+            kwargs=codec.decode(entry.kwargs),
+            response=codec.decode(entry.response),
+            created_at=entry.created_at,
+            expires_at=entry.expires_at,
+        )
+
+
+def export_entries(
+    path_to_db, path, *, qualified_name=None, max_age=None, batch_size=1_000
+):
+    """
+    Write the entries in a cache database to a JSONL or Parquet file, returns
+    the number of exported entries.
+
+    Parameters
+    ----------
+    qualified_name : str, optional
+        Only export entries for this function (e.g., "openai.resources...")
+
+    max_age : float, optional
+        Only export entries created in the last max_age seconds
+    """
+    backend = SQLiteBackend(path_to_db, read_only=True)
+    records = _decoded_records(backend, qualified_name, max_age)
+    count = 0
+
+    if _format(path) == "jsonl":
+        with open(path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+                count += 1
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema(
+            [
+                ("key", pa.string()),
+                ("qualified_name", pa.string()),
+                ("kwargs", pa.string()),
+                ("response", pa.string()),
+                ("created_at", pa.float64()),
+                ("expires_at", pa.float64()),
+            ]
+        )
+
+        with pq.ParquetWriter(path, schema) as writer:
+            for batch in _batched(records, batch_size):
+                for record in batch:
+                    record["kwargs"] = json.dumps(record["kwargs"])
+                    record["response"] = json.dumps(record["response"])
+
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+                count += len(batch)
+
+    backend.close()
+    return count
+
+
+def _read_records(path, batch_size):
+    if _format(path) == "jsonl":
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            for record in batch.to_pylist():
+                record["kwargs"] = json.loads(record["kwargs"])
+                record["response"] = json.loads(record["response"])
+                yield record
+
+
+def _matches(entry, qualified_name, created_after):
+    return (qualified_name is None or entry.qualified_name == qualified_name) and (
+        created_after is None or entry.created_at > created_after
+    )
+
+
+def _upsert(backend, entries, batch_size):
+    count = 0
+
+    for batch in _batched(entries, batch_size):
+        backend.set_many(batch)
+        count += len(batch)
+
+    return count
+
+
+def import_entries(
+    path,
+    path_to_db,
+    *,
+    codec=None,
+    qualified_name=None,
+    max_age=None,
+    batch_size=1_000,
+):
+    """
+    Load entries from a JSONL or Parquet file (see export_entries) into a
+    cache database, creating it if needed. Entries are deduplicated by key,
+    keeping the most recently created one. Returns the number of entries read
+    (after filtering)
+
+    Parameters
+    ----------
+    codec : aiutils.codecs.Codec, optional
+        Codec to encode the entries with, defaults to uncompressed JSON
+    """
+    codec = codec or DEFAULT_CODEC
+    created_after = _created_after(max_age)
+    now = time.time()
+    backend = SQLiteBackend(path_to_db)
+
+    def entries():
+        for record in _read_records(path, batch_size):
+            kwargs = codec.encode(record["kwargs"])
+            response = codec.encode(record["response"])
+            entry = Entry(
+                # recompute the key in case the file was edited by hand
+                key=make_key(record["qualified_name"], record["kwargs"]),
+                qualified_name=record["qualified_name"],
+                kwargs=kwargs,
+                response=response,
+                created_at=record["created_at"],
+                accessed_at=now,
+                expires_at=record["expires_at"],
+                size=encoded_size(kwargs) + encoded_size(response),
+                codec=codec.name,
+            )
+
+            expired = entry.expires_at is not None and entry.expires_at <= now
+
+            if not expired and _matches(entry, qualified_name, created_after):
+                yield entry
+
+    if codec.dictionary is not None:
+        backend.set_dictionary(dictionary_id(codec.dictionary), codec.dictionary)
+
+    count = _upsert(backend, entries(), batch_size)
+    backend.close()
+    return count
+
+
+def merge(
+    source_db, path_to_db, *, qualified_name=None, max_age=None, batch_size=1_000
+):
+    """
+    Copy the entries from one cache database into another, deduplicating by
+    key and keeping the most recently created entry. Entries are copied
+    without re-encoding them. source_db is opened read-only and must exist.
+    Returns the number of entries read from source_db
+    """
+    source = SQLiteBackend(source_db, read_only=True)
+    target = SQLiteBackend(path_to_db)
+
+    # copy the dictionaries before the entries, so the target can decode every
+    # entry it holds, even if the merge fails halfway
+    for id_, data in source.connection.execute(
+        "SELECT id, data FROM codec_dictionaries"
+    ):
+        target.set_dictionary(id_, data)
+
+    entries = source.iter_entries(
+        qualified_name=qualified_name, created_after=_created_after(max_age)
+    )
+    count = _upsert(target, entries, batch_size)
+
+    source.close()
+    target.close()
+    return count
@@ -0,0 +1,220 @@
+"""
+A persistent cache of the tables extracted from PDF pages, see
+Document(table_cache=...). Entries are keyed by the content of the page (not
+the whole file), the models used and the render matrix, so editing a page only
+invalidates that page and processing an unchanged document again is a pure read
+"""
+
+from collections import namedtuple
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+import hashlib
+import json
+import time
+
+import numpy as np
+
+from aiutils import CACHE_PATH, tables
+from aiutils.backends import ThreadConnections
+from aiutils.keys import canonical_kwargs
+
+# bump this when the extraction code changes the results, it invalidates every
+# entry
+FORMAT_VERSION = 1
+
+# the rows and columns of every table in a page, one record per bbox
+AXIS_DTYPE = np.dtype(
+    [("table", np.int32), ("axis", np.uint8), ("bbox", np.float64, (4,))]
+)
+ROW, COLUMN = 0, 1
+
+
+PageTables = namedtuple("PageTables", ["objects", "grids", "tables"])
+PageTables.__doc__ = """
+The tables in a page: objects are the tables found by tables.TableDetector
+(label, score and bbox), grids their tables.CellGrid and tables the text in
+each cell, as returned by tables.apply_ocr
+"""
+
+
+def page_fingerprint(doc, page_number):
+    """
+    Digest of what determines how a page of a fitz document renders: the page
+    dictionary, its content streams and the objects it uses (images, forms,
+    fonts and annotations)
+    """
+    page = doc[page_number]
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(doc.xref_object(page.xref, compressed=True).encode("utf-8"))
+    digest.update(page.read_contents())
+
+    xrefs = {image[0] for image in page.get_images(full=True)}
+    xrefs.update(xobject[0] for xobject in page.get_xobjects())
+    xrefs.update(font[0] for font in page.get_fonts(full=True))
+    xrefs.update(annot.xref for annot in page.annots())
+
+    for xref in sorted(xrefs):
+        if xref <= 0:
+            continue
+
+        digest.update(doc.xref_object(xref, compressed=True).encode("utf-8"))
+
+        if doc.xref_is_stream(xref):
+            digest.update(doc.xref_stream_raw(xref))
+
+    return digest.hexdigest()
+
+
+def models_revision():
+    """Identify the models and the OCR engine used to extract tables"""
+    try:
+        easyocr_version = version("easyocr")
+    except PackageNotFoundError:
+        easyocr_version = None
+
+    return dict(
+        format=FORMAT_VERSION,
+        detection=list(tables.DETECTION_MODEL),
+        structure=list(tables.STRUCTURE_MODEL),
+        ocr=["easyocr", easyocr_version, list(tables.OCR_LANGUAGES)],
+    )
+
+
+def _pack_grids(grids):
+    arrays = []
+
+    for i, grid in enumerate(grids):
+        for axis, bboxes in ((ROW, grid.rows), (COLUMN, grid.columns)):
+            records = np.empty(len(bboxes), dtype=AXIS_DTYPE)
+            records["table"] = i
+            records["axis"] = axis
+            records["bbox"] = bboxes
+            arrays.append(records)
+
+    return np.concatenate(arrays).tobytes() if arrays else b""
+
+
+def _unpack_grids(data, n_tables):
+    records = np.frombuffer(data, dtype=AXIS_DTYPE)
+    grids = []
+
+    for i in range(n_tables):
+        table = records[records["table"] == i]
+        grids.append(
+            tables.CellGrid(
+                table["bbox"][table["axis"] == ROW],
+                table["bbox"][table["axis"] == COLUMN],
+            )
+        )
+
+    return grids
+
+
+class TableCache:
+    """
+    Store the tables extracted from each page in a SQLite database. Boxes and
+    text are stored as JSON and cell grids as packed arrays (AXIS_DTYPE)
+
+    Parameters
+    ----------
+    path_to_db : str, optional
+        Path to the database, defaults to ~/.aiutils/tables.db
+
+    revision : dict, optional
+        Identifies the models used, defaults to models_revision(). Entries
+        written with a different revision are never returned
+    """
+
+    def __init__(self, path_to_db=None, *, revision=None) -> None:
+        self._path_to_db = path_to_db or CACHE_PATH.parent / "tables.db"
+        self._revision = canonical_kwargs(
+            models_revision() if revision is None else revision
+        )
+        self._connections = ThreadConnections(self._path_to_db)
+        self.create_db()
+
+    @property
+    def connection(self):
+        """The connection for the current thread"""
+        return self._connections.get()
+
+    def create_db(self):
+        Path(self._path_to_db).parent.mkdir(parents=True, exist_ok=True)
+        connection = self.connection
+        connection.execute("PRAGMA journal_mode = WAL")
+
+        with connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS page_tables (
+                    key TEXT PRIMARY KEY,
+                    objects TEXT NOT NULL,
+                    grids BLOB NOT NULL,
+                    tables TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """
+            )
+
+    def key(self, fingerprint, matrix):
+        """
+        Return the key for a page with the given page_fingerprint, rendered
+        with matrix (a fitz.Matrix or its six values)
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(fingerprint.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(json.dumps([float(v) for v in matrix]).encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(self._revision.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the PageTables stored for key, or None"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """Return a dictionary with the PageTables of the keys that are stored"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+
+        # stay below SQLite's limit on the number of parameters
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            cursor = self.connection.execute(
+                "SELECT key, objects, grids, tables FROM page_tables "
+                f"WHERE key IN ({placeholders})",
+                batch,
+            )
+
+            for key, objects, grids, tables_ in cursor:
+                objects = json.loads(objects)
+                found[key] = PageTables(
+                    objects=objects,
+                    grids=_unpack_grids(grids, len(objects)),
+                    tables=json.loads(tables_),
+                )
+
+        return found
+
+    def set(self, key, page_tables):
+        """Store the PageTables of a page, replacing any existing entry"""
+        with self.connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO page_tables "
+                "(key, objects, grids, tables, created_at) VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    json.dumps(page_tables.objects),
+                    _pack_grids(page_tables.grids),
+                    json.dumps(page_tables.tables),
+                    time.time(),
+                ),
+            )
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM page_tables").fetchone()[0]
+
+    def close(self):
+        self._connections.close()
@@ -1,35 +1,92 @@
 """
 Code adapted from: https://huggingface.co/spaces/nielsr/tatr-demo/blob/main/app.py
+
+Heavy libraries (torch, torchvision, transformers, easyocr, pandas) are imported
+when first needed and models are loaded on first use, so importing this module
+is cheap. Plotting helpers live in aiutils.visualize
 """
 
-import io
-import csv
 from copy import deepcopy
+import csv
+import io
 
-import torch
-from torchvision import transforms
-from transformers import AutoModelForObjectDetection
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.patches import Patch
-from PIL import Image, ImageDraw
+from PIL import ImageDraw
 import numpy as np
-import pandas as pd
-import easyocr
 
-from aiutils._singleton import SingletonMeta
+from aiutils.registry import ModelMeta, module_bytes, preload as _preload
+
+# (name, revision) of the models and the OCR languages, they're part of the key
+# of aiutils.tablecache entries
+DETECTION_MODEL = ("microsoft/table-transformer-detection", "no_timm")
+STRUCTURE_MODEL = ("microsoft/table-transformer-structure-recognition-v1.1-all", "main")
+OCR_LANGUAGES = ("en",)
+
+# apply_ocr stacks the cells of a table into a few images, separated by this
+# many pixels so text in different cells isn't detected as a single box
+OCR_PADDING = 16
+
+# easyocr shrinks images whose longest side is over its canvas_size, stacked
+# images are kept below it
+OCR_MAX_HEIGHT = 2560
+
+# lines recognized per forward pass, easyocr ignores it (and reads one line at
+# a time) on CPU
+OCR_BATCH_SIZE = 64
+
+
+class OCRReader(metaclass=ModelMeta):
+    """The easyocr reader, loaded once per process on first use"""
+
+    def __init__(self):
+        import easyocr
 
+        self._reader = easyocr.Reader(list(OCR_LANGUAGES))
 
-reader = easyocr.Reader(["en"])
+    @property
+    def fork_safe(self):
+        # CUDA can't be used after a fork
+        return self._reader.device == "cpu"
+
+    def memory_usage(self):
+        return module_bytes(self._reader.detector, self._reader.recognizer)
+
+    def readtext(self, image, **kwargs):
+        return self._reader.readtext(image, **kwargs)
+
+
+def preload():
+    """
+    Load the models now. Call it before forking worker processes (e.g., in
+    gunicorn's master process) so they share the models instead of loading
+    them each, see aiutils.registry
+    """
+    _preload(TableDetector, TableStructureDetector, OCRReader)
+
+
+def __getattr__(name):
+    # backwards compatibility, these used to be module attributes
+    if name == "reader":
+        return OCRReader()
+
+    if name in {"fig2img", "visualize_detected_tables"}:
+        from aiutils import visualize
+
+        return getattr(visualize, name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def box_cxcywh_to_xyxy(x):
+    import torch
+
     x_c, y_c, w, h = x.unbind(-1)
     b = [(x_c - 0.5 * w), (y_c - 0.5 * h), (x_c + 0.5 * w), (y_c + 0.5 * h)]
     return torch.stack(b, dim=1)
 
 
 def rescale_bboxes(out_bbox, size):
+    import torch
+
     width, height = size
     boxes = box_cxcywh_to_xyxy(out_bbox)
     boxes = boxes * torch.tensor([width, height, width, height], dtype=torch.float32)
@@ -37,23 +94,95 @@ def rescale_bboxes(out_bbox, size):
 
 
 def outputs_to_objects(outputs, img_size, id2label):
+    return outputs_to_objects_batch(outputs, [img_size], id2label)[0]
+
+
+def outputs_to_objects_batch(outputs, img_sizes, id2label):
+    """
+    Like outputs_to_objects, for a batch of images. Scores, labels and boxes
+    are computed for the whole batch at once
+    """
+    import torch
+
     m = outputs.logits.softmax(-1).max(-1)
-    pred_labels = list(m.indices.detach().cpu().numpy())[0]
-    pred_scores = list(m.values.detach().cpu().numpy())[0]
-    pred_bboxes = outputs["pred_boxes"].detach().cpu()[0]
-    pred_bboxes = [elem.tolist() for elem in rescale_bboxes(pred_bboxes, img_size)]
+    pred_labels = m.indices.detach().cpu().numpy()
+    pred_scores = m.values.detach().cpu().numpy()
+
+    # (batch, queries, 4) boxes, rescaled to the size of each image
+    pred_bboxes = outputs["pred_boxes"].detach().cpu()
+    n_images, n_queries, _ = pred_bboxes.shape
+    boxes = box_cxcywh_to_xyxy(pred_bboxes.reshape(-1, 4)).reshape(
+        n_images, n_queries, 4
+    )
+    scale = torch.tensor(
+        [[width, height, width, height] for width, height in img_sizes],
+        dtype=torch.float32,
+    )
+    pred_bboxes = (boxes * scale[:, None, :]).numpy()
+
+    no_object = [label for label, name in id2label.items() if name == "no object"]
+    keep = ~np.isin(pred_labels, no_object)
+
+    return [
+        [
+            {
+                "label": id2label[int(label)],
+                "score": float(score),
+                "bbox": [float(elem) for elem in bbox],
+            }
+            for label, score, bbox in zip(
+                pred_labels[i][keep[i]],
+                pred_scores[i][keep[i]],
+                pred_bboxes[i][keep[i]],
+            )
+        ]
+        for i in range(n_images)
+    ]
+
+
+def _id2label(model):
+    id2label = dict(model.config.id2label)
+    id2label[len(id2label)] = "no object"
+    return id2label
+
+
+def _pad_batch(tensors):
+    """
+    Stack (channels, height, width) tensors of different sizes into a batch,
+    padding them at the bottom and right. Returns the batch and the pixel mask
+    (1 for real pixels, 0 for padding)
+    """
+    import torch
+
+    height = max(t.shape[1] for t in tensors)
+    width = max(t.shape[2] for t in tensors)
+    batch = torch.zeros((len(tensors), tensors[0].shape[0], height, width))
+    mask = torch.zeros((len(tensors), height, width), dtype=torch.long)
 
+    for i, t in enumerate(tensors):
+        batch[i, :, : t.shape[1], : t.shape[2]] = t
+        mask[i, : t.shape[1], : t.shape[2]] = 1
+
+    return batch, mask
+
+
+def _detect_batch(model, transform, device, images, batch_size):
+    """Run model over images in batches, returns the objects in each image"""
+    import torch
+
+    id2label = _id2label(model)
     objects = []
-    for label, score, bbox in zip(pred_labels, pred_scores, pred_bboxes):
-        class_label = id2label[int(label)]
-        if not class_label == "no object":
-            objects.append(
-                {
-                    "label": class_label,
-                    "score": float(score),
-                    "bbox": [float(elem) for elem in bbox],
-                }
-            )
+
+    for start in range(0, len(images), batch_size):
+        batch = images[start : start + batch_size]
+        pixel_values, pixel_mask = _pad_batch([transform(image) for image in batch])
+
+        with torch.no_grad():
+            outputs = model(pixel_values.to(device), pixel_mask=pixel_mask.to(device))
+
+        objects.extend(
+            outputs_to_objects_batch(outputs, [image.size for image in batch], id2label)
+        )
 
     return objects
 
@@ -73,8 +202,12 @@ class MaxResize(object):
         return resized_image
 
 
-class TableDetector(metaclass=SingletonMeta):
+class TableDetector(metaclass=ModelMeta):
     def __init__(self):
+        import torch
+        from torchvision import transforms
+        from transformers import AutoModelForObjectDetection
+
         self._device = "cuda" if torch.cuda.is_available() else "cpu"
 
         self._detection_transform = transforms.Compose(
@@ -85,137 +218,64 @@ class TableDetector(metaclass=SingletonMeta):
             ]
         )
 
+        name, revision = DETECTION_MODEL
         self._model = AutoModelForObjectDetection.from_pretrained(
-            "microsoft/table-transformer-detection", revision="no_timm"
+            name, revision=revision
         ).to(self._device)
 
+    @property
+    def fork_safe(self):
+        return self._device == "cpu"
+
+    def memory_usage(self):
+        return module_bytes(self._model)
+
     def detect(self, image):
         """Return a list of detected tables in the image."""
+        import torch
+
         pixel_values = self._detection_transform(image).unsqueeze(0).to(self._device)
 
         with torch.no_grad():
             outputs = self._model(pixel_values)
 
-        id2label = self._model.config.id2label
-        id2label[len(self._model.config.id2label)] = "no object"
-        detected_tables = outputs_to_objects(outputs, image.size, id2label)
+        detected_tables = outputs_to_objects(
+            outputs, image.size, _id2label(self._model)
+        )
 
         return detected_tables
 
-
-def fig2img(fig):
-    """Convert a Matplotlib figure to a PIL Image and return it"""
-    buf = io.BytesIO()
-    fig.savefig(buf)
-    buf.seek(0)
-    image = Image.open(buf)
-    return image
-
-
-def visualize_detected_tables(img, det_tables):
-    plt.imshow(img, interpolation="lanczos")
-
-    fig = plt.gcf()
-    fig.set_size_inches(20, 20)
-    ax = plt.gca()
-
-    for det_table in det_tables:
-        bbox = det_table["bbox"]
-
-        if det_table["label"] == "table":
-            facecolor = (1, 0, 0.45)
-            edgecolor = (1, 0, 0.45)
-            alpha = 0.3
-            linewidth = 2
-            hatch = "//////"
-        elif det_table["label"] == "table rotated":
-            facecolor = (0.95, 0.6, 0.1)
-            edgecolor = (0.95, 0.6, 0.1)
-            alpha = 0.3
-            linewidth = 2
-            hatch = "//////"
-        else:
-            continue
-
-        rect = patches.Rectangle(
-            bbox[:2],
-            bbox[2] - bbox[0],
-            bbox[3] - bbox[1],
-            linewidth=linewidth,
-            edgecolor="none",
-            facecolor=facecolor,
-            alpha=0.1,
+    def detect_batch(self, images, batch_size=8):
+        """
+        Like detect, for a list of images. Images are padded to the same size
+        and each batch of batch_size images runs in a single forward pass
+        """
+        return _detect_batch(
+            self._model,
+            self._detection_transform,
+            self._device,
+            images,
+            batch_size,
         )
-        ax.add_patch(rect)
-        rect = patches.Rectangle(
-            bbox[:2],
-            bbox[2] - bbox[0],
-            bbox[3] - bbox[1],
-            linewidth=linewidth,
-            edgecolor=edgecolor,
-            facecolor="none",
-            linestyle="-",
-            alpha=alpha,
-        )
-        ax.add_patch(rect)
-        rect = patches.Rectangle(
-            bbox[:2],
-            bbox[2] - bbox[0],
-            bbox[3] - bbox[1],
-            linewidth=0,
-            edgecolor=edgecolor,
-            facecolor="none",
-            linestyle="-",
-            hatch=hatch,
-            alpha=0.2,
-        )
-        ax.add_patch(rect)
-
-    plt.xticks([], [])
-    plt.yticks([], [])
-
-    legend_elements = [
-        Patch(
-            facecolor=(1, 0, 0.45),
-            edgecolor=(1, 0, 0.45),
-            label="Table",
-            hatch="//////",
-            alpha=0.3,
-        ),
-        Patch(
-            facecolor=(0.95, 0.6, 0.1),
-            edgecolor=(0.95, 0.6, 0.1),
-            label="Table (rotated)",
-            hatch="//////",
-            alpha=0.3,
-        ),
-    ]
-    plt.legend(
-        handles=legend_elements,
-        bbox_to_anchor=(0.5, -0.02),
-        loc="upper center",
-        borderaxespad=0,
-        fontsize=10,
-        ncol=2,
-    )
-    plt.gcf().set_size_inches(10, 10)
-    plt.axis("off")
-
-    return fig2img(fig)
 
 
 def crop_tables(image, tables):
     return [image.crop(table["bbox"]) for table in tables]
 
 
-class TableStructureDetector(metaclass=SingletonMeta):
+class TableStructureDetector(metaclass=ModelMeta):
     """Detect the structure of a table in an image (rows and columns)"""
 
     def __init__(self):
+        import torch
+        from torchvision import transforms
+        from transformers import AutoModelForObjectDetection
+
         self._device = "cuda" if torch.cuda.is_available() else "cpu"
 
+        name, revision = STRUCTURE_MODEL
         self._structure_model = AutoModelForObjectDetection.from_pretrained(
-            "microsoft/table-transformer-structure-recognition-v1.1-all"
+            name, revision=revision
         ).to(self._device)
 
         self._structure_transform = transforms.Compose(
@@ -226,8 +286,21 @@ class TableStructureDetector(metaclass=SingletonMeta):
             ]
         )
 
-    def detect(self, image_table):
-        """Detect the structure of a single table"""
+    @property
+    def fork_safe(self):
+        return self._device == "cpu"
+
+    def memory_usage(self):
+        return module_bytes(self._structure_model)
+
+    def detect(self, image_table, visualize=True):
+        """
+        Detect the structure of a single table, returns a copy of the image
+        with the cells drawn (the image itself if visualize is False) and the
+        cells
+        """
+        import torch
+
         pixel_values = (
             self._structure_transform(image_table).unsqueeze(0).to(self._device)
         )
@@ -236,103 +309,259 @@ class TableStructureDetector(metaclass=SingletonMeta):
             outputs = self._structure_model(pixel_values)
 
         # postprocess to get individual elements
-        id2label = self._structure_model.config.id2label
-        id2label[len(self._structure_model.config.id2label)] = "no object"
-        cells = outputs_to_objects(outputs, image_table.size, id2label)
+        cells = outputs_to_objects(
+            outputs, image_table.size, _id2label(self._structure_model)
+        )
+
+        if visualize:
+            image_table = _draw_cells(image_table, cells)
+
+        return image_table, cells
+
+    def detect_batch(self, images_table, batch_size=8, visualize=False):
+        """
+        Like detect, for a list of tables. Images are padded to the same size
+        and each batch of batch_size tables runs in a single forward pass.
+        Unlike detect, cells aren't drawn unless visualize is True
+        """
+        batch_cells = _detect_batch(
+            self._structure_model,
+            self._structure_transform,
+            self._device,
+            images_table,
+            batch_size,
+        )
+        return [
+            (_draw_cells(image_table, cells) if visualize else image_table, cells)
+            for image_table, cells in zip(images_table, batch_cells)
+        ]
 
-        # visualize cells on cropped table
-        image_table = deepcopy(image_table)
 
-        draw = ImageDraw.Draw(image_table)
+def _draw_cells(image_table, cells):
+    """Return a copy of a table image with the cells drawn"""
+    image_table = deepcopy(image_table)
+    draw = ImageDraw.Draw(image_table)
 
-        for cell in cells:
-            draw.rectangle(cell["bbox"], outline="red")
+    for cell in cells:
+        draw.rectangle(cell["bbox"], outline="red")
+
+    return image_table
 
-        return image_table, cells
+
+# one record per cell, see CellGrid.to_records
+CELL_DTYPE = np.dtype(
+    [("row", np.int32), ("column", np.int32), ("bbox", np.float32, (4,))]
+)
+
+
+class CellGrid:
+    """
+    The cells of a table, as the bboxes of its rows (sorted top to bottom) and
+    columns (sorted left to right). Cell (i, j) spans column j horizontally and
+    row i vertically
+
+    Parameters
+    ----------
+    rows : array-like
+        (n_rows, 4) array of row bboxes (x0, y0, x1, y1)
+
+    columns : array-like
+        (n_columns, 4) array of column bboxes
+    """
+
+    def __init__(self, rows, columns) -> None:
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, 4)
+        columns = np.asarray(columns, dtype=np.float64).reshape(-1, 4)
+        self.rows = rows[np.argsort(rows[:, 1], kind="stable")]
+        self.columns = columns[np.argsort(columns[:, 0], kind="stable")]
+
+    @classmethod
+    def from_objects(cls, table_data):
+        """Build the grid from the output of TableStructureDetector.detect"""
+        return cls(
+            [entry["bbox"] for entry in table_data if entry["label"] == "table row"],
+            [entry["bbox"] for entry in table_data if entry["label"] == "table column"],
+        )
+
+    @property
+    def shape(self):
+        return len(self.rows), len(self.columns)
+
+    @property
+    def cells(self):
+        """(n_rows, n_columns, 4) array with the bbox of each cell"""
+        n_rows, n_columns = self.shape
+        cells = np.empty((n_rows, n_columns, 4))
+        cells[..., 0] = self.columns[None, :, 0]
+        cells[..., 1] = self.rows[:, None, 1]
+        cells[..., 2] = self.columns[None, :, 2]
+        cells[..., 3] = self.rows[:, None, 3]
+        return cells
+
+    def to_records(self):
+        """Return the cells as a structured array (row, column, bbox), by row"""
+        n_rows, n_columns = self.shape
+        records = np.empty(n_rows * n_columns, dtype=CELL_DTYPE)
+        rows, columns = np.indices((n_rows, n_columns))
+        records["row"] = rows.ravel()
+        records["column"] = columns.ravel()
+        records["bbox"] = self.cells.reshape(-1, 4)
+        return records
+
+    def to_dicts(self):
+        """Return the cells in the format of get_cell_coordinates_by_row"""
+        cells = self.cells.tolist()
+        columns = self.columns.tolist()
+        return [
+            {
+                "row": row,
+                "cells": [
+                    {"column": column, "cell": cell}
+                    for column, cell in zip(columns, row_cells)
+                ],
+                "cell_count": len(columns),
+            }
+            for row, row_cells in zip(self.rows.tolist(), cells)
+        ]
+
+
+def get_cell_grid(table_data):
+    """Return the CellGrid for the output of TableStructureDetector.detect"""
+    return CellGrid.from_objects(table_data)
 
 
 def get_cell_coordinates_by_row(table_data):
-    # Extract rows and columns
-    rows = [entry for entry in table_data if entry["label"] == "table row"]
-    columns = [entry for entry in table_data if entry["label"] == "table column"]
-
-    # Sort rows and columns by their Y and X coordinates, respectively
-    rows.sort(key=lambda x: x["bbox"][1])
-    columns.sort(key=lambda x: x["bbox"][0])
-
-    # Function to find cell coordinates
-    def find_cell_coordinates(row, column):
-        cell_bbox = [
-            column["bbox"][0],
-            row["bbox"][1],
-            column["bbox"][2],
-            row["bbox"][3],
+    """
+    Return a list with a dictionary per row (top to bottom) with the row bbox
+    and its cells (left to right). get_cell_grid returns a more compact form
+    """
+    return get_cell_grid(table_data).to_dicts()
+
+
+def _cell_boxes(cell_coordinates):
+    """
+    Return a (rows, columns, 4) array with the bbox of each cell, from a
+    CellGrid, its records or the output of get_cell_coordinates_by_row
+    """
+    if isinstance(cell_coordinates, CellGrid):
+        return cell_coordinates.cells
+
+    if isinstance(cell_coordinates, np.ndarray):
+        if not len(cell_coordinates):
+            return np.empty((0, 0, 4))
+
+        n_rows = cell_coordinates["row"].max() + 1
+        n_columns = cell_coordinates["column"].max() + 1
+        boxes = np.full((n_rows, n_columns, 4), np.nan)
+        boxes[cell_coordinates["row"], cell_coordinates["column"]] = cell_coordinates[
+            "bbox"
         ]
-        return cell_bbox
+        return boxes
 
-    # Generate cell coordinates and count cells in each row
-    cell_coordinates = []
+    n_rows = len(cell_coordinates)
+    n_columns = max((row["cell_count"] for row in cell_coordinates), default=0)
+    boxes = np.full((n_rows, n_columns, 4), np.nan)
 
-    for row in rows:
-        row_cells = []
-        for column in columns:
-            cell_bbox = find_cell_coordinates(row, column)
-            row_cells.append({"column": column["bbox"], "cell": cell_bbox})
+    for i, row in enumerate(cell_coordinates):
+        for j, cell in enumerate(row["cells"]):
+            boxes[i, j] = cell["cell"]
+
+    return boxes
 
-        # Sort cells in the row by X coordinate
-        row_cells.sort(key=lambda x: x["column"][0])
 
-        # Append row information to cell_coordinates
-        cell_coordinates.append(
-            {"row": row["bbox"], "cells": row_cells, "cell_count": len(row_cells)}
+def _stack_cells(image, cells, max_height, padding):
+    """
+    Stack the crops of cells (x0, y0, x1, y1 integer boxes) of image vertically
+    on a white background, in images up to max_height pixels tall. Yields
+    (index of the first cell, stacked image, y coordinate of each cell in it)
+    """
+    height, width = image.shape[:2]
+    cells = np.clip(cells, 0, [width, height, width, height])
+    heights = np.maximum(cells[:, 3] - cells[:, 1], 0)
+    widths = np.maximum(cells[:, 2] - cells[:, 0], 0)
+    start = 0
+
+    while start < len(cells):
+        tops, bottom, end = [], padding, start
+
+        # a cell taller than max_height gets an image of its own
+        while end < len(cells) and (
+            end == start or bottom + heights[end] + padding <= max_height
+        ):
+            tops.append(bottom)
+            bottom += heights[end] + padding
+            end += 1
+
+        stacked = np.full(
+            (bottom, widths[start:end].max() + 2 * padding, *image.shape[2:]),
+            255,
+            dtype=image.dtype,
         )
 
-    # Sort rows from top to bottom
-    cell_coordinates.sort(key=lambda x: x["row"][1])
-
-    return cell_coordinates
-
-
-def apply_ocr(cell_coordinates, cropped_table):
-    # let's OCR row by row
-    data = dict()
-    max_num_columns = 0
-    for idx, row in enumerate(cell_coordinates):
-        row_text = []
-        for cell in row["cells"]:
-            # crop cell out of image
-            cell_image = np.array(cropped_table.crop(cell["cell"]))
-            # apply OCR
-            result = reader.readtext(np.array(cell_image))
-            if len(result) > 0:
-                text = " ".join([x[1] for x in result])
-                row_text.append(text)
-
-        if len(row_text) > max_num_columns:
-            max_num_columns = len(row_text)
-
-        data[str(idx)] = row_text
-
-    # pad rows which don't have max_num_columns elements
-    # to make sure all rows have the same number of columns
-    for idx, row_data in data.copy().items():
-        if len(row_data) != max_num_columns:
-            row_data = row_data + ["" for _ in range(max_num_columns - len(row_data))]
-        data[str(idx)] = row_data
-
-    # write to csv
-    with open("output.csv", "w") as result_file:
-        wr = csv.writer(result_file, dialect="excel")
-
-        for row, row_text in data.items():
-            wr.writerow(row_text)
-
-    # return as Pandas dataframe
-    # TODO: write to memory instead of disk
-    try:
-        df = pd.read_csv("output.csv")
-    # TODO: this hapens in some pages, but we need a better way to handle this
-    except Exception as e:
+        for top, (x0, y0, x1, y1) in zip(tops, cells[start:end]):
+            stacked[top : top + y1 - y0, padding : padding + x1 - x0] = image[
+                y0:y1, x0:x1
+            ]
+
+        yield start, stacked, np.array(tops)
+        start = end
+
+
+def apply_ocr(cell_coordinates, cropped_table, reader=None):
+    """
+    OCR a table and return it as a data frame (the first row is the header) and
+    a dictionary with the text of each row, empty cells are kept as "" so
+    columns stay aligned.
+
+    The cells are cropped and stacked into a few images (usually one) with
+    padding between them, so text in adjacent cells isn't merged, and each image
+    is read with a single readtext call. Cells with several lines of text are
+    read line by line, top to bottom. On GPU, OCR_BATCH_SIZE lines are
+    recognized per forward pass.
+
+    cell_coordinates can be a CellGrid, its records (CellGrid.to_records) or the
+    output of get_cell_coordinates_by_row. reader defaults to OCRReader()
+    """
+    import pandas as pd
+
+    reader = reader or OCRReader()
+    boxes = _cell_boxes(cell_coordinates)
+    n_rows, n_columns, _ = boxes.shape
+    rows = [["" for _ in range(n_columns)] for _ in range(n_rows)]
+    # (row, column) of each cell with a bbox
+    index = np.argwhere(~np.isnan(boxes).any(axis=-1))
+    cells = boxes[index[:, 0], index[:, 1]].round().astype(int)
+
+    stacks = _stack_cells(
+        np.array(cropped_table), cells, max_height=OCR_MAX_HEIGHT, padding=OCR_PADDING
+    )
+
+    for start, stacked, tops in stacks:
+        results = reader.readtext(stacked, batch_size=OCR_BATCH_SIZE)
+
+        if not results:
+            continue
+
+        centers = np.array([np.mean(points, axis=0) for points, _, _ in results])
+        slots = np.searchsorted(tops, centers[:, 1], side="right") - 1
+        # read each cell top to bottom, left to right
+        order = np.lexsort((centers[:, 0], centers[:, 1], slots))
+
+        for k in order:
+            i, j = index[start + max(slots[k], 0)]
+            text = results[k][1]
+            rows[i][j] = f"{rows[i][j]} {text}" if rows[i][j] else text
+
+    data = {str(idx): row_text for idx, row_text in enumerate(rows)}
+
+    # TODO: this happens in some pages, but we need a better way to handle this
+    if not rows or not rows[0]:
         return None, None
 
+    # parse it as a CSV file so column types are inferred (and header names
+    # made unique) as they were when tables were written to disk
+    buffer = io.StringIO()
+    csv.writer(buffer, dialect="excel").writerows(rows)
+    buffer.seek(0)
+    df = pd.read_csv(buffer)
     return df, data
@@ -1,14 +1,130 @@
+"""
+Text extraction from images (OCR with pytesseract) and PDFs. The *_many
+functions process many files in a pool of processes, see aiutils.pipeline
+"""
+
+from itertools import islice
+
 from PIL import Image
-import pytesseract
 import fitz
 
+from aiutils.pipeline import Pipeline, Stage
+
+# scanned pages are rendered at this zoom before running OCR on them
+OCR_ZOOM = 2
+
+
+def _ocr(image):
+    import pytesseract
+
+    return pytesseract.image_to_string(image)
+
 
 def image2text(path_to_image):
     """Extracts text from a single image"""
-    return pytesseract.image_to_string(Image.open(path_to_image))
+    return _ocr(Image.open(path_to_image))
+
+
+def _page_text(page, ocr):
+    text = page.get_text()
+
+    # scanned pages have no text layer
+    if ocr and not text.strip():
+        pix = page.get_pixmap(matrix=fitz.Matrix(OCR_ZOOM, OCR_ZOOM), alpha=False)
+        text = _ocr(Image.frombytes("RGB", (pix.width, pix.height), pix.samples))
+
+    return text
+
+
+def pdf2text(path_to_pdf, ocr=False):
+    """
+    Extracts text from a single PDF file, if ocr is True, pages without text
+    are OCR'd
+    """
+    with fitz.open(path_to_pdf) as doc:
+        return [_page_text(page, ocr) for page in doc]
+
+
+def _map(function, items, n_workers, mp_context):
+    """map(function, items), in a pool of processes if n_workers is passed"""
+    if n_workers is None:
+        return map(function, items)
+
+    pipeline = Pipeline(
+        [Stage(function.__name__, function, n_workers=n_workers)],
+        mp_context=mp_context,
+    )
+    return pipeline.map(items)
+
+
+def _pdf_chunks(paths, chunk_size, ocr):
+    for path in paths:
+        with fitz.open(path) as doc:
+            n_pages = doc.page_count
+
+        # documents without pages still need a chunk to be yielded
+        for start in range(0, max(n_pages, 1), chunk_size):
+            yield path, start, min(start + chunk_size, n_pages), n_pages, ocr
+
+
+def _pdf_chunk(chunk):
+    """Return whether the chunk is the last of its document and its texts"""
+    path, start, stop, n_pages, ocr = chunk
+
+    with fitz.open(path) as doc:
+        return stop == n_pages, [_page_text(doc[i], ocr) for i in range(start, stop)]
+
+
+def pdf2text_many(paths, *, n_workers=None, chunk_size=16, ocr=True, mp_context=None):
+    """
+    Extract the text from many PDFs, yields a list with the text of each page
+    for each PDF, in order
+
+    Parameters
+    ----------
+    paths : iterable of str
+        Paths to the PDFs, consumed as the workers need more work
+
+    n_workers : int, optional
+        Number of processes, by default files are processed in this process
+
+    chunk_size : int, default=16
+        Number of consecutive pages each worker extracts at a time
+
+    ocr : bool, default=True
+        OCR pages without text (e.g., scanned pages) with pytesseract
+
+    mp_context : multiprocessing context, optional
+        See aiutils.pipeline.Pipeline
+    """
+    pages = []
+
+    for last, texts in _map(
+        _pdf_chunk, _pdf_chunks(paths, chunk_size, ocr), n_workers, mp_context
+    ):
+        pages.extend(texts)
+
+        if last:
+            yield pages
+            pages = []
+
+
+def _chunks(items, size):
+    items = iter(items)
+
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def _image_chunk(paths):
+    return [image2text(path) for path in paths]
 
 
-def pdf2text(path_to_pdf):
-    """Extracts text from a single PDF file"""
-    doc = fitz.open(path_to_pdf)
-    return [page.get_text() for page in doc]
+def image2text_many(paths, *, n_workers=None, chunk_size=16, mp_context=None):
+    """
+    Extract the text from many images, yields the text of each one, in order.
+    Each worker OCRs chunk_size images at a time, see pdf2text_many for the
+    other parameters
+    """
+    for texts in _map(_image_chunk, _chunks(paths, chunk_size), n_workers, mp_context):
+        yield from texts
@@ -0,0 +1,303 @@
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import threading
+
+from pydantic import BaseModel
+import pytest
+
+from aiutils.backends import Entry, RedisBackend, SQLiteBackend
+from aiutils.cache import APICache
+
+
+def make_entry(
+    key,
+    response="{}",
+    now=0,
+    expires_at=None,
+    qualified_name="module.function",
+    codec="json",
+):
+    return Entry(
+        key=key,
+        qualified_name=qualified_name,
+        kwargs="{}",
+        response=response,
+        created_at=now,
+        accessed_at=now,
+        expires_at=expires_at,
+        size=len(response),
+        codec=codec,
+    )
+
+
+class SampleResponseModel(BaseModel):
+    x: int
+
+
+@pytest.fixture(params=["sqlite", "sqlite-batch-writes", "redis"])
+def backend(request):
+    if request.param == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        backend = RedisBackend(fakeredis.FakeRedis())
+    else:
+        backend = SQLiteBackend(
+            "api_calls.db", batch_writes=request.param == "sqlite-batch-writes"
+        )
+
+    yield backend
+    backend.close()
+
+
+def keys(entries):
+    return sorted(entry.key for entry in entries)
+
+
+# conformance tests, every backend must pass them
+
+
+def test_get_returns_what_was_set(backend):
+    entry = make_entry("a", response='{"value": 1}', now=1)
+    backend.set(entry)
+    backend.set(make_entry("b", response=b"\x00\n\xff", codec="json+zstd"))
+
+    assert backend.get("a", now=2) == entry
+    assert backend.get("b", now=2).response == b"\x00\n\xff"
+    assert backend.get("c", now=2) is None
+
+
+def test_set_replaces(backend):
+    backend.set(make_entry("a", response="1", now=2))
+    backend.set(make_entry("a", response="2", now=1))
+
+    assert backend.get("a", now=3).response == "2"
+
+
+def test_get_skips_expired_entries(backend):
+    backend.set(make_entry("a", expires_at=10))
+
+    assert backend.get("a", now=5).key == "a"
+    assert backend.get("a", now=10) is None
+    assert backend.get_many(["a"], now=100) == [None]
+
+
+def test_get_many(backend):
+    backend.set(make_entry("a"))
+    backend.set(make_entry("c"))
+
+    assert [
+        None if entry is None else entry.key
+        for entry in backend.get_many(["a", "b", "c"], now=0)
+    ] == ["a", None, "c"]
+    assert backend.get_many([], now=0) == []
+
+
+def test_set_many_keeps_the_newest_entry(backend):
+    backend.set(make_entry("a", response="old", now=1))
+    backend.set(make_entry("b", response="new", now=5))
+    backend.set_many(
+        [
+            make_entry("a", response="new", now=5),
+            make_entry("b", response="old", now=1),
+            make_entry("c", response="new", now=1),
+        ]
+    )
+
+    assert [e.response for e in backend.get_many(["a", "b", "c"], now=6)] == [
+        "new",
+        "new",
+        "new",
+    ]
+
+
+def test_iter_entries_filters(backend):
+    backend.set(make_entry("a", now=1))
+    backend.set(make_entry("b", now=5, qualified_name="other.function"))
+    backend.set(make_entry("c", now=5))
+    backend.set(make_entry("d", now=5, expires_at=6))
+
+    assert keys(backend.iter_entries(now=10)) == ["a", "b", "c"]
+    assert keys(backend.iter_entries(qualified_name="other.function")) == ["b"]
+    assert keys(backend.iter_entries(created_after=2, now=10)) == ["b", "c"]
+
+
+def test_compact_evicts_least_recently_used(backend):
+    for i, key in enumerate("abcd"):
+        backend.set(make_entry(key, response="12345", now=i))
+
+    backend.touch_many([("a", 10), ("missing", 10)])
+
+    assert sorted(backend.compact(now=11, max_entries=2)) == ["b", "c"]
+    assert keys(backend.iter_entries(now=11)) == ["a", "d"]
+
+    assert backend.compact(now=11, max_bytes=7) == ["d"]
+    assert keys(backend.iter_entries(now=11)) == ["a"]
+
+
+def test_compact_deletes_expired_entries(backend):
+    backend.set(make_entry("a", expires_at=5))
+    backend.set(make_entry("b"))
+
+    assert backend.compact(now=6) == ["a"]
+
+    assert keys(backend.iter_entries(now=0)) == ["b"]
+
+
+def test_dictionaries(backend):
+    backend.set_dictionary("id", b"dictionary")
+    backend.set_dictionary("id", b"ignored, ids are content hashes")
+
+    assert backend.get_dictionary("id") == b"dictionary"
+    assert backend.get_dictionary("missing") is None
+
+
+# SQLite
+
+
+def count_rows(path_to_db):
+    conn = sqlite3.connect(path_to_db)
+    (count,) = conn.execute("SELECT COUNT(*) FROM api_calls").fetchone()
+    conn.close()
+    return count
+
+
+def test_uses_wal():
+    backend = SQLiteBackend("api_calls.db")
+    (mode,) = backend.connection.execute("PRAGMA journal_mode").fetchone()
+    assert mode == "wal"
+
+
+@pytest.mark.parametrize("batch_writes", [False, True])
+def test_set_and_get(batch_writes):
+    backend = SQLiteBackend("api_calls.db", batch_writes=batch_writes)
+    backend.set(make_entry("a", response='{"value": 1}'))
+    backend.set(make_entry("b", expires_at=10))
+
+    assert backend.get("a", now=100).response == '{"value": 1}'
+    assert backend.get("b", now=5).key == "b"
+    assert backend.get("b", now=100) is None
+    assert backend.get("c", now=100) is None
+
+
+def test_batched_writes_are_committed_together():
+    backend = SQLiteBackend("api_calls.db", batch_writes=True, flush_interval=60)
+
+    for key in range(10):
+        backend.set(make_entry(str(key)))
+
+    # still pending, but visible to the backend itself
+    assert count_rows("api_calls.db") == 0
+    assert backend.get("9", now=0) is not None
+
+    backend.close()
+
+    assert count_rows("api_calls.db") == 10
+
+
+def test_flush_interval_bounds_latency():
+    backend = SQLiteBackend("api_calls.db", batch_writes=True, flush_interval=0.01)
+    backend.set(make_entry("a"))
+    backend.flush()
+
+    assert count_rows("api_calls.db") == 1
+    assert backend._writer.pending == {}
+
+
+@pytest.mark.parametrize("batch_writes", [False, True])
+def test_concurrent_writers(batch_writes):
+    backends = [
+        SQLiteBackend("api_calls.db", batch_writes=batch_writes) for _ in range(2)
+    ]
+
+    def write(i):
+        backends[i % 2].set(make_entry(str(i)))
+        return backends[(i + 1) % 2].get(str(i - 1), now=0)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(write, range(200)))
+
+    for backend in backends:
+        backend.flush()
+
+    assert count_rows("api_calls.db") == 200
+
+
+def test_compact_flushes_pending_writes():
+    backend = SQLiteBackend("api_calls.db", batch_writes=True, flush_interval=60)
+
+    for key in range(5):
+        backend.set(make_entry(str(key), now=key))
+
+    backend.compact(now=0, max_entries=2)
+
+    assert count_rows("api_calls.db") == 2
+    assert backend.get("4", now=0) is not None
+    assert backend.get("0", now=0) is None
+
+
+# Redis
+
+
+def test_redis_entries_expire_on_the_server():
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    backend = RedisBackend(client, prefix="test:")
+    backend.set(make_entry("a", now=100, expires_at=160))
+    backend.set(make_entry("b"))
+
+    assert 59_000 < client.pttl("test:entry:a") <= 60_000
+    assert client.pttl("test:entry:b") == -1
+
+
+def test_replicas_share_a_redis_cache():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    calls = []
+
+    def api_function(x):
+        calls.append(x)
+        return SampleResponseModel(x=x)
+
+    replicas = [
+        APICache(
+            api_function,
+            backend=RedisBackend(fakeredis.FakeRedis(server=server)),
+            memory=False,
+        )
+        for _ in range(2)
+    ]
+
+    replicas[0](x=1)
+    replicas[1](x=1)
+    replicas[1](x=2)
+
+    assert calls == [1, 2]
+    assert replicas[1].stats["hits"] == 1
+    assert replicas[0].lookup_many(kwargs_list=[dict(x=2), dict(x=3)]) == [
+        dict(x=2),
+        None,
+    ]
+
+
+def test_sqlite_closes_connections_of_finished_threads():
+    backend = SQLiteBackend("cache.db")
+    connections = []
+
+    def query():
+        connection = backend.connection
+        connection.execute("SELECT 1")
+        connections.append(connection)
+
+    for _ in range(5):
+        thread = threading.Thread(target=query)
+        thread.start()
+        thread.join()
+
+    # only the connection of this thread is left
+    assert len(backend._connections) == 1
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        connections[0].execute("SELECT 1")
+
+    backend.close()
+
+    assert len(backend._connections) == 0
@@ -1,10 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import json
 import sqlite3
+import threading
+import time
 
 from pydantic import BaseModel
 import pytest
 
 import aiutils.cache as cache
+import aiutils.lru as lru
 
 
 def dummy_api_function():
@@ -68,7 +73,7 @@ def test_create_db():
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
     tables = cursor.fetchall()
-    assert tables == [("api_calls",)]
+    assert tables == [("api_calls",), ("codec_dictionaries",)]
 
 
 def test_insert(sample_messages, sample_response):
@@ -86,11 +91,12 @@ def test_insert(sample_messages, sample_response):
 
     conn = sqlite3.connect("api_calls.db")
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM api_calls")
+    cursor.execute("SELECT key, qualified_name, kwargs, response FROM api_calls")
     rows = cursor.fetchall()
 
     assert rows == [
         (
+            c.key(kwargs),
             "test_cache.dummy_api_function",
             json.dumps(kwargs),
             json.dumps(sample_response),
@@ -98,6 +104,69 @@ def test_insert(sample_messages, sample_response):
     ]
 
 
+def test_key_ignores_kwargs_order():
+    assert cache.make_key("f", {"a": 1, "b": [1, 2]}) == cache.make_key(
+        "f", {"b": [1, 2], "a": 1}
+    )
+    assert cache.make_key("f", {"a": 1}) != cache.make_key("g", {"a": 1})
+    assert cache.make_key("f", {"a": 1}) != cache.make_key("f", {"a": 2})
+
+
+def test_lookup_uses_primary_key(sample_cache):
+    cursor = sample_cache.connection.cursor()
+    cursor.execute(
+        "EXPLAIN QUERY PLAN SELECT response FROM api_calls WHERE key = ?", ("",)
+    )
+    (plan,) = [row[-1] for row in cursor.fetchall()]
+
+    assert "USING PRIMARY KEY" in plan
+
+
+def test_migrates_legacy_database(sample_messages, sample_response):
+    kwargs = dict(model="gpt-4-0125-preview", messages=sample_messages)
+
+    conn = sqlite3.connect("api_calls.db")
+    conn.execute(
+        "CREATE TABLE api_calls (qualified_name TEXT, kwargs TEXT, response TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO api_calls VALUES (?, ?, ?)",
+        [
+            (
+                "test_cache.dummy_api_function",
+                json.dumps(kwargs),
+                json.dumps(sample_response),
+            ),
+            (
+                "test_cache.dummy_api_function",
+                json.dumps(kwargs),
+                json.dumps({"duplicate": True}),
+            ),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    c = cache.APICache(api_function=dummy_api_function, path_to_db="api_calls.db")
+
+    assert c.lookup(kwargs=kwargs) == sample_response
+
+    cursor = c.connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM api_calls")
+    assert cursor.fetchone() == (1,)
+    cursor.execute("PRAGMA user_version")
+    assert cursor.fetchone() == (cache.SCHEMA_VERSION,)
+
+
+def test_rejects_newer_schema():
+    conn = sqlite3.connect("api_calls.db")
+    conn.execute("PRAGMA user_version = 1000")
+    conn.close()
+
+    with pytest.raises(RuntimeError, match="schema version 1000"):
+        cache.APICache(api_function=dummy_api_function, path_to_db="api_calls.db")
+
+
 def test_lookup_exists(sample_cache, sample_messages, sample_response):
     response = sample_cache.lookup(
         kwargs=dict(model="gpt-4-0125-preview", messages=sample_messages)
@@ -142,6 +211,7 @@ def test_call_uses_cache(sample_cache, sample_messages, sample_response):
     response = sample_cache(model="gpt-4-0125-preview", messages=sample_messages)
 
     assert response.to_dict() == sample_response
+    assert sample_cache.stats == {"hits": 1}
 
 
 class SampleResponseModel(BaseModel):
@@ -199,3 +269,309 @@ def test_doesnt_use_cache_if_different_api_function():
 
     assert first_cache(a=1, b=2).to_dict() == {"key": "first api"}
     assert second_cache(a=1, b=2).to_dict() == {"key": "second api"}
+
+
+def test_thread_safe_cache_coalesces_concurrent_misses():
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def api_function(a):
+        calls.append(a)
+        time.sleep(0.2)
+        return SampleResponseModel(key=f"value {a}")
+
+    my_cache = cache.ThreadSafeAPICache(
+        api_function=api_function, path_to_db="api_calls.db"
+    )
+
+    def call():
+        barrier.wait()
+        return my_cache(a=1).to_dict()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: call(), range(8)))
+
+    assert calls == [1]
+    assert results == [{"key": "value 1"}] * 8
+
+
+def test_thread_safe_cache_propagates_errors():
+    calls = []
+
+    def api_function(a):
+        calls.append(a)
+
+        if len(calls) == 1:
+            raise ValueError("API is down")
+
+        return SampleResponseModel(key="ok")
+
+    my_cache = cache.ThreadSafeAPICache(
+        api_function=api_function, path_to_db="api_calls.db"
+    )
+
+    with pytest.raises(ValueError, match="API is down"):
+        my_cache(a=1)
+
+    assert my_cache(a=1).to_dict() == {"key": "ok"}
+    assert my_cache._in_flight == {}
+
+
+def test_async_cache_coalesces_concurrent_misses():
+    calls = []
+
+    async def api_function(a):
+        calls.append(a)
+        await asyncio.sleep(0.1)
+        return SampleResponseModel(key=f"value {a}")
+
+    my_cache = cache.AsyncAPICache(api_function=api_function, path_to_db="api_calls.db")
+
+    async def main():
+        return await asyncio.gather(*[my_cache(a=1) for _ in range(5)], my_cache(a=2))
+
+    results = asyncio.run(main())
+
+    assert sorted(calls) == [1, 2]
+    assert [r.to_dict() for r in results] == [{"key": "value 1"}] * 5 + [
+        {"key": "value 2"}
+    ]
+    assert my_cache._in_flight == {}
+
+    # the second round is served from the database
+    asyncio.run(main())
+    assert sorted(calls) == [1, 2]
+
+
+def test_lookup_uses_memory(sample_cache, sample_messages, sample_response):
+    kwargs = dict(model="gpt-4-0125-preview", messages=sample_messages)
+    sample_cache.connection.execute("DELETE FROM api_calls")
+
+    assert sample_cache.lookup(kwargs=kwargs) == sample_response
+
+
+def test_lookup_without_memory(sample_messages, sample_response):
+    kwargs = dict(model="gpt-4-0125-preview", messages=sample_messages)
+    my_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db", memory=False
+    )
+    my_cache.insert(kwargs=kwargs, response=sample_response)
+    assert my_cache.lookup(kwargs=kwargs) == sample_response
+
+    my_cache.connection.execute("DELETE FROM api_calls")
+    assert my_cache.lookup(kwargs=kwargs) is None
+
+
+@pytest.mark.parametrize("memory", [True, False])
+def test_entries_expire(monkeypatch, memory):
+    now = 1_000_000
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+    monkeypatch.setattr(lru.time, "time", lambda: now)
+
+    my_cache = cache.APICache(
+        api_function=dummy_api_function,
+        path_to_db="api_calls.db",
+        ttl=10,
+        memory=memory,
+    )
+    my_cache.insert(kwargs={"a": 1}, response={"key": "default ttl"})
+    my_cache.insert(kwargs={"a": 2}, response={"key": "custom ttl"}, ttl=20)
+
+    now += 15
+    assert my_cache.lookup(kwargs={"a": 1}) is None
+    assert my_cache.lookup(kwargs={"a": 2}) == {"key": "custom ttl"}
+
+    now += 10
+    assert my_cache.lookup(kwargs={"a": 2}) is None
+
+
+def test_compact_evicts_least_recently_used(monkeypatch):
+    now = 1_000_000
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+
+    my_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db", max_entries=2
+    )
+
+    for a in range(3):
+        my_cache.insert(kwargs={"a": a}, response={"value": a})
+        now += cache.ACCESS_RESOLUTION + 1
+
+    # access the oldest so the second one becomes the least recently used
+    my_cache._memory.clear()
+    my_cache.lookup(kwargs={"a": 0})
+    my_cache.compact()
+
+    assert my_cache.lookup(kwargs={"a": 0}) == {"value": 0}
+    assert my_cache.lookup(kwargs={"a": 1}) is None
+    assert my_cache.lookup(kwargs={"a": 2}) == {"value": 2}
+
+
+def test_compact_keeps_keys_hit_from_memory(monkeypatch):
+    now = 1_000_000
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+    calls = []
+
+    def api_function(a):
+        calls.append(a)
+        return SampleChunkModel(content=str(a))
+
+    my_cache = cache.APICache(
+        api_function=api_function, path_to_db="api_calls.db", max_entries=2
+    )
+
+    for a in range(3):
+        my_cache(a=a)
+        now += cache.ACCESS_RESOLUTION + 1
+
+    for _ in range(5):
+        my_cache(a=0)
+
+    my_cache.compact()
+
+    assert my_cache(a=0).content == "0"
+    assert my_cache(a=2).content == "2"
+    assert calls == [0, 1, 2]
+    assert my_cache.lookup(kwargs={"a": 1}) is None
+    # only the deleted entry was dropped from memory
+    assert my_cache._memory.get(my_cache.key({"a": 2})) is not None
+
+
+def test_compact_enforces_max_bytes(monkeypatch):
+    now = 1_000_000
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+
+    my_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db", max_bytes=100
+    )
+
+    for a in range(10):
+        my_cache.insert(kwargs={"a": a}, response={"value": "x" * 20})
+        now += 1
+
+    my_cache.compact()
+
+    cursor = my_cache.connection.cursor()
+    cursor.execute("SELECT SUM(size), MIN(kwargs) FROM api_calls")
+    total, oldest = cursor.fetchone()
+
+    # each entry takes 41 bytes
+    assert total == 82
+    assert json.loads(oldest) == {"a": 8}
+
+
+def test_compacts_on_write(monkeypatch):
+    monkeypatch.setattr(cache, "COMPACT_EVERY", 5)
+
+    my_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db", max_entries=3
+    )
+
+    for a in range(5):
+        my_cache.insert(kwargs={"a": a}, response={"value": a})
+
+    cursor = my_cache.connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM api_calls")
+    assert cursor.fetchone() == (3,)
+
+
+def test_compacts_expired_entries_on_write(monkeypatch):
+    now = 1_000_000
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+    monkeypatch.setattr(cache, "COMPACT_EVERY", 5)
+
+    my_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db", ttl=10
+    )
+
+    for a in range(12):
+        my_cache.insert(kwargs={"a": a}, response={"value": a})
+        now += 3
+
+    # the last compaction (10th insert) deleted the entries that expired by
+    # then, the first six
+    cursor = my_cache.connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM api_calls")
+    assert cursor.fetchone() == (6,)
+
+
+class SampleChunkModel(BaseModel):
+    content: str
+
+
+def stream_api_function(calls):
+    def api_function(messages, stream):
+        calls.append(messages)
+        return (SampleChunkModel(content=token) for token in ["Hello", "!", " Bye"])
+
+    return api_function
+
+
+def test_stream_is_recorded_and_replayed():
+    calls = []
+    my_cache = cache.APICache(
+        api_function=stream_api_function(calls), path_to_db="api_calls.db"
+    )
+
+    first = [chunk.content for chunk in my_cache(messages="hi", stream=True)]
+    second = [chunk.content for chunk in my_cache(messages="hi", stream=True)]
+
+    assert first == second == ["Hello", "!", " Bye"]
+    assert calls == ["hi"]
+    assert my_cache.lookup(kwargs=dict(messages="hi", stream=True)) == [
+        {"content": "Hello"},
+        {"content": "!"},
+        {"content": " Bye"},
+    ]
+
+
+def test_partially_consumed_stream_is_not_stored():
+    calls = []
+    my_cache = cache.APICache(
+        api_function=stream_api_function(calls), path_to_db="api_calls.db"
+    )
+
+    stream = my_cache(messages="hi", stream=True)
+    next(stream)
+    stream.close()
+
+    assert my_cache.lookup(kwargs=dict(messages="hi", stream=True)) is None
+
+
+def test_stream_replay_pacing(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(cache.time, "sleep", sleeps.append)
+
+    my_cache = cache.APICache(
+        api_function=stream_api_function([]),
+        path_to_db="api_calls.db",
+        stream_pace=0.05,
+    )
+    list(my_cache(messages="hi", stream=True))
+    assert sleeps == []
+
+    list(my_cache(messages="hi", stream=True))
+    assert sleeps == [0.05, 0.05]
+
+
+def test_async_stream_is_recorded_and_replayed():
+    calls = []
+
+    async def api_function(messages, stream):
+        calls.append(messages)
+
+        async def chunks():
+            for token in ["Hello", "!"]:
+                yield SampleChunkModel(content=token)
+
+        return chunks()
+
+    my_cache = cache.AsyncAPICache(api_function=api_function, path_to_db="api_calls.db")
+
+    async def main():
+        stream = await my_cache(messages="hi", stream=True)
+        return [chunk.content async for chunk in stream]
+
+    assert asyncio.run(main()) == ["Hello", "!"]
+    assert asyncio.run(main()) == ["Hello", "!"]
+    assert calls == ["hi"]
@@ -0,0 +1,141 @@
+import sqlite3
+
+import pytest
+
+from aiutils.backends import SQLiteBackend
+from aiutils.cache import APICache
+from aiutils.cli import cli
+from aiutils.codecs import Codec, recompress, train_dictionary
+
+
+def dummy_api_function():
+    pass
+
+
+def make_response(i):
+    return {
+        "id": f"chatcmpl-{i}",
+        "choices": [
+            {
+                "finish_reason": "stop",
+                "index": 0,
+                "message": {
+                    "content": f"Answer number {i}: " + "lorem ipsum " * (i % 7),
+                    "role": "assistant",
+                },
+            }
+        ],
+        "model": "gpt-4-0125-preview",
+        "object": "chat.completion",
+        "usage": {"completion_tokens": i, "prompt_tokens": 20, "total_tokens": 20 + i},
+    }
+
+
+@pytest.fixture
+def populated_db():
+    my_cache = APICache(api_function=dummy_api_function, path_to_db="api_calls.db")
+
+    for i in range(300):
+        my_cache.insert(kwargs={"i": i}, response=make_response(i))
+
+    my_cache.flush()
+
+
+@pytest.fixture
+def dictionary():
+    return train_dictionary(
+        [Codec().serialize(make_response(i)).encode() for i in range(300)],
+        size=2048,
+    )
+
+
+@pytest.mark.parametrize(
+    "name",
+    ["json", "json+zlib", "json+zstd", "msgpack", "msgpack+zlib", "msgpack+zstd"],
+)
+def test_roundtrip(name):
+    codec = Codec.from_name(name)
+
+    assert codec.name == name
+    assert codec.decode(codec.encode(make_response(1))) == make_response(1)
+
+
+def test_roundtrip_with_dictionary(dictionary):
+    codec = Codec(compressor="zstd", dictionary=dictionary)
+    encoded = codec.encode(make_response(1))
+
+    assert codec.decode(encoded) == make_response(1)
+    assert len(encoded) < len(Codec(compressor="zstd").encode(make_response(1)))
+
+    restored = Codec.from_name(codec.name, get_dictionary=lambda _: dictionary)
+    assert restored.decode(encoded) == make_response(1)
+
+
+def test_from_name_requires_dictionary():
+    with pytest.raises(KeyError, match="Missing dictionary"):
+        Codec.from_name("json+zstd:abc")
+
+
+@pytest.mark.parametrize(
+    "kwargs, match",
+    [
+        (dict(serializer="yaml"), "Unknown serializer"),
+        (dict(compressor="lz4"), "Unknown compressor"),
+        (dict(compressor="zlib", dictionary=b"data"), "only supported by zstd"),
+    ],
+)
+def test_invalid_codec(kwargs, match):
+    with pytest.raises(ValueError, match=match):
+        Codec(**kwargs)
+
+
+def test_cache_reads_entries_written_with_other_codecs(dictionary):
+    codecs = [
+        Codec(),
+        Codec(compressor="zlib"),
+        Codec(serializer="msgpack", compressor="zstd", dictionary=dictionary),
+    ]
+
+    for i, codec in enumerate(codecs):
+        APICache(
+            api_function=dummy_api_function, path_to_db="api_calls.db", codec=codec
+        ).insert(kwargs={"i": i}, response=make_response(i))
+
+    my_cache = APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db", memory=False
+    )
+
+    for i in range(len(codecs)):
+        assert my_cache.lookup(kwargs={"i": i}) == make_response(i)
+
+    conn = sqlite3.connect("api_calls.db")
+    names = [name for (name,) in conn.execute("SELECT codec FROM api_calls")]
+    assert sorted(names) == sorted(codec.name for codec in codecs)
+
+
+@pytest.mark.parametrize("train", [False, True])
+def test_recompress(populated_db, train):
+    summary = recompress("api_calls.db", Codec(compressor="zstd"), train=train)
+
+    assert summary["entries"] == 300
+    assert summary["entries_bytes_after"] < summary["entries_bytes_before"]
+    assert summary["codec"].startswith("json+zstd")
+    assert (":" in summary["codec"]) is train
+
+    my_cache = APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db", memory=False
+    )
+    assert my_cache.lookup(kwargs={"i": 42}) == make_response(42)
+
+    # entries already using the codec are skipped
+    codec = Codec.from_name(
+        summary["codec"], SQLiteBackend("api_calls.db").get_dictionary
+    )
+    again = recompress("api_calls.db", codec)
+    assert again["entries"] == 0
+
+
+def test_cli_recompress(populated_db, capsys):
+    cli(["recompress", "api_calls.db", "--codec", "msgpack+zlib", "--level", "9"])
+
+    assert "Re-encoded 300 entries with msgpack+zlib" in capsys.readouterr().out
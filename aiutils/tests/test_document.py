@@ -0,0 +1,190 @@
+import fitz
+import pytest
+
+from aiutils import document
+
+
+@pytest.fixture
+def encoding():
+    try:
+        return document.get_encoding()
+    # tiktoken downloads the encoding on first use
+    except Exception as e:
+        pytest.skip(f"Could not load the encoding: {e}")
+
+
+@pytest.fixture
+def path_to_pdf():
+    doc = fitz.open()
+
+    for i in range(20):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"page {i} " + "lorem ipsum " * (i + 1))
+
+    doc.save("doc.pdf")
+    return "doc.pdf"
+
+
+def test_pages_are_extracted_on_demand(path_to_pdf, encoding):
+    doc = document.Document(path_to_pdf)
+    pages = doc.pages()
+
+    assert doc._page_tokens == {}
+    assert next(pages).startswith("page 0 ")
+    assert list(doc._page_tokens) == [0]
+    assert len(list(pages)) == 19
+
+
+def test_page_cache_is_bounded(path_to_pdf, encoding):
+    doc = document.Document(path_to_pdf, max_cache_bytes=100)
+
+    for i in range(20):
+        assert doc.get_page_text(i).startswith(f"page {i} ")
+
+    assert doc._text_pages.n_bytes <= 100
+    assert len(doc._page_tokens) == 20
+
+
+def test_n_tokens(path_to_pdf, encoding):
+    doc = document.Document(path_to_pdf, n_sample_pages=4)
+    estimate = doc.n_tokens
+
+    assert len(doc._page_tokens) == 4
+    assert "n_tokens=~" in repr(doc)
+
+    exact = doc.count_tokens()
+
+    assert exact == sum(
+        len(encoding.encode(page.get_text())) for page in fitz.open(path_to_pdf)
+    )
+    assert abs(estimate - exact) / exact < 0.25
+    assert "n_tokens=~" not in repr(doc)
+
+
+def test_reuses_a_single_handle(path_to_pdf, monkeypatch, encoding):
+    opened = []
+    open_ = fitz.open
+    monkeypatch.setattr(
+        document.fitz, "open", lambda *args: opened.append(args) or open_(*args)
+    )
+
+    with document.Document(path_to_pdf) as doc:
+        doc.get_page_text(0)
+        doc.get_page_as_image(1)
+        assert len(list(doc.iter_page_images(range(3)))) == 3
+
+    assert len(opened) == 1
+    assert doc._doc is None
+
+
+def test_render_pages(path_to_pdf):
+    doc = document.Document(path_to_pdf)
+    pixmaps = doc.render_pages(range(2, 5), zoom=1)
+    pix = next(pixmaps)
+    page = fitz.open(path_to_pdf)[2].get_pixmap()
+
+    array = document.pixmap_to_array(pix)
+
+    assert array.shape == (pix.height, pix.width, 3)
+    assert (array == document.pixmap_to_array(page)).all()
+    assert document.pixmap_to_image(pix).size == (pix.width, pix.height)
+    assert len(list(pixmaps)) == 2
+
+
+def test_zero_copy_conversions(path_to_pdf):
+    doc = document.Document(path_to_pdf)
+    pix = next(doc.render_pages([0], alpha=True))
+
+    array = document.pixmap_to_array(pix)
+    image = document.pixmap_to_image(pix)
+    array[0, 0] = (1, 2, 3, 4)
+
+    assert image.mode == "RGBA"
+    assert image.getpixel((0, 0)) == (1, 2, 3, 4)
+
+    # views must be released before the pixmap
+    del array, image
+
+
+class ByteEncoding:
+    """One token per byte, so token counts add up when joining strings"""
+
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode(self, tokens):
+        return bytes(tokens).decode("utf-8", errors="ignore")
+
+
+def render(page_number, text, tables=""):
+    return document.template_page.render(
+        text=text, tables=tables, page_number=page_number
+    )
+
+
+def test_pack_prompts_groups_consecutive_pages():
+    pages = [(i, "x" * 50, []) for i in range(5)]
+    max_tokens = 2 * len(render(0, "x" * 50, [])) + 5
+
+    batches = list(
+        document.pack_prompts(
+            pages, max_tokens, encoding=ByteEncoding(), price_per_token=0.5
+        )
+    )
+
+    assert [batch.page_numbers for batch in batches] == [[0, 1], [2, 3], [4]]
+    assert batches[0].prompt == render(0, "x" * 50, []) + render(1, "x" * 50, [])
+    assert all(batch.n_tokens <= max_tokens for batch in batches)
+    assert [batch.cost for batch in batches] == [
+        batch.n_tokens * 0.5 for batch in batches
+    ]
+
+
+def test_pack_prompts_splits_pages_on_paragraphs():
+    paragraphs = [f"paragraph {i} " + "y" * 80 for i in range(10)]
+    pages = [(0, "\n\n".join(paragraphs), "table data"), (1, "short", "")]
+
+    batches = list(document.pack_prompts(pages, 300, encoding=ByteEncoding()))
+
+    page_numbers = [batch.page_numbers for batch in batches]
+    last_part = max(i for i, numbers in enumerate(page_numbers) if 0 in numbers)
+
+    assert len(batches) > 3
+    assert all(batch.n_tokens <= 300 for batch in batches)
+    assert page_numbers[:last_part] == [[0]] * last_part
+    assert 1 in page_numbers[-1]
+    # tables go in the last part of the page
+    assert ["table data" in batch.prompt for batch in batches].count(True) == 1
+    assert "table data" in batches[last_part].prompt
+
+    for paragraph in paragraphs:
+        assert sum(paragraph in batch.prompt for batch in batches) == 1
+
+
+def test_pack_prompts_splits_long_lines():
+    batches = list(
+        document.pack_prompts([(0, "z" * 1000, "")], 300, encoding=ByteEncoding())
+    )
+
+    assert all(batch.n_tokens <= 300 for batch in batches)
+    assert sum(batch.prompt.count("z") for batch in batches) == 1000
+
+
+def test_iter_prompts_with_max_tokens(path_to_pdf, monkeypatch):
+    monkeypatch.setattr(document, "get_encoding", ByteEncoding)
+    monkeypatch.setattr(
+        document,
+        "_extract_tables",
+        lambda page: document.PageTables(objects=[], grids=[], tables=[]),
+    )
+    doc = document.Document(path_to_pdf)
+
+    per_page = list(doc.iter_prompts())
+    packed = list(doc.iter_prompts(max_tokens=1000))
+    batches = list(doc.iter_prompt_batches(1000))
+
+    assert len(per_page) == 20
+    assert len(packed) < 20
+    assert "".join(packed) == "".join(per_page)
+    assert [batch.prompt for batch in batches] == packed
+    assert [n for batch in batches for n in batch.page_numbers] == list(range(20))
@@ -0,0 +1,115 @@
+import json
+import pickle
+
+import pytest
+
+from aiutils.frozenjson import FrozenJSON, FrozenList
+
+
+@pytest.fixture
+def payload():
+    return {
+        "id": "chatcmpl-123",
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": "hello"}},
+            {"index": 1, "message": {"role": "assistant", "content": "bye"}},
+        ],
+        "usage": {"total_tokens": 10},
+        "class": "keyword",
+    }
+
+
+def test_attribute_access(payload):
+    response = FrozenJSON(payload)
+
+    assert response.id == "chatcmpl-123"
+    assert response.choices[0].message.content == "hello"
+    assert response.choices[-1].message.content == "bye"
+    assert response.usage.total_tokens == 10
+    assert response.class_ == "keyword"
+    assert response["class_"] == "keyword"
+    assert "class_" in dir(response)
+    assert list(response.keys()) == list(payload)
+
+
+def test_wraps_without_copying(payload):
+    response = FrozenJSON(payload)
+
+    assert response._data is payload
+    assert response.to_dict() == {
+        **{k: v for k, v in payload.items() if k != "class"},
+        "class_": "keyword",
+    }
+    assert response.to_dict()["choices"] is not payload["choices"]
+
+
+def test_reuses_wrappers(payload):
+    response = FrozenJSON(payload)
+
+    assert response.choices is response.choices
+    assert response.choices[1] is response.choices[-1]
+    assert response.choices[0].message is response.choices[0].message
+
+
+def test_lists_are_read_only_views(payload):
+    choices = FrozenJSON(payload).choices
+
+    assert isinstance(choices, FrozenList)
+    assert len(choices) == 2
+    assert [c.index for c in choices] == [0, 1]
+    assert [c.index for c in choices[1:]] == [1]
+    assert choices == payload["choices"]
+    assert isinstance(choices, list)
+    assert choices + [None] == payload["choices"] + [None]
+
+    with pytest.raises(TypeError):
+        choices[0] = None
+
+    with pytest.raises(TypeError):
+        choices.append(None)
+
+    with pytest.raises(IndexError):
+        choices[-3]
+
+
+def test_slots_and_pickling(payload):
+    response = FrozenJSON(payload)
+
+    assert not hasattr(response, "__dict__")
+    assert pickle.loads(pickle.dumps(response)).choices[0].message.content == "hello"
+
+
+def test_missing_keys(payload):
+    response = FrozenJSON(payload)
+
+    with pytest.raises(KeyError, match="available keys are"):
+        response["missing"]
+
+    with pytest.raises(KeyError):
+        response.missing
+
+
+def test_lists_of_scalars_are_lists():
+    response = FrozenJSON({"data": [{"embedding": [0.1, 0.2]}]})
+    embedding = response.data[0].embedding
+
+    assert type(embedding) is list
+    assert json.dumps(response.data[0].embedding) == "[0.1, 0.2]"
+    assert embedding + [0.3] == [0.1, 0.2, 0.3]
+    assert FrozenJSON([1, 2]) == [1, 2]
+
+
+def test_reading_does_not_modify_the_wrapped_object(payload):
+    response = FrozenJSON(payload)
+
+    response["choices"].append(None)
+    response.get("usage")["total_tokens"] = 0
+    response.items()[1][1].clear()
+    response.choices[0].to_dict()["message"]["content"] = None
+
+    assert len(payload["choices"]) == 2
+    assert payload["usage"] == {"total_tokens": 10}
+    assert payload["choices"][0]["message"]["content"] == "hello"
+
+    with pytest.raises(AttributeError):
+        response.update({})
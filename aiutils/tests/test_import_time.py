@@ -0,0 +1,43 @@
+"""
+Importing aiutils modules must stay cheap: heavy libraries and models are
+loaded on first use
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+HEAVY = {"torch", "torchvision", "transformers", "easyocr", "matplotlib", "pandas"}
+
+# seconds, generous so the test isn't flaky on slow machines. With the heavy
+# libraries imported eagerly, importing aiutils.tables took several seconds
+MAX_IMPORT_TIME = 2
+
+
+def import_times(module):
+    """Return {module: cumulative import time in seconds} using -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative) / 1_000_000
+
+    return times
+
+
+@pytest.mark.parametrize("module", ["aiutils.tables", "aiutils.document"])
+def test_import_is_cheap(module):
+    times = import_times(module)
+
+    assert not HEAVY & set(times)
+    assert times[module] < MAX_IMPORT_TIME
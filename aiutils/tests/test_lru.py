@@ -0,0 +1,54 @@
+from aiutils.lru import LRUCache
+import aiutils.lru as lru
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_evicts_by_size():
+    cache = LRUCache(max_entries=None, max_bytes=10)
+    cache.set("a", 1, size=4)
+    cache.set("b", 2, size=4)
+    cache.set("c", 3, size=4)
+
+    assert "a" not in cache
+    assert len(cache) == 2
+    assert cache.n_bytes == 8
+
+
+def test_ignores_entries_larger_than_budget():
+    cache = LRUCache(max_entries=None, max_bytes=10)
+    cache.set("a", 1, size=4)
+    cache.set("b", 2, size=11)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+
+
+def test_replacing_updates_size():
+    cache = LRUCache()
+    cache.set("a", 1, size=4)
+    cache.set("a", 2, size=6)
+
+    assert cache.get("a") == 2
+    assert cache.n_bytes == 6
+
+
+def test_expires(monkeypatch):
+    monkeypatch.setattr(lru.time, "time", lambda: 100)
+    cache = LRUCache()
+    cache.set("a", 1, size=4, expires_at=100)
+    cache.set("b", 2, size=4, expires_at=101)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.n_bytes == 4
@@ -0,0 +1,113 @@
+from urllib.request import urlopen
+
+from pydantic import BaseModel
+import pytest
+
+from aiutils.cache import APICache, qualified_name
+from aiutils.metrics import CacheMetrics, Histogram, serve_metrics
+
+
+class SampleResponseModel(BaseModel):
+    model: str
+    usage: dict
+
+
+def api_function(model, messages):
+    return SampleResponseModel(
+        model=model, usage={"prompt_tokens": 1000, "completion_tokens": 500}
+    )
+
+
+@pytest.fixture
+def metrics():
+    return CacheMetrics()
+
+
+@pytest.fixture
+def api_cache(metrics):
+    return APICache(api_function, path_to_db="api_calls.db", metrics=metrics)
+
+
+def call(api_cache, content):
+    return api_cache(
+        model="gpt-4-0125-preview", messages=[{"role": "user", "content": content}]
+    )
+
+
+def test_records_hits_misses_and_savings(api_cache, metrics):
+    call(api_cache, "hello")
+    call(api_cache, "hello")
+    call(api_cache, "hello")
+    call(api_cache, "bye")
+
+    summary = metrics.summary()[qualified_name(api_function)]
+
+    assert summary["hits"] == 2
+    assert summary["misses"] == 2
+    assert summary["near_hits"] == 0
+    assert summary["hit_ratio"] == 0.5
+    assert summary["lookup_seconds"]["count"] == 4
+    assert summary["upstream_seconds"]["count"] == 2
+    assert summary["stored_bytes"] > 0
+    assert summary["saved_tokens"] == 3000
+    # gpt-4-0125-preview: $10/1M prompt tokens, $30/1M completion tokens
+    assert summary["saved_cost_usd"] == pytest.approx(2 * (0.01 + 0.015))
+
+
+def test_unknown_model_saves_tokens_but_no_cost(metrics):
+    response = dict(model="some-model", usage=dict(prompt_tokens=5))
+
+    metrics.record_lookup("f", "hit", 0.001, response)
+
+    assert metrics.summary()["f"]["saved_tokens"] == 5
+    assert metrics.summary()["f"]["saved_cost_usd"] == 0
+
+
+def test_stream_usage_comes_from_the_last_chunk(metrics):
+    chunks = [
+        dict(model="gpt-4o-mini", usage=None),
+        dict(model="gpt-4o-mini", usage=dict(prompt_tokens=10, completion_tokens=0)),
+    ]
+
+    metrics.record_lookup("f", "hit", 0.001, chunks)
+
+    assert metrics.summary()["f"]["saved_cost_usd"] == pytest.approx(10 * 0.15e-6)
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(1, 2, 4))
+
+    for value in (0.5, 1.5, 1.5, 3):
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.quantile(0.5) == 1.5
+    assert histogram.quantile(1) == 4
+    assert Histogram().quantile(0.5) is None
+
+
+def test_to_prometheus(metrics):
+    metrics.record_lookup('my "api"', "miss", 0.002)
+    metrics.record_upstream('my "api"', 1.2)
+
+    text = metrics.to_prometheus()
+    name = 'qualified_name="my \\"api\\""'
+
+    assert "# TYPE aiutils_cache_lookups_total counter" in text
+    assert f'aiutils_cache_lookups_total{{{name},outcome="miss"}} 1' in text
+    assert f'aiutils_cache_upstream_seconds_bucket{{{name},le="1"}} 0' in text
+    assert f'aiutils_cache_upstream_seconds_bucket{{{name},le="2.5"}} 1' in text
+    assert f"aiutils_cache_upstream_seconds_count{{{name}}} 1" in text
+
+
+def test_serve_metrics(metrics):
+    metrics.record_lookup("f", "hit", 0.001)
+    server = serve_metrics(port=0, host="127.0.0.1", metrics=metrics)
+
+    try:
+        with urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+
+    assert 'aiutils_cache_lookups_total{qualified_name="f",outcome="hit"} 1' in body
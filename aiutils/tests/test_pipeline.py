@@ -0,0 +1,91 @@
+import os
+import random
+import time
+
+import pytest
+
+from aiutils.pipeline import Pipeline, Stage
+
+# set by the initializer, once per worker process
+_model = None
+
+
+def load_model():
+    global _model
+    _model = object()
+
+
+def use_model(x):
+    return os.getpid(), id(_model)
+
+
+def slow_square(x):
+    time.sleep(random.random() / 100)
+    return x * x
+
+
+def increment(x):
+    return x + 1
+
+
+def fail_on_three(x):
+    if x == 3:
+        raise ValueError("three")
+
+    return x
+
+
+def test_preserves_order():
+    pipeline = Pipeline(
+        [Stage("square", slow_square, n_workers=4), Stage("increment", increment)]
+    )
+
+    assert list(pipeline.map(range(50))) == [x * x + 1 for x in range(50)]
+    assert [s.n_items for s in pipeline.stats] == [50, 50]
+    assert all(s.throughput > 0 for s in pipeline.stats)
+
+
+def test_initializer_runs_once_per_worker():
+    pipeline = Pipeline(
+        [Stage("model", use_model, n_workers=2, initializer=load_model)]
+    )
+    models = {}
+
+    for pid, model in pipeline.map(range(20)):
+        models.setdefault(pid, set()).add(model)
+
+    assert 1 <= len(models) <= 2
+    assert all(len(ids) == 1 for ids in models.values())
+
+
+def test_reports_progress():
+    calls = []
+    pipeline = Pipeline(
+        [Stage("a", increment), Stage("b", increment)],
+        progress=lambda stats: calls.append((stats.name, stats.n_items)),
+    )
+
+    assert list(pipeline.map(range(3))) == [2, 3, 4]
+    # stages run concurrently, but each one reports its items in order
+    assert [n for name, n in calls if name == "a"] == [1, 2, 3]
+    assert [n for name, n in calls if name == "b"] == [1, 2, 3]
+
+
+def test_propagates_errors():
+    pipeline = Pipeline([Stage("fail", fail_on_three), Stage("increment", increment)])
+    results = pipeline.map(range(10))
+
+    assert [next(results) for _ in range(3)] == [1, 2, 3]
+
+    with pytest.raises(ValueError, match="three"):
+        next(results)
+
+
+def test_stops_early():
+    pipeline = Pipeline([Stage("increment", increment)], max_in_flight=2)
+
+    for x in pipeline.map(range(1_000_000)):
+        if x == 5:
+            break
+
+    assert pipeline.stats[0].n_items < 100
@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+import pytest
+
+from aiutils import registry
+from aiutils.registry import ModelMeta, ModelRegistry, module_bytes
+
+
+@pytest.fixture(autouse=True)
+def unload():
+    yield
+    registry.REGISTRY.unload()
+
+
+class Model(metaclass=ModelMeta):
+    n_loaded = 0
+
+    def __init__(self, size=10):
+        type(self).n_loaded += 1
+        time.sleep(0.05)
+        self.size = size
+
+    def memory_usage(self):
+        return self.size
+
+
+class GPUModel(metaclass=ModelMeta):
+    fork_safe = False
+
+
+def test_returns_the_same_instance():
+    Model.n_loaded = 0
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        instances = list(executor.map(lambda _: Model(), range(8)))
+
+    assert Model.n_loaded == 1
+    assert all(instance is instances[0] for instance in instances)
+    assert Model() is instances[0]
+
+
+def test_stats_and_unload():
+    Model(size=100)
+    (stats,) = registry.REGISTRY.stats()
+
+    assert stats.name == "Model"
+    assert stats.n_bytes == 100
+    assert stats.load_seconds >= 0.05
+    assert stats.preloaded is False
+    assert registry.REGISTRY.n_bytes == 100
+
+    registry.REGISTRY.unload(Model)
+
+    assert not registry.REGISTRY.is_loaded(Model)
+    assert Model(size=5).size == 5
+
+
+def test_preload():
+    registry.preload(Model, GPUModel)
+
+    assert registry.REGISTRY.is_loaded(Model)
+    assert [stats.preloaded for stats in registry.REGISTRY.stats()] == [True, True]
+
+
+def test_child_keeps_fork_safe_models():
+    models = ModelRegistry()
+    model = models.get(Model)
+    models.get(GPUModel)
+
+    models._after_fork_in_child()
+
+    assert models.get(Model) is model
+    assert not models.is_loaded(GPUModel)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_forked_process_inherits_preloaded_models():
+    registry.preload(Model, GPUModel)
+    model = Model()
+    read, write = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        try:
+            inherited = Model() is model
+            dropped = not registry.REGISTRY.is_loaded(GPUModel)
+            os.write(write, b"%d%d" % (inherited, dropped))
+        finally:
+            os._exit(0)
+
+    os.waitpid(pid, 0)
+
+    assert os.read(read, 2) == b"11"
+    assert registry.REGISTRY.is_loaded(GPUModel)
+
+
+def test_module_bytes():
+    torch = pytest.importorskip("torch")
+    module = torch.nn.Linear(10, 5)
+    module.register_buffer("buffer", torch.zeros(3, dtype=torch.float64))
+
+    assert module_bytes(module) == (10 * 5 + 5) * 4 + 3 * 8
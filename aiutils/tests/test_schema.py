@@ -0,0 +1,186 @@
+from typing import Optional
+import sys
+
+from pydantic import BaseModel, ConfigDict
+import pytest
+
+from aiutils.cache import APICache
+from aiutils.schema import CompiledModel, compile_schema, constructor
+
+
+class Message(BaseModel):
+    role: str
+    content: Optional[str] = None
+
+
+class Choice(BaseModel):
+    index: int
+    message: Message
+
+
+class Usage(BaseModel):
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class Completion(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    id: str
+    choices: list[Choice]
+    usage: Optional[Usage] = None
+    logprobs: dict[str, Message] = {}
+
+
+class Chunk(BaseModel):
+    content: str
+
+
+class Node(BaseModel):
+    value: int
+    children: list["Node"] = []
+
+
+class Tagged(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    tags: list[str]
+    meta: dict
+    pairs: Optional[list[list[int]]] = None
+
+
+@pytest.fixture
+def completion():
+    return Completion(
+        id="chatcmpl-123",
+        choices=[
+            Choice(index=0, message=Message(role="assistant", content="hello")),
+            Choice(index=1, message=Message(role="assistant")),
+        ],
+        usage=Usage(prompt_tokens=10, completion_tokens=5),
+        logprobs={"a": Message(role="user")},
+        system_fingerprint="fp_123",
+    ).model_dump()
+
+
+def test_compile_schema(completion):
+    response = compile_schema(Completion)(completion)
+
+    assert isinstance(response, CompiledModel)
+    assert response.id == "chatcmpl-123"
+    assert response.choices[0].message.content == "hello"
+    assert response.choices[1].message.content is None
+    assert response.usage.prompt_tokens == 10
+    assert response.logprobs["a"].role == "user"
+    assert response["system_fingerprint"] == "fp_123"
+    assert response["id"] == "chatcmpl-123"
+    assert response.to_dict() == completion
+    assert not hasattr(response, "__dict__")
+    assert type(response.choices[0]) is compile_schema(Choice)
+
+
+def test_compile_schema_handles_missing_and_null_fields():
+    response = compile_schema(Completion)({"id": "x", "choices": [], "usage": None})
+
+    assert response.usage is None
+    assert response.logprobs is None
+    assert response.choices == []
+
+
+def test_compile_schema_recursive_models():
+    tree = Node(value=0, children=[Node(value=1, children=[Node(value=2)])])
+
+    root = compile_schema(Node)(tree.model_dump())
+
+    assert root.children[0].children[0].value == 2
+    assert compile_schema(Node) is compile_schema(Node)
+
+
+def test_constructor(completion):
+    response = constructor(Completion)(completion)
+
+    assert isinstance(response, Completion)
+    assert isinstance(response.choices[0].message, Message)
+    assert isinstance(response.logprobs["a"], Message)
+    assert response.choices[0].message.content == "hello"
+    assert response.system_fingerprint == "fp_123"
+    assert response.model_dump() == completion
+
+    tree = Node(value=0, children=[Node(value=1)])
+    assert constructor(Node)(tree.model_dump()) == tree
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="X | Y requires 3.10+")
+def test_union_type_annotations():
+    class Response(BaseModel):
+        usage: Usage | None = None
+
+    data = {"usage": {"prompt_tokens": 1, "completion_tokens": 2}}
+
+    assert compile_schema(Response)(data).usage.prompt_tokens == 1
+    assert isinstance(constructor(Response)(data).usage, Usage)
+
+
+@pytest.mark.parametrize("make_type", [compile_schema, constructor])
+def test_cached_responses_are_not_shared(make_type):
+    def api_function(q):
+        return Tagged(tags=["a"], meta={}, pairs=[[1]], extra=["x"])
+
+    my_cache = APICache(
+        api_function, path_to_db="api_calls.db", response_type=make_type(Tagged)
+    )
+
+    def extra(response):
+        return response["extra"] if make_type is compile_schema else response.extra
+
+    first = my_cache(q=1)
+    first.tags.append("MUT")
+    first.meta["x"] = 99
+    first.pairs[0].append(2)
+    extra(first).append("MUT")
+
+    hit = my_cache(q=1)
+
+    assert hit.tags == ["a"]
+    assert hit.meta == {}
+    assert hit.pairs == [[1]]
+    assert extra(hit) == ["x"]
+
+
+@pytest.mark.parametrize(
+    "make_type, expected_type",
+    [
+        (compile_schema, CompiledModel),
+        (constructor, BaseModel),
+    ],
+    ids=["compiled", "constructor"],
+)
+def test_api_cache_response_type(completion, make_type, expected_type):
+    calls = []
+
+    def api_function(messages, stream=False):
+        calls.append(messages)
+
+        if stream:
+            return (Chunk(content=token) for token in ["a", "b"])
+
+        return Completion(**completion)
+
+    my_cache = APICache(
+        api_function,
+        path_to_db="api_calls.db",
+        response_type=make_type(Completion),
+        chunk_type=make_type(Chunk),
+    )
+
+    miss = my_cache(messages="hi")
+    hit = my_cache(messages="hi")
+    stream = [chunk.content for chunk in my_cache(messages="hi", stream=True)]
+    replay = list(my_cache(messages="hi", stream=True))
+
+    assert len(calls) == 2
+    assert isinstance(miss, expected_type)
+    assert isinstance(hit, expected_type)
+    assert hit.choices[0].message.content == "hello"
+    assert stream == ["a", "b"]
+    assert all(isinstance(chunk, expected_type) for chunk in replay)
@@ -0,0 +1,198 @@
+import math
+
+from pydantic import BaseModel
+import pytest
+
+from aiutils.cache import APICache
+from aiutils.semantic import SemanticIndex, split_messages
+
+VOCABULARY = ["book", "recommend", "science", "fiction", "cooking", "me", "a"]
+
+
+def embed(text):
+    words = text.lower().split()
+    return [words.count(word) + 0.01 for word in VOCABULARY]
+
+
+class SampleResponseModel(BaseModel):
+    key: str
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def semantic_cache(calls):
+    def api_function(model, messages):
+        calls.append(messages[-1]["content"])
+        return SampleResponseModel(key=f"answer to {messages[-1]['content']}")
+
+    return APICache(
+        api_function=api_function,
+        path_to_db="api_calls.db",
+        semantic=SemanticIndex(embed, threshold=0.95),
+    )
+
+
+def messages(question, system=("You're a librarian", "Be brief")):
+    return [{"role": "system", "content": content} for content in system] + [
+        {"role": "user", "content": question}
+    ]
+
+
+def test_split_messages():
+    assert split_messages(
+        [
+            {"role": "system", "content": "s"},
+            {"role": "user", "content": [{"type": "text", "text": "hi"}]},
+            {"role": "assistant", "content": "a"},
+        ]
+    ) == (
+        "hi",
+        [{"role": "system", "content": "s"}, {"role": "assistant", "content": "a"}],
+    )
+    assert split_messages([{"role": "system", "content": "s"}]) is None
+
+
+def test_near_hit(semantic_cache, calls):
+    semantic_cache(
+        model="gpt", messages=messages("Recommend me a science fiction book")
+    )
+    response = semantic_cache(
+        model="gpt",
+        messages=messages(
+            "  recommend me a SCIENCE fiction book ",
+            system=("Be  brief", "you're a librarian"),
+        ),
+    )
+
+    assert response.key == "answer to Recommend me a science fiction book"
+    assert calls == ["Recommend me a science fiction book"]
+    assert semantic_cache.stats == {"misses": 1, "near_hits": 1}
+
+
+def test_dissimilar_prompt_is_a_miss(semantic_cache, calls):
+    semantic_cache(
+        model="gpt", messages=messages("Recommend me a science fiction book")
+    )
+    semantic_cache(model="gpt", messages=messages("Recommend me a cooking book"))
+
+    assert len(calls) == 2
+    assert semantic_cache.stats == {"misses": 2}
+
+
+def test_different_kwargs_are_not_compared(semantic_cache, calls):
+    semantic_cache(
+        model="gpt", messages=messages("Recommend me a science fiction book")
+    )
+    semantic_cache(
+        model="other", messages=messages("Recommend me a science fiction book")
+    )
+    semantic_cache(
+        model="gpt",
+        messages=messages("Recommend me a science fiction book", system=["Hi"]),
+    )
+
+    assert len(calls) == 3
+
+
+def test_index_is_persisted(semantic_cache, calls):
+    semantic_cache(
+        model="gpt", messages=messages("Recommend me a science fiction book")
+    )
+
+    another = APICache(
+        api_function=semantic_cache._api_function,
+        path_to_db="api_calls.db",
+        semantic=SemanticIndex(embed, threshold=0.95),
+    )
+    another(model="gpt", messages=messages("recommend me a science fiction book"))
+
+    assert len(calls) == 1
+    assert another.stats == {"near_hits": 1}
+
+
+def test_evicted_calls_are_removed_from_the_index(calls):
+    def api_function(model, messages):
+        calls.append(messages[-1]["content"])
+        return SampleResponseModel(key=f"answer to {messages[-1]['content']}")
+
+    index = SemanticIndex(embed, threshold=0.95)
+    cache = APICache(
+        api_function=api_function,
+        path_to_db="api_calls.db",
+        semantic=index,
+        max_entries=1,
+    )
+    cache(model="gpt", messages=messages("Recommend me a science fiction book"))
+    cache(model="gpt", messages=messages("Recommend me a cooking book"))
+
+    # only the deleted keys are removed, the index isn't scanned
+    def keys():
+        raise AssertionError("compact must not scan the index")
+
+    index.keys, all_keys = keys, index.keys
+    cache.compact()
+    index.keys = all_keys
+
+    assert len(index.keys()) == 1
+
+    # the evicted call isn't returned as a near hit, it's called again
+    cache(model="gpt", messages=messages("recommend me a science fiction book"))
+
+    assert len(calls) == 3
+
+
+def test_near_hit_skips_evicted_keys(semantic_cache, calls):
+    question = "Recommend me a science fiction book"
+    semantic_cache(model="gpt", messages=messages(question))
+    semantic_cache.insert(
+        kwargs=dict(model="gpt", messages=messages(question + " please")),
+        response={"key": "another answer"},
+    )
+    # evicted behind the index's back
+    evicted = semantic_cache.key(dict(model="gpt", messages=messages(question)))
+    semantic_cache._backend.connection.execute(
+        "DELETE FROM api_calls WHERE key = ?", (evicted,)
+    )
+    semantic_cache._backend.connection.commit()
+    semantic_cache._memory.clear()
+
+    response = semantic_cache(model="gpt", messages=messages(question.upper()))
+
+    assert response.key == "another answer"
+    assert calls == [question]
+    assert evicted not in semantic_cache._semantic.keys()
+
+
+def test_index_grows_and_shrinks():
+    # a different angle for each number
+    index = SemanticIndex(
+        lambda text: [math.cos(float(text)), math.sin(float(text))], threshold=0.999
+    )
+    index.connect("api_calls.db")
+    queries = {
+        str(i): index.encode("f", dict(messages=messages(str(i)))) for i in range(40)
+    }
+
+    for key, query in queries.items():
+        index.add(query, key)
+
+    vectors = index._index(queries["0"].context)
+    assert len(vectors.matrix) == 40
+    assert len(vectors._buffer) == 64
+
+    index.remove([str(i) for i in range(0, 40, 2)])
+
+    assert len(vectors.keys) == 20
+    assert all(index.search(queries[str(i)])[0] == str(i) for i in range(1, 40, 2))
+    assert index.search(queries["2"])[0] is None
+    assert sorted(index.keys()) == sorted(vectors.keys)
+
+
+def test_zero_embedding():
+    index = SemanticIndex(lambda text: [0.0, 0.0])
+
+    assert index.embed("anything").tolist() == [0.0, 0.0]
@@ -0,0 +1,183 @@
+from pathlib import Path
+import json
+import sqlite3
+
+import pytest
+
+from aiutils import snapshot
+from aiutils.cache import APICache
+from aiutils.cli import cli
+from aiutils.backends import SQLiteBackend
+import aiutils.backends as backends
+from aiutils.codecs import Codec, dictionary_id
+import aiutils.cache as cache
+
+
+def first_api_function():
+    pass
+
+
+def second_api_function():
+    pass
+
+
+@pytest.fixture
+def golden(monkeypatch):
+    now = 1_000_000
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+
+    first = APICache(
+        api_function=first_api_function,
+        path_to_db="golden.db",
+        codec=Codec(compressor="zlib"),
+    )
+    second = APICache(api_function=second_api_function, path_to_db="golden.db")
+
+    for i in range(5):
+        first.insert(kwargs={"i": i}, response={"first": i})
+        second.insert(kwargs={"i": i}, response={"second": i})
+        now += 10
+
+    # expired
+    first.insert(kwargs={"i": 100}, response={"first": 100}, ttl=-1)
+    monkeypatch.undo()
+
+    return 1_000_000
+
+
+def lookup(path_to_db, api_function, i):
+    my_cache = APICache(api_function=api_function, path_to_db=path_to_db, memory=False)
+    return my_cache.lookup(kwargs={"i": i})
+
+
+@pytest.mark.parametrize("extension", ["jsonl", "parquet"])
+def test_export_import_roundtrip(golden, extension):
+    assert snapshot.export_entries("golden.db", f"snapshot.{extension}") == 10
+    assert snapshot.import_entries(f"snapshot.{extension}", "replica.db") == 10
+
+    assert lookup("replica.db", first_api_function, 3) == {"first": 3}
+    assert lookup("replica.db", second_api_function, 4) == {"second": 4}
+    assert lookup("replica.db", first_api_function, 100) is None
+
+
+def test_export_format_is_readable(golden):
+    snapshot.export_entries("golden.db", "snapshot.jsonl")
+
+    with open("snapshot.jsonl") as f:
+        records = [json.loads(line) for line in f]
+
+    assert {r["qualified_name"] for r in records} == {
+        "test_snapshot.first_api_function",
+        "test_snapshot.second_api_function",
+    }
+    assert {"key", "kwargs", "response", "created_at", "expires_at"} < set(records[0])
+    first = [r["response"]["first"] for r in records if "first" in r["response"]]
+    assert sorted(first) == [0, 1, 2, 3, 4]
+
+
+def test_export_filters(golden, monkeypatch):
+    count = snapshot.export_entries(
+        "golden.db",
+        "snapshot.jsonl",
+        qualified_name="test_snapshot.first_api_function",
+    )
+    assert count == 5
+
+    # entries are created 10 seconds apart
+    monkeypatch.setattr(snapshot.time, "time", lambda: golden + 1000)
+    count = snapshot.export_entries("golden.db", "snapshot.jsonl", max_age=975)
+    assert count == 4
+
+
+def test_import_keeps_the_newest_entry(golden):
+    snapshot.export_entries("golden.db", "snapshot.jsonl")
+
+    newer = APICache(api_function=first_api_function, path_to_db="replica.db")
+    newer.insert(kwargs={"i": 0}, response={"first": "newer"})
+
+    snapshot.import_entries("snapshot.jsonl", "replica.db", codec=Codec("msgpack"))
+
+    assert lookup("replica.db", first_api_function, 0) == {"first": "newer"}
+    assert lookup("replica.db", first_api_function, 1) == {"first": 1}
+
+
+def test_merge(golden):
+    dictionary_codec = Codec(compressor="zstd", dictionary=b"a small dictionary" * 8)
+    other = APICache(
+        api_function=first_api_function, path_to_db="other.db", codec=dictionary_codec
+    )
+    other.insert(kwargs={"i": 1}, response={"first": "newer"})
+    other.insert(kwargs={"i": 50}, response={"first": 50})
+
+    assert snapshot.merge("other.db", "golden.db") == 2
+
+    assert lookup("golden.db", first_api_function, 0) == {"first": 0}
+    assert lookup("golden.db", first_api_function, 1) == {"first": "newer"}
+    assert lookup("golden.db", first_api_function, 50) == {"first": 50}
+
+
+def test_merge_copies_dictionaries_first(golden, monkeypatch):
+    dictionary_codec = Codec(compressor="zstd", dictionary=b"a small dictionary" * 8)
+    other = APICache(
+        api_function=first_api_function, path_to_db="other.db", codec=dictionary_codec
+    )
+    other.insert(kwargs={"i": 50}, response={"first": 50})
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("merge failed")
+
+    monkeypatch.setattr(snapshot, "_upsert", fail)
+
+    with pytest.raises(RuntimeError, match="merge failed"):
+        snapshot.merge("other.db", "golden.db")
+
+    target = SQLiteBackend("golden.db")
+    assert target.get_dictionary(dictionary_id(dictionary_codec.dictionary))
+
+
+def test_merge_opens_the_source_read_only(golden, monkeypatch):
+    with pytest.raises(FileNotFoundError):
+        snapshot.merge("missing.db", "golden.db")
+
+    assert not Path("missing.db").exists()
+
+    opened = []
+    connect = backends.connect
+
+    def record(path_to_db, read_only=False):
+        opened.append((path_to_db, read_only))
+        return connect(path_to_db, read_only=read_only)
+
+    monkeypatch.setattr(backends, "connect", record)
+
+    assert snapshot.merge("golden.db", "other.db") == 10
+    assert ("golden.db", False) not in opened
+    assert ("golden.db", True) in opened
+
+    source = SQLiteBackend("golden.db", read_only=True)
+
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        source.connection.execute("DELETE FROM api_calls")
+
+
+def test_export_opens_the_database_read_only(golden):
+    with pytest.raises(FileNotFoundError):
+        snapshot.export_entries("missing.db", "snapshot.jsonl")
+
+    assert not Path("missing.db").exists()
+
+
+def test_unknown_format(golden):
+    with pytest.raises(ValueError, match="Cannot infer the snapshot format"):
+        snapshot.export_entries("golden.db", "snapshot.csv")
+
+
+def test_cli(golden, capsys):
+    cli(["export", "snapshot.jsonl", "--path-to-db", "golden.db"])
+    cli(["import", "snapshot.jsonl", "--path-to-db", "replica.db"])
+    cli(["merge", "golden.db", "--path-to-db", "other.db"])
+
+    out = capsys.readouterr().out
+    assert "Exported 10 entries" in out
+    assert "Imported 10 entries" in out
+    assert "Merged 10 entries" in out
@@ -0,0 +1,146 @@
+import threading
+
+import fitz
+import numpy as np
+import pytest
+
+from aiutils import document, tables
+from aiutils.tablecache import PageTables, TableCache, page_fingerprint
+
+
+@pytest.fixture
+def path_to_pdf():
+    doc = fitz.open()
+
+    for i in range(5):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"page {i}")
+
+    doc.save("doc.pdf")
+    return "doc.pdf"
+
+
+@pytest.fixture
+def extracted(monkeypatch):
+    """Replace the models, record the size of the images they get"""
+    images = []
+
+    def extract_tables(page):
+        images.append(page.size)
+        grid = tables.CellGrid(
+            rows=[[0, 10, 100, 20], [0, 0, 100, 10]],
+            columns=[[0, 0, 50, 20], [50, 0, 100, 20]],
+        )
+        return PageTables(
+            objects=[{"label": "table", "score": 0.9, "bbox": [1.5, 2, 3, 4]}],
+            grids=[grid],
+            tables=[{"0": ["a", "b"], "1": ["c", ""]}],
+        )
+
+    monkeypatch.setattr(document, "_extract_tables", extract_tables)
+    return images
+
+
+def test_round_trip():
+    cache = TableCache("tables.db")
+    grids = [
+        tables.CellGrid(rows=[[0, 0.1, 1, 1.25]], columns=[[0, 0, 1, 2], [1, 0, 2, 2]]),
+        tables.CellGrid([], []),
+    ]
+    page_tables = PageTables(
+        objects=[{"label": "table", "bbox": [0, 0, 1, 1]}] * 2,
+        grids=grids,
+        tables=[{"0": ["x", "y"]}, None],
+    )
+
+    cache.set("key", page_tables)
+    stored = TableCache("tables.db").get("key")
+
+    assert stored.objects == page_tables.objects
+    assert stored.tables == page_tables.tables
+
+    for grid, expected in zip(stored.grids, grids):
+        assert np.array_equal(grid.rows, expected.rows)
+        assert np.array_equal(grid.columns, expected.columns)
+
+    assert cache.get("missing") is None
+    assert len(cache) == 1
+
+
+def test_keys():
+    cache = TableCache("tables.db")
+    key = cache.key("fingerprint", fitz.Matrix(2, 2))
+
+    assert key == cache.key("fingerprint", [2, 0, 0, 2, 0, 0])
+    assert key != cache.key("other", fitz.Matrix(2, 2))
+    assert key != cache.key("fingerprint", fitz.Matrix(1, 1))
+    assert key != TableCache("tables.db", revision=dict(detection="v2")).key(
+        "fingerprint", fitz.Matrix(2, 2)
+    )
+
+
+def test_editing_a_page_only_changes_its_fingerprint(path_to_pdf):
+    doc = fitz.open(path_to_pdf)
+    before = [page_fingerprint(doc, i) for i in range(5)]
+
+    doc[3].insert_text((72, 144), "edited")
+    doc.save("edited.pdf")
+    edited = fitz.open("edited.pdf")
+    after = [page_fingerprint(edited, i) for i in range(5)]
+
+    assert len(set(before)) == 5
+    assert [b == a for b, a in zip(before, after)] == [True, True, True, False, True]
+
+
+def test_document_reads_unchanged_pages_from_the_cache(path_to_pdf, extracted):
+    cache = TableCache("tables.db")
+
+    first = list(document.Document(path_to_pdf, table_cache=cache).iter_tables())
+
+    assert len(extracted) == 5
+    assert len(cache) == 5
+
+    second = list(document.Document(path_to_pdf, table_cache=cache).iter_tables())
+
+    assert second == first
+    assert len(extracted) == 5
+
+    doc = fitz.open(path_to_pdf)
+    doc[3].insert_text((72, 144), "edited")
+    doc.save("edited.pdf")
+
+    with document.Document("edited.pdf", table_cache=cache) as edited:
+        assert list(edited.iter_tables()) == first
+        page_tables = edited.get_page_tables(1)
+
+    # only the edited page is rendered (at the zoom in the key)
+    assert extracted[5:] == [extracted[0]]
+    assert len(cache) == 6
+    assert page_tables.grids[0].shape == (2, 2)
+    assert page_tables.objects[0]["bbox"] == [1.5, 2, 3, 4]
+
+
+def test_document_without_cache(path_to_pdf, extracted):
+    doc = document.Document(path_to_pdf)
+
+    assert doc.get_tables_in_page(2) == [{"0": ["a", "b"], "1": ["c", ""]}]
+    assert len(list(doc.iter_tables())) == 5
+    assert len(extracted) == 6
+
+
+def test_closes_connections_of_finished_threads():
+    cache = TableCache("tables.db", revision={})
+
+    def count():
+        return len(cache)
+
+    for _ in range(5):
+        thread = threading.Thread(target=count)
+        thread.start()
+        thread.join()
+
+    assert len(cache._connections) == 1
+
+    cache.close()
+
+    assert len(cache._connections) == 0
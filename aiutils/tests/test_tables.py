@@ -0,0 +1,359 @@
+import numpy as np
+from PIL import Image, ImageDraw
+import pytest
+
+from aiutils import tables
+
+
+@pytest.fixture
+def torch():
+    return pytest.importorskip("torch")
+
+
+class Outputs(dict):
+    """Mimics transformers' ModelOutput (attribute and key access)"""
+
+    __getattr__ = dict.__getitem__
+
+
+def reference_outputs_to_objects(outputs, img_size, id2label):
+    """The original, one image at a time, implementation"""
+    m = outputs.logits.softmax(-1).max(-1)
+    pred_labels = list(m.indices.detach().cpu().numpy())[0]
+    pred_scores = list(m.values.detach().cpu().numpy())[0]
+    pred_bboxes = outputs["pred_boxes"].detach().cpu()[0]
+    pred_bboxes = [
+        elem.tolist() for elem in tables.rescale_bboxes(pred_bboxes, img_size)
+    ]
+
+    return [
+        {
+            "label": id2label[int(label)],
+            "score": float(score),
+            "bbox": [float(elem) for elem in bbox],
+        }
+        for label, score, bbox in zip(pred_labels, pred_scores, pred_bboxes)
+        if id2label[int(label)] != "no object"
+    ]
+
+
+@pytest.fixture
+def id2label():
+    return {0: "table", 1: "table rotated", 2: "no object"}
+
+
+def test_outputs_to_objects_batch_matches_single_image(id2label, torch):
+    torch.manual_seed(0)
+    logits = torch.randn(3, 15, 3)
+    boxes = torch.rand(3, 15, 4) / 2 + 0.25
+    sizes = [(100, 200), (640, 480), (50, 50)]
+
+    batched = tables.outputs_to_objects_batch(
+        Outputs(logits=logits, pred_boxes=boxes), sizes, id2label
+    )
+
+    for i, size in enumerate(sizes):
+        single = reference_outputs_to_objects(
+            Outputs(logits=logits[i : i + 1], pred_boxes=boxes[i : i + 1]),
+            size,
+            id2label,
+        )
+        assert [o["label"] for o in batched[i]] == [o["label"] for o in single]
+        assert [o["score"] for o in batched[i]] == [o["score"] for o in single]
+
+        for obj, expected in zip(batched[i], single):
+            assert obj["bbox"] == pytest.approx(expected["bbox"])
+
+
+def test_pad_batch(torch):
+    batch, mask = tables._pad_batch([torch.ones(3, 2, 4), torch.ones(3, 5, 1)])
+
+    assert batch.shape == (2, 3, 5, 4)
+    assert mask.tolist()[0] == [[1] * 4] * 2 + [[0] * 4] * 3
+    assert mask.tolist()[1] == [[1, 0, 0, 0]] * 5
+    assert batch.sum() == mask.sum() * 3
+
+
+@pytest.fixture
+def tiny_detector(torch):
+    """A TableDetector with a small, randomly initialized model"""
+    transformers = pytest.importorskip("transformers")
+    from torchvision import transforms
+
+    config = transformers.TableTransformerConfig(
+        use_timm_backbone=False,
+        use_pretrained_backbone=False,
+        backbone=None,
+        backbone_config=transformers.ResNetConfig(
+            embedding_size=8,
+            hidden_sizes=[8, 8, 8, 8],
+            depths=[1, 1, 1, 1],
+            out_features=["stage4"],
+        ),
+        d_model=16,
+        encoder_layers=1,
+        decoder_layers=1,
+        encoder_attention_heads=2,
+        decoder_attention_heads=2,
+        encoder_ffn_dim=16,
+        decoder_ffn_dim=16,
+        num_queries=5,
+        id2label={0: "table", 1: "table rotated"},
+        label2id={"table": 0, "table rotated": 1},
+    )
+    torch.manual_seed(0)
+    detector = object.__new__(tables.TableDetector)
+    detector._device = "cpu"
+    detector._detection_transform = transforms.Compose(
+        [tables.MaxResize(64), transforms.ToTensor()]
+    )
+    detector._model = transformers.TableTransformerForObjectDetection(config).eval()
+    return detector
+
+
+def test_detect_batch_matches_detect(tiny_detector):
+    rng = np.random.default_rng(0)
+    images = [
+        Image.fromarray(rng.integers(0, 255, (h, w, 3), dtype=np.uint8))
+        for h, w in [(64, 48), (64, 48), (30, 64)]
+    ]
+
+    single = [tiny_detector.detect(image) for image in images]
+    batched = tiny_detector.detect_batch(images, batch_size=3)
+
+    assert len(batched) == 3
+
+    for objects, expected in zip(batched, single):
+        assert [o["label"] for o in objects] == [o["label"] for o in expected]
+
+        # padding the last image changes the backbone's features at the
+        # borders slightly
+        for obj, exp in zip(objects, expected):
+            assert obj["bbox"] == pytest.approx(exp["bbox"], abs=0.01)
+
+
+def test_detect_does_not_modify_the_model_config(tiny_detector):
+    image = Image.new("RGB", (64, 48))
+
+    tiny_detector.detect(image)
+    tiny_detector.detect(image)
+
+    assert tiny_detector._model.config.id2label == {0: "table", 1: "table rotated"}
+
+
+def test_structure_detect_batch_draws_only_when_visualizing(tiny_detector):
+    structure = object.__new__(tables.TableStructureDetector)
+    structure._device = "cpu"
+    structure._structure_model = tiny_detector._model
+    structure._structure_transform = tiny_detector._detection_transform
+    images = [Image.new("RGB", (64, 48), "white"), Image.new("RGB", (30, 64))]
+
+    plain = structure.detect_batch(images)
+    drawn = structure.detect_batch(images, visualize=True)
+
+    assert [image for image, _ in plain] == images
+    assert all(a is b for (a, _), b in zip(plain, images))
+    assert all(image is not original for (image, _), original in zip(drawn, images))
+    assert [cells for _, cells in plain] == [cells for _, cells in drawn]
+    assert structure.detect(images[0], visualize=False)[0] is images[0]
+
+
+class FakeReader:
+    """
+    Reads fixed words: draw paints each one on an image as a block of its own
+    color, readtext finds those blocks and returns (bbox points, text,
+    confidence) for each one
+    """
+
+    def __init__(self, results) -> None:
+        self.results = results
+        self.calls = []
+
+    def color(self, i):
+        return (i + 1, 100, 200)
+
+    def draw(self, image):
+        draw = ImageDraw.Draw(image)
+
+        for i, (points, _, _) in enumerate(self.results):
+            (x0, y0), _, (x1, y1), _ = points
+            draw.rectangle([x0, y0, x1 - 1, y1 - 1], fill=self.color(i))
+
+        return image
+
+    def readtext(self, image, batch_size):
+        self.calls.append(dict(shape=image.shape, batch_size=batch_size))
+        recognized = []
+
+        for i, (_, text, confidence) in enumerate(self.results):
+            ys, xs = np.nonzero((image == self.color(i)).all(axis=-1))
+
+            if len(xs):
+                x0, y0, x1, y1 = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+                points = [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+                recognized.append((points, text, confidence))
+
+        return recognized
+
+
+def word(text, x, y):
+    """An OCR result for a 10x10 word whose top-left corner is at x, y"""
+    return [[x, y], [x + 10, y], [x + 10, y + 10], [x, y + 10]], text, 0.9
+
+
+def grid(n_rows, n_columns, size=50):
+    rows = [
+        {"label": "table row", "bbox": [0, i * size, n_columns * size, (i + 1) * size]}
+        for i in range(n_rows)
+    ]
+    columns = [
+        {"label": "table column", "bbox": [j * size, 0, (j + 1) * size, n_rows * size]}
+        for j in range(n_columns)
+    ]
+    return tables.get_cell_grid(columns + rows)
+
+
+def reference_cell_coordinates(table_data):
+    """The original, dict-based, implementation of get_cell_coordinates_by_row"""
+    rows = [entry for entry in table_data if entry["label"] == "table row"]
+    columns = [entry for entry in table_data if entry["label"] == "table column"]
+    rows.sort(key=lambda x: x["bbox"][1])
+    columns.sort(key=lambda x: x["bbox"][0])
+    cell_coordinates = []
+
+    for row in rows:
+        row_cells = [
+            {
+                "column": column["bbox"],
+                "cell": [
+                    column["bbox"][0],
+                    row["bbox"][1],
+                    column["bbox"][2],
+                    row["bbox"][3],
+                ],
+            }
+            for column in columns
+        ]
+        cell_coordinates.append(
+            {"row": row["bbox"], "cells": row_cells, "cell_count": len(row_cells)}
+        )
+
+    return cell_coordinates
+
+
+def test_cell_grid_matches_reference():
+    rng = np.random.default_rng(0)
+    table_data = [
+        {"label": label, "score": 0.9, "bbox": rng.uniform(0, 500, 4).tolist()}
+        for label in ["table row"] * 7 + ["table column"] * 4 + ["table"]
+    ]
+    rng.shuffle(table_data)
+
+    assert tables.get_cell_coordinates_by_row(table_data) == reference_cell_coordinates(
+        table_data
+    )
+
+
+def test_cell_grid():
+    grid = tables.CellGrid(
+        rows=[[0, 10, 100, 20], [0, 0, 100, 10]],
+        columns=[[50, 0, 100, 20], [0, 0, 50, 20]],
+    )
+    records = grid.to_records()
+
+    assert grid.shape == (2, 2)
+    assert grid.cells[0].tolist() == [[0, 0, 50, 10], [50, 0, 100, 10]]
+    assert grid.cells[1].tolist() == [[0, 10, 50, 20], [50, 10, 100, 20]]
+    assert records.dtype == tables.CELL_DTYPE
+    assert records["row"].tolist() == [0, 0, 1, 1]
+    assert records["column"].tolist() == [0, 1, 0, 1]
+    assert records["bbox"][3].tolist() == [50, 10, 100, 20]
+    assert tables.CellGrid([], []).cells.shape == (0, 0, 4)
+
+
+@pytest.mark.parametrize(
+    "to_cells",
+    [
+        lambda grid: grid.to_dicts(),
+        lambda grid: grid,
+        lambda grid: grid.to_records(),
+    ],
+    ids=["dicts", "grid", "records"],
+)
+def test_apply_ocr(to_cells):
+    reader = FakeReader(
+        [
+            word("Revenue", 5, 55),
+            word("name", 5, 5),
+            word("2024", 60, 5),
+            word("USD", 30, 55),
+            word("10", 60, 55),
+            word("outside", 500, 500),
+            word("Costs", 5, 105),
+        ]
+    )
+    image = reader.draw(Image.new("RGB", (100, 150)))
+
+    df, data = tables.apply_ocr(to_cells(grid(3, 2)), image, reader=reader)
+
+    # every cell is read from a single image, in one batch
+    assert reader.calls == [
+        dict(shape=(6 * 50 + 7 * 16, 50 + 2 * 16, 3), batch_size=64)
+    ]
+    assert data == {
+        "0": ["name", "2024"],
+        "1": ["Revenue USD", "10"],
+        "2": ["Costs", ""],
+    }
+    assert df.columns.tolist() == ["name", "2024"]
+    assert df["name"].tolist() == ["Revenue USD", "Costs"]
+    # types are inferred, empty cells are missing values
+    assert df["2024"].dtype == "float64"
+    assert df["2024"].iloc[0] == 10
+    assert df["2024"].isna().iloc[1]
+
+
+def test_apply_ocr_header_names():
+    reader = FakeReader([word("a", 5, 5), word("a", 55, 5)])
+    image = reader.draw(Image.new("RGB", (150, 50)))
+
+    df, _ = tables.apply_ocr(grid(1, 3), image, reader=reader)
+
+    assert df.columns.tolist() == ["a", "a.1", "Unnamed: 2"]
+    assert len(df) == 0
+
+
+def test_apply_ocr_reads_cells_with_several_lines():
+    reader = FakeReader(
+        [
+            word("line", 5, 25),
+            word("first", 5, 5),
+            word("right", 55, 5),
+            word("second", 20, 65),
+            word("cell", 5, 85),
+        ]
+    )
+    image = reader.draw(Image.new("RGB", (100, 100)))
+
+    _, data = tables.apply_ocr(grid(2, 2), image, reader=reader)
+
+    assert data == {"0": ["first line", "right"], "1": ["second cell", ""]}
+
+
+def test_apply_ocr_splits_tall_tables(monkeypatch):
+    monkeypatch.setattr(tables, "OCR_MAX_HEIGHT", 200)
+    reader = FakeReader([word(str(i), 5, 50 * i + 5) for i in range(6)])
+    image = reader.draw(Image.new("RGB", (50, 300)))
+
+    _, data = tables.apply_ocr(grid(6, 1), image, reader=reader)
+
+    assert len(reader.calls) == 3
+    assert data == {str(i): [str(i)] for i in range(6)}
+
+
+def test_apply_ocr_without_cells():
+    reader = FakeReader([word("a", 5, 5)])
+
+    df, data = tables.apply_ocr([], Image.new("RGB", (50, 50)), reader=reader)
+
+    assert df is None and data is None
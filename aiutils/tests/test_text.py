@@ -0,0 +1,62 @@
+import fitz
+from PIL import Image
+import pytest
+
+from aiutils import text
+
+
+def make_pdf(path, n_pages, blank=()):
+    doc = fitz.open()
+
+    for i in range(n_pages):
+        page = doc.new_page()
+
+        if i not in blank:
+            page.insert_text((72, 72), f"{path} page {i}")
+
+    doc.save(path)
+    return path
+
+
+@pytest.fixture
+def fake_ocr(monkeypatch):
+    images = []
+
+    def ocr(image):
+        images.append(image.size)
+        return "ocr"
+
+    monkeypatch.setattr(text, "_ocr", ocr)
+    return images
+
+
+@pytest.mark.parametrize("n_workers", [None, 2])
+def test_pdf2text_many(n_workers):
+    paths = [make_pdf(f"{i}.pdf", n_pages) for i, n_pages in enumerate([7, 1, 3])]
+
+    results = text.pdf2text_many(paths, n_workers=n_workers, chunk_size=3)
+
+    assert list(results) == [text.pdf2text(path) for path in paths]
+
+
+def test_pdf2text_many_ocrs_pages_without_text(fake_ocr):
+    path = make_pdf("scanned.pdf", 3, blank={1})
+
+    (pages,) = text.pdf2text_many([path], chunk_size=2)
+
+    assert pages[0].startswith("scanned.pdf page 0")
+    assert pages[1] == "ocr"
+    assert pages[2].startswith("scanned.pdf page 2")
+    # pages are rendered at OCR_ZOOM
+    assert fake_ocr == [(1190, 1684)]
+    assert text.pdf2text(path)[1] == ""
+
+
+def test_image2text_many(fake_ocr):
+    for i in range(5):
+        Image.new("RGB", (10 + i, 10)).save(f"{i}.png")
+
+    texts = text.image2text_many([f"{i}.png" for i in range(5)], chunk_size=2)
+
+    assert list(texts) == ["ocr"] * 5
+    assert [size[0] for size in fake_ocr] == [10, 11, 12, 13, 14]
@@ -2,7 +2,7 @@ from openai import OpenAI
 from gdrive_loader.models import Document, User
 from sqlalchemy.orm import Session
 from gdrive_loader.db import engine
-from gdrive_loader.load import compute_embedding
+from gdrive_loader.embedding import compute_embedding
 
 
 def answer_query(query: str, email: str) -> str:
@@ -0,0 +1,270 @@
+"""
+Compute embeddings with OpenAI. The same module is used by pdf_loader,
+gdrive_loader and hubspot_loader, keep them in sync.
+
+EmbeddingService reuses a single client, packs texts into as few requests as
+the model allows (by number of inputs and tokens), sends up to max_concurrency
+requests at a time, retries rate limited (429) requests with exponential
+backoff and caches embeddings by content, so unchanged texts are never sent
+again.
+"""
+
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from openai import InternalServerError, OpenAI, RateLimitError
+from sqlalchemy.engine import make_url
+import tiktoken
+
+from gdrive_loader import SETTINGS
+
+MODEL = "text-embedding-3-small"
+
+# limits of the embeddings endpoint
+MAX_INPUT_TOKENS = 8191
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300_000
+
+
+class EmbeddingCache:
+    """Embeddings stored in a SQLite table, keyed by a hash of model and text"""
+
+    def __init__(self, path_to_db) -> None:
+        # shared by the threads sending requests, guarded by self._lock
+        self._connection = sqlite3.connect(
+            path_to_db, timeout=30, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    key TEXT PRIMARY KEY,
+                    embedding BLOB NOT NULL
+                )
+            """
+            )
+            self._connection.commit()
+
+    @staticmethod
+    def key(model, text):
+        return hashlib.blake2b(f"{model}\0{text}".encode(), digest_size=16).hexdigest()
+
+    def get_many(self, keys):
+        """Return a {key: embedding} dictionary with the keys found"""
+        found = {}
+
+        with self._lock:
+            # stay below SQLite's limit on the number of parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                rows = self._connection.execute(
+                    "SELECT key, embedding FROM embedding_cache "
+                    f"WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+
+        return found
+
+    def set_many(self, items):
+        """Store (key, embedding) pairs"""
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, embedding) VALUES (?, ?)",
+                [(key, array("f", embedding).tobytes()) for key, embedding in items],
+            )
+            self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+class EmbeddingService:
+    """Compute embeddings in batches, see the module's docstring
+
+    Parameters
+    ----------
+    model : str
+        Embedding model
+
+    cache : EmbeddingCache, optional
+        Where to store computed embeddings, they're not cached if None
+
+    max_concurrency : int, default=4
+        Maximum number of requests in flight
+
+    max_retries : int, default=6
+        Times to retry a request that got a 429 (or a 5xx) response
+
+    max_batch_tokens : int, default=MAX_BATCH_TOKENS
+        Maximum number of tokens per request
+
+    client : openai.OpenAI, optional
+        Client used for every request, a new one is created if None
+    """
+
+    def __init__(
+        self,
+        model=MODEL,
+        cache=None,
+        max_concurrency=4,
+        max_retries=6,
+        max_batch_tokens=MAX_BATCH_TOKENS,
+        client=None,
+    ) -> None:
+        self.model = model
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_batch_tokens = max_batch_tokens
+        # we retry ourselves, so retries are bounded by max_retries
+        self.client = client or OpenAI(max_retries=0)
+        self.encoding = tiktoken.encoding_for_model(model)
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """Return the embedding of every text, in order"""
+        keys = [EmbeddingCache.key(self.model, text) for text in texts]
+        embeddings = self.cache.get_many(list(set(keys))) if self.cache else {}
+
+        # texts we haven't seen (each one once)
+        missing = {}
+
+        for key, text in zip(keys, texts):
+            if key not in embeddings:
+                missing.setdefault(key, text)
+
+        if missing:
+            computed = self._compute(list(missing.values()))
+            computed = dict(zip(missing, computed))
+
+            if self.cache:
+                self.cache.set_many(computed.items())
+
+            embeddings.update(computed)
+
+        return [embeddings[key] for key in keys]
+
+    def embed_one(self, text: str) -> list[float]:
+        return self.embed([text])[0]
+
+    def _compute(self, texts):
+        batches = list(self._batches(texts))
+
+        if len(batches) == 1 or self.max_concurrency == 1:
+            results = [self._request(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                results = list(executor.map(self._request, batches))
+
+        return [embedding for result in results for embedding in result]
+
+    def _batches(self, texts):
+        """
+        Group texts into requests of up to MAX_BATCH_INPUTS inputs and
+        max_batch_tokens tokens, texts longer than the model's input limit are
+        truncated
+        """
+        batch, n_tokens = [], 0
+
+        for text in texts:
+            tokens = self.encoding.encode(text, disallowed_special=())
+
+            if len(tokens) > MAX_INPUT_TOKENS:
+                tokens = tokens[:MAX_INPUT_TOKENS]
+                text = self.encoding.decode(tokens)
+
+            # the endpoint rejects empty strings
+            text = text or " "
+
+            if batch and (
+                len(batch) == MAX_BATCH_INPUTS
+                or n_tokens + len(tokens) > self.max_batch_tokens
+            ):
+                yield batch
+                batch, n_tokens = [], 0
+
+            batch.append(text)
+            n_tokens += len(tokens)
+
+        if batch:
+            yield batch
+
+    def _request(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.client.embeddings.create(input=batch, model=self.model)
+            except (RateLimitError, InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+
+                time.sleep(_backoff(e, attempt))
+            else:
+                return [d.embedding for d in sorted(response.data, key=_index)]
+
+
+def _index(embedding):
+    return embedding.index
+
+
+def _backoff(error, attempt, base=1, cap=60):
+    """Seconds to wait before retrying, honoring the Retry-After header"""
+    retry_after = error.response.headers.get("retry-after")
+
+    try:
+        return min(float(retry_after), cap)
+    except (TypeError, ValueError):
+        # full jitter, so concurrent requests don't retry at the same time
+        return random.uniform(0, min(cap, base * 2**attempt))
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def _reset_service():
+    # the client's connections can't be shared with a forked process (e.g., a
+    # celery worker), children create their own service
+    global _service, _service_lock
+    _service = None
+    _service_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_service)
+
+
+def get_service() -> EmbeddingService:
+    """
+    Return the process' EmbeddingService, it caches embeddings in the app's
+    database
+    """
+    global _service
+
+    with _service_lock:
+        if _service is None:
+            path_to_db = make_url(SETTINGS.DB_URI).database
+            _service = EmbeddingService(cache=EmbeddingCache(path_to_db))
+
+    return _service
+
+
+def compute_embedding(text: str | list[str], return_single: bool = True) -> list[float]:
+    if isinstance(text, str):
+        text = [text]
+
+    embeddings = get_service().embed(text)
+
+    if len(embeddings) == 1 and return_single:
+        return embeddings[0]
+    else:
+        return embeddings
@@ -4,17 +4,7 @@ from googleapiclient.discovery import build
 import argparse
 from sqlalchemy.orm import Session
 from gdrive_loader.db import engine
-from openai import OpenAI
-
-
-def compute_embedding(text: str | list[str], return_single: bool = True) -> list[float]:
-    client = OpenAI()
-    response = client.embeddings.create(input=text, model="text-embedding-3-small")
-
-    if len(response.data) == 1 and return_single:
-        return response.data[0].embedding
-    else:
-        return [d.embedding for d in response.data]
+from gdrive_loader.embedding import compute_embedding
 
 
 def convert_doc_to_markdown(document):
@@ -122,7 +112,7 @@ def load_documents_from_user(email, dry_run=False, limit=None):
             print(f"Would process document: {name}")
         return
 
-    # Compute embeddings in batch
+    # Compute embeddings in batch, unchanged documents are read from the cache
     embeddings = compute_embedding([md[2] for md in markdown_docs], return_single=False)
 
     # Store everything in database
@@ -3,7 +3,7 @@ from openai import OpenAI
 from hubspot_loader.models import Document
 from sqlalchemy.orm import Session
 from hubspot_loader.db import engine
-from hubspot_loader.load import compute_embedding
+from hubspot_loader.embedding import compute_embedding
 
 SYSTEM_PROMPT = """
 You are a helpful assistant that can answer questions about the documents provided.
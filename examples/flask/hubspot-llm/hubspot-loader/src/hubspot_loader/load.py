@@ -2,21 +2,11 @@ from hubspot_loader.models import Document
 import argparse
 from sqlalchemy.orm import Session
 from hubspot_loader.db import engine
-from openai import OpenAI
+from hubspot_loader.embedding import compute_embedding
 import hubspot
 from hubspot_loader import SETTINGS
 
 
-def compute_embedding(text: str | list[str], return_single: bool = True) -> list[float]:
-    client = OpenAI()
-    response = client.embeddings.create(input=text, model="text-embedding-3-small")
-
-    if len(response.data) == 1 and return_single:
-        return response.data[0].embedding
-    else:
-        return [d.embedding for d in response.data]
-
-
 def iter_tickets(after=None, limit=None, _fetched=0):
     client = hubspot.Client.create(access_token=SETTINGS.HUBSPOT_ACCESS_TOKEN)
     api_response = client.crm.tickets.basic_api.get_page(
@@ -62,33 +52,27 @@ def load_tickets(limit=None, dry_run=False, reset=False):
             print(f"Would process ticket: {ticket.id} - {ticket.properties['subject']}")
         return
 
-    with Session(engine) as db_session:
-        batch = []
-        batch_contents = []
+    documents = [
+        Document(
+            name=ticket.properties["subject"],
+            content=ticket.properties["content"],
+            hubspot_ticket_id=ticket.id,
+        )
+        for ticket in iter_tickets(limit=limit, after=after)
+    ]
 
-        for ticket in iter_tickets(limit=limit, after=after):
-            document = Document(
-                name=ticket.properties["subject"],
-                content=ticket.properties["content"],
-                hubspot_ticket_id=ticket.id,
-            )
-            batch.append(document)
-            batch_contents.append(document.content)
+    if not documents:
+        return
 
-            if len(batch) == 10:
-                embeddings = compute_embedding(batch_contents, return_single=False)
-                for doc, emb in zip(batch, embeddings):
-                    doc.embedding = emb
-                    db_session.add(doc)
-                batch = []
-                batch_contents = []
+    # batched by the embedding service according to the model's limits
+    embeddings = compute_embedding(
+        [doc.content for doc in documents], return_single=False
+    )
 
-        # Handle remaining documents in final batch
-        if batch:
-            embeddings = compute_embedding(batch_contents, return_single=False)
-            for doc, emb in zip(batch, embeddings):
-                doc.embedding = emb
-                db_session.add(doc)
+    with Session(engine) as db_session:
+        for doc, emb in zip(documents, embeddings):
+            doc.embedding = emb
+            db_session.add(doc)
 
         db_session.commit()
 
@@ -1,6 +1,6 @@
 from openai import OpenAI
 import mistune
-from pdf_loader.models import Document
+from pdf_loader.models import Chunk
 from sqlalchemy.orm import Session
 from pdf_loader.db import engine
 from pdf_loader.embedding import compute_embedding
@@ -18,13 +18,16 @@ Respond in markdown format.
 """
 
 
-def answer_query(query: str) -> str:
+def answer_query(query: str, limit: int = 8) -> str:
     embedding = compute_embedding(query, return_single=True)
     with Session(engine) as db_session:
-        similar_docs = Document.find_similar(
+        similar_chunks = Chunk.find_similar(
             db_session,
             embedding=embedding,
-            limit=5,
+            limit=limit,
+        )
+        context = "\n\n".join(
+            f"# {chunk.document.name}\n\n{chunk.content}" for chunk in similar_chunks
         )
 
     messages = [
@@ -34,7 +37,7 @@ def answer_query(query: str) -> str:
         },
         {
             "role": "user",
-            "content": "\n\n".join([doc.content for doc in similar_docs]),
+            "content": context,
         },
         {
             "role": "user",
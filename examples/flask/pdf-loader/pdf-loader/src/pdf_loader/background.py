@@ -1,10 +1,12 @@
 from celery import Celery
 from pdf_loader import SETTINGS
-from pdf_loader.models import Document, DocumentStatus
+from pdf_loader.models import Chunk, Document, DocumentStatus
 from pdf_loader.db import engine
 from sqlalchemy.orm import Session
-from pdf_loader.embedding import compute_embedding
+from pdf_loader.embedding import get_service
+from pdf_loader.chunking import split_into_chunks
 from pathlib import Path
+import argparse
 import easyocr
 import fitz  # PyMuPDF
 
@@ -23,15 +25,60 @@ def process_pdf_document(filename: str):
         db_session.commit()
 
         content = pdf_ocr(filename)
-
-        # to prevent going over the max length
-        embedding = compute_embedding(content[:5000])
+        index_document(db_session, document, content)
         document.content = content
-        document.embedding = embedding
         document.status = DocumentStatus.COMPLETED
         db_session.commit()
 
 
+def index_document(db_session, document: Document, content: str) -> list[Chunk]:
+    """Replace the chunks of a document with the ones in content"""
+    service = get_service()
+    text_chunks = split_into_chunks(content, service.encoding)
+    # embedded in as few requests as the model allows
+    embeddings = service.embed([chunk.content for chunk in text_chunks])
+
+    Chunk.delete_for_document(db_session, document.id)
+    chunks = [
+        Chunk(
+            document_id=document.id,
+            position=position,
+            content=chunk.content,
+            n_tokens=chunk.n_tokens,
+        )
+        for position, chunk in enumerate(text_chunks)
+    ]
+    db_session.add_all(chunks)
+    # assigns the ids, which are the rowids in chunks_vec
+    db_session.flush()
+    Chunk.add_embeddings(db_session, chunks, embeddings)
+    return chunks
+
+
+def reindex_documents() -> int:
+    """
+    Index the processed documents that don't have chunks (e.g., processed before
+    documents were split into chunks), returns how many were indexed
+    """
+    with Session(engine) as db_session:
+        documents = (
+            db_session.query(Document)
+            .filter(
+                Document.status == DocumentStatus.COMPLETED,
+                Document.content.is_not(None),
+                ~Document.chunks.any(),
+            )
+            .all()
+        )
+
+        for document in documents:
+            print(f"Indexing {document.name}...")
+            index_document(db_session, document, document.content)
+            db_session.commit()
+
+    return len(documents)
+
+
 def pdf_ocr(filename: str) -> str:
     content = Path(SETTINGS.PATH_TO_UPLOADS / filename).read_bytes()
 
@@ -60,5 +107,16 @@ def pdf_ocr(filename: str) -> str:
 
 
 if __name__ == "__main__":
-    # this will force a model download
-    easyocr.Reader(["en"])
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Index processed documents that don't have chunks",
+    )
+    args = parser.parse_args()
+
+    if args.reindex:
+        print(f"Indexed {reindex_documents()} documents")
+    else:
+        # this will force a model download
+        easyocr.Reader(["en"])
@@ -0,0 +1,41 @@
+"""
+Split documents into overlapping passages of a bounded number of tokens, each
+one is embedded and retrieved on its own
+"""
+
+from collections import namedtuple
+
+# with the default limit in answer_query, the documents in a prompt take at
+# most 8 * 512 tokens
+CHUNK_TOKENS = 512
+CHUNK_OVERLAP = 64
+
+TextChunk = namedtuple("TextChunk", ["content", "n_tokens"])
+
+
+def split_into_chunks(
+    text: str, encoding, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP
+) -> list[TextChunk]:
+    """
+    Split text into windows of up to max_tokens tokens, consecutive windows
+    share overlap tokens so passages cut at a boundary are found in either one
+    """
+    if overlap >= max_tokens:
+        raise ValueError(
+            f"overlap ({overlap}) must be smaller than max_tokens ({max_tokens})"
+        )
+
+    tokens = encoding.encode(text, disallowed_special=())
+    chunks = []
+
+    for start in range(0, len(tokens), max_tokens - overlap):
+        window = tokens[start : start + max_tokens]
+        content = encoding.decode(window).strip()
+
+        if content:
+            chunks.append(TextChunk(content, len(window)))
+
+        if start + max_tokens >= len(tokens):
+            break
+
+    return chunks
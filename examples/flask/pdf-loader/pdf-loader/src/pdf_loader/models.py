@@ -5,12 +5,19 @@ from sqlalchemy import (
     DateTime,
     Text,
     func,
-    CheckConstraint,
+    ForeignKey,
+    DDL,
+    event,
+)
+from sqlalchemy.orm import (
+    DeclarativeBase,
+    Mapped,
+    mapped_column,
+    relationship,
+    joinedload,
 )
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy.types import TypeDecorator, BLOB
 from sqlite_vec import serialize_float32
-from sqlalchemy import text
+from sqlalchemy import text, select
 from werkzeug.security import generate_password_hash, check_password_hash
 import enum
 
@@ -37,25 +44,6 @@ class User(Base):
         return check_password_hash(self.password_hash, password)
 
 
-class FloatArray(TypeDecorator):
-    """Custom type for SQLite float array stored as BLOB"""
-
-    impl = BLOB
-    cache_ok = True
-
-    def process_bind_param(self, value, dialect):
-        # Convert float array to BLOB when saving
-        if value is None:
-            return None
-        return serialize_float32(value)
-
-    def process_result_value(self, value, dialect):
-        # Convert BLOB back to float array when loading
-        if value is None:
-            return None
-        return value
-
-
 class DocumentStatus(enum.Enum):
     PENDING = "pending"
     PROCESSING = "processing"
@@ -69,33 +57,93 @@ class Document(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     content: Mapped[str] = mapped_column(Text, nullable=True)
-    embedding: Mapped[bytes] = mapped_column(FloatArray, nullable=True)
     status: Mapped[DocumentStatus] = mapped_column(nullable=False)
+    chunks: Mapped[list["Chunk"]] = relationship(
+        back_populates="document", order_by="Chunk.position"
+    )
+
+
+# embeddings of text-embedding-3-small
+EMBEDDING_DIMENSIONS = 1536
+
+
+class Chunk(Base):
+    """A passage of a document, its embedding is stored in chunks_vec"""
+
+    __tablename__ = "chunks"
 
-    __table_args__ = (
-        CheckConstraint(
-            "embedding IS NULL OR (typeof(embedding) = 'blob' AND vec_length(embedding) = 1536)",
-            name="check_embedding_type_and_length",
-        ),
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    document_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("documents.id"), nullable=False, index=True
     )
+    position: Mapped[int] = mapped_column(Integer, nullable=False)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    n_tokens: Mapped[int] = mapped_column(Integer, nullable=False)
+    document: Mapped[Document] = relationship(back_populates="chunks")
+
+    @classmethod
+    def add_embeddings(cls, session, chunks, embeddings):
+        """Index the embeddings of chunks (they must have been flushed)"""
+        if not chunks:
+            return
+
+        session.execute(
+            text("INSERT INTO chunks_vec (rowid, embedding) VALUES (:id, :embedding)"),
+            [
+                {"id": chunk.id, "embedding": serialize_float32(embedding)}
+                for chunk, embedding in zip(chunks, embeddings)
+            ],
+        )
+
+    @classmethod
+    def delete_for_document(cls, session, document_id):
+        """Delete the chunks of a document and their embeddings"""
+        session.execute(
+            text(
+                """
+                DELETE FROM chunks_vec
+                WHERE rowid IN (SELECT id FROM chunks WHERE document_id = :id)
+                """
+            ),
+            {"id": document_id},
+        )
+        session.query(cls).filter(cls.document_id == document_id).delete()
 
     @classmethod
-    def find_similar(cls, session, embedding, limit: int = None):
+    def find_similar(cls, session, embedding, limit: int = 10):
+        """
+        Return up to limit chunks closest to embedding, closest first. Chunks
+        deleted since the search (e.g., by a concurrent reindex) are skipped
+        """
         query = text(
             """
-            SELECT id, vec_distance_L2(embedding, :embedding) as distance
-            FROM documents
+            SELECT rowid, distance
+            FROM chunks_vec
+            WHERE embedding MATCH :embedding AND k = :limit
             ORDER BY distance
             """
-            + (f"LIMIT {limit}" if limit else "")
         )
 
-        result = session.execute(query, {"embedding": serialize_float32(embedding)})
+        result = session.execute(
+            query, {"embedding": serialize_float32(embedding), "limit": limit}
+        )
+        ids = [row.rowid for row in result]
+
+        # load them (and their documents) at once
+        chunks = session.scalars(
+            select(cls).where(cls.id.in_(ids)).options(joinedload(cls.document))
+        )
+        chunks = {chunk.id: chunk for chunk in chunks}
+
+        return [chunks[id_] for id_ in ids if id_ in chunks]
 
-        # Fetch the actual Document objects and pair them with their distances
-        documents_with_distances = []
-        for row in result:
-            document = session.get(cls, row.id)
-            documents_with_distances.append(document)
 
-        return documents_with_distances
+# nearest neighbour search over the chunks' embeddings, rowid is chunks.id
+event.listen(
+    Chunk.__table__,
+    "after_create",
+    DDL(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_vec USING vec0("
+        f"embedding float[{EMBEDDING_DIMENSIONS}])"
+    ),
+)